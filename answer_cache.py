@@ -0,0 +1,136 @@
+import collections
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def checkpoint_version(checkpoint_path, settings=None):
+    '''Identifies a checkpoint by its path and the modification times of its
+       files, along with any settings that change answers, so that cached
+       answers are dropped when the model is retrained.
+    '''
+    files = sorted(glob.glob(checkpoint_path + '*'))
+    stamp = [(os.path.basename(f), os.path.getmtime(f)) for f in files]
+    return hashlib.sha1(json.dumps([checkpoint_path, stamp, settings], sort_keys=True)
+                        .encode('utf-8')).hexdigest()
+
+
+def to_list(x):
+    return x.tolist() if hasattr(x, 'tolist') else x
+
+
+class AnswerCache:
+    '''A bounded LRU cache of answers, keyed by the question and passages as
+       the reader sees them (normalized tokens or token ids) and the model
+       version. With a path, answers are also kept in a SQLite database so
+       they survive restarts; entries from other model versions are deleted
+       when it is opened. Writes to it are committed, and the least recently
+       used entries over disk_capacity evicted, every commit_every writes
+       or commit_seconds, and on close.
+    '''
+
+    def __init__(self, capacity, model_version, path=None, disk_capacity=None, commit_every=1000,
+                 commit_seconds=10.0):
+        self.capacity = capacity
+        self.model_version = model_version
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.db = None
+        self.disk_capacity = disk_capacity or 10 * capacity
+        self.commit_every = commit_every
+        self.commit_seconds = commit_seconds
+        self.pending = 0
+        self.committed = time.time()
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS answers '
+                            '(key TEXT PRIMARY KEY, version TEXT, value TEXT, used REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS answers_used ON answers (used)')
+            self.db.execute('DELETE FROM answers WHERE version != ?', (model_version,))
+            self.db.commit()
+
+    def key(self, question, passages):
+        '''question is a list of tokens or ids, passages a list of such lists.'''
+        content = json.dumps([self.model_version, to_list(question), [to_list(p) for p in passages]],
+                             separators=(',', ':'))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+
+            if self.db is not None:
+                row = self.db.execute('SELECT value FROM answers WHERE key = ? AND version = ?',
+                                      (key, self.model_version)).fetchone()
+                if row is not None:
+                    self.db.execute('UPDATE answers SET used = ? WHERE key = ?', (time.time(), key))
+                    self.wrote()
+                    value = json.loads(row[0])
+                    self.insert(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def insert(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key, value):
+        with self.lock:
+            self.insert(key, value)
+
+            if self.db is not None:
+                self.db.execute('INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?)',
+                                (key, self.model_version, json.dumps(value), time.time()))
+                self.wrote()
+
+    def wrote(self):
+        self.pending += 1
+        if self.pending >= self.commit_every or time.time() - self.committed >= self.commit_seconds:
+            self.commit()
+
+    def commit(self):
+        '''Evicts the least recently used entries over disk_capacity, walking
+           the index on used, and commits.
+        '''
+        size = self.db.execute('SELECT COUNT(*) FROM answers').fetchone()[0]
+        if size > self.disk_capacity:
+            self.db.execute('DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY used LIMIT ?)',
+                            (size - self.disk_capacity,))
+        self.db.commit()
+        self.pending = 0
+        self.committed = time.time()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.entries), 'evictions': self.evictions}
+
+    def close(self):
+        if self.db is not None:
+            with self.lock:
+                self.commit()
+                self.db.close()
+                self.db = None
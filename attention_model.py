@@ -1,6 +1,6 @@
 import tensorflow as tf
-from tensorflow.contrib.rnn import DropoutWrapper
-from tensorflow.contrib.rnn import GRUCell
+
+import rnn_cells
 
 
 class Model:
@@ -10,6 +10,7 @@ class Model:
         self.max_x = max_x
         self.max_q = max_q
         self.saver = None
+        self.cell = config.cell or 'gru'
 
     def build(self, x, x_len, q, q_len, y_begin, y_end, emb_mat, keep_prob):
        
@@ -19,18 +20,15 @@ class Model:
         with tf.variable_scope('embedding_question'):
             question = tf.nn.embedding_lookup(emb_mat, q, name='question')
 
-        cell = GRUCell(self.dim)
-        d_cell = DropoutWrapper(cell, input_keep_prob=keep_prob)  # to avoid over-fitting
-        
         with tf.variable_scope('encoding'):
-            outputs_context, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=context, sequence_length=x_len, dtype=tf.float32)
+            outputs_context = rnn_cells.bidirectional_rnn(self.cell, self.dim, context, x_len, keep_prob)
             context_fw, context_bw = outputs_context
             context_output = tf.concat([context_fw, context_bw], axis=2)
             tf.summary.histogram('context_output', context_output)
 
             tf.get_variable_scope().reuse_variables()
 
-            outputs_question, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=question, sequence_length=q_len, dtype=tf.float32)
+            outputs_question = rnn_cells.bidirectional_rnn(self.cell, self.dim, question, q_len, keep_prob)
             question_fw, question_bw = outputs_question
             question_output = tf.concat([question_fw, question_bw], axis=2)
             tf.summary.histogram('question_output', question_output)
@@ -52,7 +50,7 @@ class Model:
         xq = tf.concat([context_output, sum_q, context_output * sum_q], axis=2)
 
         with tf.variable_scope('post_process'):
-            outputs_xq, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=xq, sequence_length=x_len, dtype=tf.float32)
+            outputs_xq = rnn_cells.bidirectional_rnn(self.cell, self.dim, xq, x_len, keep_prob)
             xq_fw, xq_bw = outputs_xq
             xq_output = tf.concat([xq_fw, xq_bw], axis=2)
             tf.summary.histogram('xq_output', xq_output)
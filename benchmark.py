@@ -0,0 +1,232 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval', 'bleu'))
+
+from bleu.bleu import Bleu
+from rouge.rouge import Rouge
+
+import main
+import rnn_cells
+import synthetic_data
+from data import Data
+
+
+MODELS = ['baseline', 'attention', 'coattention', 'bidaf']
+BENCHMARKS = ['data', 'models', 'eval']
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks data loading, the models and the evaluation '
+                                                 'metrics on a synthetic dataset.')
+    parser.add_argument('--benchmarks', '-bm', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--models', '-m', nargs='+', default=MODELS, choices=MODELS)
+    parser.add_argument('--cells', '-c', nargs='+', default=[None], choices=rnn_cells.CELLS) # each model's own by default
+    parser.add_argument('--steps', '-s', type=int, default=20)
+    parser.add_argument('--batch_size', '-b', type=int, default=32)
+    parser.add_argument('--hidden_size', '-hs', type=int, default=50)
+    parser.add_argument('--data_dir', '-d', default='./benchmarks/synthetic')
+    parser.add_argument('--queries', '-n', type=int, default=500)
+    parser.add_argument('--passages', '-p', type=int, default=10)
+    parser.add_argument('--passage_length', '-pl', type=int, default=60)
+    parser.add_argument('--output', '-o', default='./benchmarks/results.json')
+    parser.add_argument('--baseline', '-bl', default='./benchmarks/baseline.json')
+    parser.add_argument('--save_baseline', '-sb', type=int, default=0)
+    parser.add_argument('--tolerance', '-tol', type=float, default=0.2) # allowed slowdown
+
+    return parser
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def record(results, name, seconds, count, unit):
+    results[name] = {'seconds': seconds, 'count': int(count), 'unit': unit, 'rate': count / seconds}
+    print('{:32} {:12.1f} {}/sec'.format(name, count / seconds, unit))
+
+
+def get_settings(args):
+    '''Everything that changes what is being measured, so that results are
+       only compared against a baseline produced the same way.
+    '''
+    return {'queries': args.queries, 'passages': args.passages, 'passage_length': args.passage_length,
+            'batch_size': args.batch_size, 'hidden_size': args.hidden_size, 'steps': args.steps}
+
+
+def generate_data(args):
+    generator_args = synthetic_data.get_parser().parse_args(
+        [args.data_dir, '--queries', str(args.queries), '--passages', str(args.passages),
+         '--passage_length', str(args.passage_length)])
+    return synthetic_data.SyntheticMsmarco(generator_args).generate()
+
+
+def get_config(args, paths):
+    config = main.get_parser().parse_args(['--batch_size', str(args.batch_size),
+                                           '--hidden_size', str(args.hidden_size)])
+    config.train_path = paths['train']
+    config.val_path = paths['dev']
+    config.test_path = paths['test']
+    config.glove_path = paths['glove']
+    return config
+
+
+def benchmark_data(config, results):
+    data, seconds = timed(Data, config)
+    record(results, 'data/init', seconds, len(data.tX) + len(data.vX) + len(data.temX), 'queries')
+
+    split, seconds = timed(lambda: data.splitMsmarcoDatasets(data.importMsmarco(config.train_path)))
+    record(results, 'data/load_tokenize', seconds, len(split[0]), 'passages')
+
+    split, seconds = timed(lambda: data.splitMsmarcoDatasetsTest(data.importMsmarco(config.val_path)))
+    record(results, 'data/load_tokenize_multi', seconds, sum(len(p) for p in split[0]), 'passages')
+
+    word_index = dict((w, i) for i, w in enumerate(data.vocab))
+    _, seconds = timed(data.vectorizeData, data.tContext, data.tQuestion, data.tAnswerBegin, data.tAnswerEnd,
+                       word_index, data.max_context_size, data.max_ques_size)
+    record(results, 'data/vectorize', seconds, sum(len(c) for c in data.tContext), 'tokens')
+
+    _, seconds = timed(data.vectorizeDataMutli, data.vmContext, data.vmQuestion, word_index,
+                       data.max_context_size, data.max_ques_size)
+    record(results, 'data/vectorize_multi', seconds, sum(len(p) for c in data.vmContext for p in c), 'tokens')
+
+    _, seconds = timed(data.passageRevelevance, data.vmContext, data.vmQuestion)
+    record(results, 'data/passage_relevance', seconds, len(data.vmContext), 'queries')
+
+    return data
+
+
+def benchmark_model(config, data, results, steps, name):
+    tf.reset_default_graph()
+    model = main.get_model(config, data)
+    placeholders = main.build_graph(config, data, model)
+    train_step = tf.train.AdamOptimizer(config.learning_rate).minimize(model.loss)
+
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+
+        # The first runs pay for allocating buffers, so are left out
+        train_batches = [main.get_feed(placeholders, data.getRandomTrainBatch(), 't', config.keep_prob)
+                         for _ in range(steps + 1)]
+        sess.run(train_step, feed_dict=train_batches[0])
+        start = time.perf_counter()
+        for feed_dict in train_batches[1:]:
+            sess.run(train_step, feed_dict=feed_dict)
+        record(results, 'train/' + name, time.perf_counter() - start, steps * config.batch_size, 'examples')
+
+        val_batches = [main.get_feed(placeholders, data.getRandomValBatch(), 'v', 1.0)
+                       for _ in range(steps + 1)]
+        sess.run([model.logits1, model.logits2], feed_dict=val_batches[0])
+        start = time.perf_counter()
+        for feed_dict in val_batches[1:]:
+            sess.run([model.logits1, model.logits2], feed_dict=feed_dict)
+        record(results, 'inference/' + name, time.perf_counter() - start, steps * config.batch_size, 'examples')
+
+
+def benchmark_eval(data, results):
+    # Score spans of the selected passages against the real answers
+    rng = random.Random(0)
+    references = {}
+    candidates = {}
+    for i, context in enumerate(data.tContext):
+        start = rng.randrange(len(context))
+        references[i] = [data.tAnswerText[i].lower()]
+        candidates[i] = [' '.join(context[start:start + rng.randint(1, 20)])]
+
+    _, seconds = timed(Bleu(4).compute_score, references, candidates)
+    record(results, 'eval/bleu', seconds, len(references), 'pairs')
+
+    _, seconds = timed(Rouge().compute_score, references, candidates)
+    record(results, 'eval/rouge', seconds, len(references), 'pairs')
+
+
+def compare(results, baseline, tolerance):
+    '''Prints the change in throughput against the baseline and returns the
+       benchmarks that slowed down by more than the tolerance.
+    '''
+    regressions = []
+    print('{:32} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline', 'current', 'change'))
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            print('{:32} {:>12} {:12.1f}'.format(name, '-', result['rate']))
+            continue
+
+        change = result['rate'] / baseline[name]['rate'] - 1
+        regressed = change < -tolerance
+        if regressed:
+            regressions.append(name)
+        print('{:32} {:12.1f} {:12.1f} {:+8.1%}{}'.format(name, baseline[name]['rate'], result['rate'], change,
+                                                          '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main_benchmark():
+    args = get_parser().parse_args()
+    np.random.seed(0)
+
+    print('Generating synthetic data in {}...'.format(args.data_dir))
+    paths = generate_data(args)
+    config = get_config(args, paths)
+
+    results = {}
+    data = benchmark_data(config, results) if 'data' in args.benchmarks else Data(config)
+
+    if 'models' in args.benchmarks:
+        for model in args.models:
+            for cell in args.cells:
+                config.model = model
+                config.cell = cell
+                name = model if cell is None else '{}/{}'.format(model, cell)
+                benchmark_model(config, data, results, args.steps, name)
+
+    if 'eval' in args.benchmarks:
+        benchmark_eval(data, results)
+
+    report = {
+        'settings': get_settings(args),
+        'environment': {'python': platform.python_version(), 'tensorflow': tf.__version__,
+                        'machine': platform.machine(), 'processor': platform.processor(),
+                        'cpus': os.cpu_count()},
+        'results': results,
+    }
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('Saved baseline to {}'.format(args.baseline))
+        return
+
+    if not os.path.exists(args.baseline):
+        print('No baseline at {}, run with --save_baseline 1 to create one'.format(args.baseline))
+        return
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline['settings'] != report['settings']:
+        print('Warning: baseline was recorded with different settings: {}'.format(baseline['settings']))
+
+    regressions = compare(results, baseline['results'], args.tolerance)
+    if regressions:
+        print('{} benchmarks regressed by more than {:.0%}'.format(len(regressions), args.tolerance))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_benchmark()
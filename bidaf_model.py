@@ -1,7 +1,6 @@
 import tensorflow as tf
-from tensorflow.contrib.rnn import DropoutWrapper
-from tensorflow.contrib.rnn import LSTMCell
-from tensorflow.contrib.rnn import GRUCell
+
+import rnn_cells
 
 
 class Model:
@@ -11,7 +10,7 @@ class Model:
         self.max_x = max_x
         self.max_q = max_q
         self.saver = None
-        self.cell = config.cell
+        self.cell = config.cell or 'lstm'
         self.highway_network_use = config.highway_network
         self.batch_size = config.batch_size
 
@@ -41,21 +40,15 @@ class Model:
                 tf.summary.histogram('context', context)
                 tf.summary.histogram('question', question)
 
-        if self.cell == 'gru':
-            cell = GRUCell(self.dim)
-        else:
-            cell = LSTMCell(self.dim)
-        d_cell = DropoutWrapper(cell, input_keep_prob=keep_prob)  # to avoid over-fitting
-
         with tf.variable_scope('encoding'):
-            outputs_question, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=question, sequence_length=q_len, dtype=tf.float32)
+            outputs_question = rnn_cells.bidirectional_rnn(self.cell, self.dim, question, q_len, keep_prob)
             question_fw, question_bw = outputs_question
             question_output = tf.concat([question_fw, question_bw], axis=2)  # [N, MQ, 2d]
             tf.summary.histogram('question_output', question_output)
 
             tf.get_variable_scope().reuse_variables()
 
-            outputs_context, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=context, sequence_length=x_len, dtype=tf.float32)
+            outputs_context = rnn_cells.bidirectional_rnn(self.cell, self.dim, context, x_len, keep_prob)
             context_fw, context_bw = outputs_context
             context_output = tf.concat([context_fw, context_bw], axis=2)  # [N, MX, 2d]
             tf.summary.histogram('context_output', context_output)
@@ -85,12 +78,12 @@ class Model:
         xq = tf.concat([context_output, sum_q, context_output * sum_q, context_output * sum_x], axis=2)
 
         with tf.variable_scope('post_process_1'):
-            outputs_xq_1, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=xq, sequence_length=x_len, dtype=tf.float32)
+            outputs_xq_1 = rnn_cells.bidirectional_rnn(self.cell, self.dim, xq, x_len, keep_prob)
             xq_fw_1, xq_bw_1 = outputs_xq_1
             xq_output_1 = tf.concat([xq_fw_1, xq_bw_1], axis=2)  # [N, MX, 2d]
 
         with tf.variable_scope('post_process_2'):
-            outputs_xq_2, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=xq_output_1, sequence_length=x_len, dtype=tf.float32)
+            outputs_xq_2 = rnn_cells.bidirectional_rnn(self.cell, self.dim, xq_output_1, x_len, keep_prob)
             xq_fw_2, xq_bw_2 = outputs_xq_2
             xq_output_2 = tf.concat([xq_fw_2, xq_bw_2], axis=2)  # [N, MX, 2d]
             tf.summary.histogram('xq_output', xq_output_2)
@@ -107,7 +100,7 @@ class Model:
         with tf.variable_scope('end_index'):
             a1i = tf.tile(tf.expand_dims(logits_start, 2), [1, 1, 2 * self.dim])
             inputs = tf.concat([xq, xq_output_2, a1i, xq_output_2 * a1i], axis=2)
-            outputs_xq_end, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=inputs, sequence_length=x_len, dtype=tf.float32)
+            outputs_xq_end = rnn_cells.bidirectional_rnn(self.cell, self.dim, inputs, x_len, keep_prob)
             xq_fw_end, xq_bw_end = outputs_xq_end
             
             xq_output_end = tf.concat([xq_fw_end, xq_bw_end], axis=2)  # [N, MX, 2d]
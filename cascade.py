@@ -0,0 +1,134 @@
+import json
+import time
+
+import numpy as np
+
+
+def select_passages(weights, top_k=0, threshold=0.0):
+    '''Indices of the passages to send to the reader, in their original
+       order: the top_k by relevance weight (all of them if top_k is 0) that
+       also have a weight of at least threshold. The most relevant passage is
+       always kept, so every query gets an answer.
+    '''
+    weights = np.asarray(weights, dtype=float)
+    if len(weights) == 0:
+        return []
+
+    order = np.argsort(-weights, kind='mergesort')
+    if top_k:
+        order = order[:top_k]
+    keep = order[weights[order] >= threshold]
+    if len(keep) == 0:
+        keep = order[:1]
+    return sorted(keep.tolist())
+
+
+def sweep(weights, selected, costs, max_k=10):
+    '''Recall of the selected passages and the speedup of the reader from
+       keeping the top k passages by weight, for k = 1..max_k.
+
+       weights, selected and costs hold one list per query, with the
+       relevance weight, is_selected flag and reader cost (e.g. number of
+       windows) of each passage. Queries without a selected passage don't
+       count towards recall.
+    '''
+    queries = len(weights)
+    max_passages = max((len(w) for w in weights), default=0)
+    max_k = min(max_k, max_passages)
+
+    # Pad to a [queries, passages] matrix, with padding ranked last
+    padded_weights = np.full((queries, max_passages), -np.inf)
+    padded_selected = np.zeros((queries, max_passages), dtype=bool)
+    padded_costs = np.zeros((queries, max_passages))
+    for i in range(queries):
+        n = len(weights[i])
+        padded_weights[i, :n] = weights[i]
+        padded_selected[i, :n] = np.asarray(selected[i][:n]) > 0
+        padded_costs[i, :n] = costs[i]
+
+    order = np.argsort(-padded_weights, axis=1, kind='mergesort')
+    rows = np.arange(queries)[:, None]
+    ranked_selected = padded_selected[rows, order]
+    ranked_costs = padded_costs[rows, order]
+
+    has_selected = padded_selected.any(axis=1)
+    # Rank of the best ranked selected passage of each query
+    first_selected = np.argmax(ranked_selected, axis=1)
+    total_cost = padded_costs.sum()
+    cumulative_cost = np.cumsum(ranked_costs, axis=1).sum(axis=0)
+
+    results = []
+    for k in range(1, max_k + 1):
+        recall = float(np.mean(first_selected[has_selected] < k)) if has_selected.any() else 0.0
+        results.append({'top_k': k,
+                        'recall': recall,
+                        'passages_read': float(np.mean(np.minimum([len(w) for w in weights], k))),
+                        'speedup': float(total_cost / cumulative_cost[k - 1])})
+    return results
+
+
+class CascadeReport:
+    '''Counts the passages the reader skipped, whether the selected passage
+       survived the cut, and the time spent in the reader. Queries answered
+       from the answer cache never reach the reader and are only counted.
+    '''
+
+    def __init__(self, top_k, threshold):
+        self.top_k = top_k
+        self.threshold = threshold
+        self.queries = 0
+        self.cached_queries = 0
+        self.queries_with_selected = 0
+        self.selected_kept = 0
+        self.passages = 0
+        self.passages_read = 0
+        self.cost = 0
+        self.cost_read = 0
+        self.reader_time = 0.0
+        self.reader_start = None
+
+    def start_reader(self):
+        self.reader_start = time.perf_counter()
+
+    def end_reader(self):
+        self.reader_time += time.perf_counter() - self.reader_start
+
+    def add_query(self, kept, selected, costs):
+        self.queries += 1
+        self.passages += len(costs)
+        self.passages_read += len(kept)
+        self.cost += sum(costs)
+        self.cost_read += sum(costs[p] for p in kept)
+
+        if any(selected):
+            self.queries_with_selected += 1
+            if any(selected[p] for p in kept):
+                self.selected_kept += 1
+
+    def add_cached_query(self):
+        self.cached_queries += 1
+
+    def report(self):
+        return {
+            'top_k': self.top_k,
+            'threshold': self.threshold,
+            'queries': self.queries,
+            'cached_queries': self.cached_queries,
+            'recall': self.selected_kept / max(self.queries_with_selected, 1),
+            'passages_per_query': self.passages / max(self.queries, 1),
+            'passages_read_per_query': self.passages_read / max(self.queries, 1),
+            'speedup': self.cost / max(self.cost_read, 1),
+            'reader_seconds': self.reader_time,
+            'reader_ms_per_query': 1000 * self.reader_time / max(self.queries, 1),
+        }
+
+    def write_report(self, path, question_type, sweep_results):
+        report = self.report()
+        report['question_type'] = question_type
+        report['sweep'] = sweep_results
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+        print('Cascade kept {:.1f} of {:.1f} passages per query, recall {:.1%}, {:.2f}x less reader work'
+              .format(report['passages_read_per_query'], report['passages_per_query'], report['recall'],
+                      report['speedup']))
@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def window_starts(length, window_size, stride):
+    '''Offsets of overlapping windows of window_size tokens, stride apart,
+       covering a passage of length tokens. The last window is moved back to
+       end at the end of the passage, so no window is shorter than needed.
+    '''
+    if length <= window_size:
+        return [0]
+
+    starts = list(range(0, length - window_size, stride))
+    starts.append(length - window_size)
+    return starts
+
+
+def split_windows(tokens, window_size, stride):
+    '''Returns the offsets and tokens of each window of a passage.'''
+    starts = window_starts(len(tokens), window_size, stride)
+    return starts, [tokens[start:start + window_size] for start in starts]
+
+
+def answer_window(starts, window_size, begin, end):
+    '''Index of the window that contains the whole answer span with the most
+       context on either side of it, or None if no window contains it.
+    '''
+    best_window = None
+    best_margin = -1
+    for i, start in enumerate(starts):
+        if begin < start or end >= start + window_size:
+            continue
+        margin = min(begin - start, start + window_size - 1 - end)
+        if margin > best_margin:
+            best_window = i
+            best_margin = margin
+    return best_window
+
+
+def merge_window_scores(starts, window_scores, length):
+    '''Combines per token scores (e.g. start probabilities) predicted for each
+       window into scores for the whole passage, taking the maximum over the
+       windows that overlap each token. window_scores may be padded.
+    '''
+    merged = np.full(length, -np.inf)
+    for start, scores in zip(starts, window_scores):
+        end = min(start + len(scores), length)
+        merged[start:end] = np.maximum(merged[start:end], scores[:end - start])
+    return merged
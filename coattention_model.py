@@ -1,8 +1,8 @@
 import tensorflow as tf
-from tensorflow.contrib.rnn import DropoutWrapper
-from tensorflow.contrib.rnn import GRUCell, LSTMCell
 import numpy as np
 
+import rnn_cells
+
 # Attempt at recreating: https://arxiv.org/pdf/1611.01604.pdf
 class Model:
     def __init__(self, config, max_x, max_q):
@@ -12,6 +12,7 @@ class Model:
         self.max_x = max_x
         self.max_q = max_q
         self.saver = None
+        self.cell = config.cell or 'lstm'
 
     def build(self, x, x_len, q, q_len, y_begin, y_end, emb_mat, keep_prob):        
         with tf.variable_scope('embedding'):
@@ -19,21 +20,18 @@ class Model:
             question = tf.nn.embedding_lookup(emb_mat, q, name='question') # (batch_size, max_q, emb_size)
 
         with tf.variable_scope('encoding') as scope:
-            lstm_enc = LSTMCell(self.hidden_size) 
-            lstm_enc = DropoutWrapper(lstm_enc, input_keep_prob=keep_prob)
-        
             # Add sentinel to end of encodings
             sentinel = tf.get_variable('sentinel', [1, self.hidden_size], dtype=tf.float32)
             fn = lambda x: tf.concat([x, sentinel], axis=0)
 
-            D, _ = tf.nn.dynamic_rnn(lstm_enc, context, sequence_length=x_len, dtype=tf.float32) # (batch_size, max_x, hidden_size)
+            D, _ = rnn_cells.dynamic_rnn(self.cell, self.hidden_size, context, x_len, keep_prob) # (batch_size, max_x, hidden_size)
             D = tf.map_fn(lambda x: fn(x), D, dtype=tf.float32)
             D = tf.transpose(D, perm=[0, 2, 1]) # (batch_size, hidden_size, max_x)            
             tf.summary.histogram('D', D)
 
             scope.reuse_variables()
 
-            Q, _ = tf.nn.dynamic_rnn(lstm_enc, question, sequence_length=q_len, dtype=tf.float32) # (batch_size, max_q, hidden_size)
+            Q, _ = rnn_cells.dynamic_rnn(self.cell, self.hidden_size, question, q_len, keep_prob) # (batch_size, max_q, hidden_size)
             Q = tf.map_fn(lambda x: fn(x), Q, dtype=tf.float32)
             Q = tf.transpose(Q, perm=[0, 2, 1]) # (batch_size, hidden_size, max_q)
             tf.summary.histogram('Q', Q)   
@@ -58,15 +56,10 @@ class Model:
             tf.summary.histogram('Cd', Cd)
         
         with tf.variable_scope('encoding_understanding'):
-            lstm_fw_cell = LSTMCell(self.hidden_size)
-            lstm_bw_cell = LSTMCell(self.hidden_size)
-            lstm_fw_cell = DropoutWrapper(lstm_fw_cell, input_keep_prob=keep_prob)
-            lstm_bw_cell = DropoutWrapper(lstm_bw_cell, input_keep_prob=keep_prob)
-
             inputs_ = tf.concat([D, Cd], axis=1) # (batch_size, 3*hidden_size, max_x)
             inputs_ = tf.transpose(inputs_, perm=[0, 2, 1]) # (batch_size, max_x, 3*hidden_size)
 
-            u, _ = tf.nn.bidirectional_dynamic_rnn(lstm_fw_cell, lstm_bw_cell, inputs=inputs_, sequence_length=x_len, dtype=tf.float32) # (batch_size, max_x, hidden_size)
+            u = rnn_cells.bidirectional_rnn(self.cell, self.hidden_size, inputs_, x_len, keep_prob) # (batch_size, max_x, hidden_size)
     
             U = tf.concat(u, axis=2) # (batch_size, max_x, 2*hidden_size)
             tf.summary.histogram('U', U)
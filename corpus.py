@@ -0,0 +1,28 @@
+import os
+
+import numpy as np
+
+
+def chunk_ranges(path, chunk_bytes):
+    '''Byte ranges of about chunk_bytes covering a plain file, starting and
+       ending on line boundaries, for workers to read themselves.
+    '''
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def bm25_idf(document_frequencies, passage_count):
+    return np.log(1. + (passage_count - document_frequencies + 0.5) / (document_frequencies + 0.5))
+
+
+def bm25(idf, frequencies, lengths, average_length, k1, b):
+    return idf * frequencies * (k1 + 1) / (frequencies + k1 * (1 - b + b * lengths / average_length))
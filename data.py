@@ -1,3 +1,4 @@
+import bisect
 import json, math
 import numpy as np
 import os
@@ -6,9 +7,82 @@ from tqdm import tqdm
 import re
 import string
 
+import chunking
+from demo_export import DemoWriter
+from sentence_filter import SentenceFilter
+
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import linear_kernel
 
+def get_unknown_classes(smart_unk):
+    '''Patterns that words missing from GloVe are bucketed by, in order. The padding index comes after them.'''
+    if smart_unk:
+        return [re.compile('\d+'), # contains a number
+                re.compile('^[\s{}]+$'.format(re.escape(string.punctuation))), # punctuation
+                re.compile('^[a-z]+$'), # misspelled word
+                re.compile('.*')] # catch all
+    else:
+        return [re.compile('.*')]
+
+def tokenize(sent):
+    '''Return the tokens of a context including punctuation. Wrapper around nltk.word_tokenize to
+       fix weird quotation marks.
+    '''
+    tokens = []
+    for token in nltk.word_tokenize(sent):
+        token = token.replace("``", '"').replace("''", '"').replace('’', "'").replace('‘', "'").replace('”', '"').replace('“', '"')
+        tokens.append(token)
+    return tokens
+
+def passage_weights(passages, question):
+    '''TF-IDF cosine similarity of each tokenized passage to the question, normalized to sum to 1.'''
+    passages = [' '.join(p) for p in passages]
+
+    tfidf = TfidfVectorizer(stop_words='english', binary=True).fit_transform([' '.join(question)] + passages)
+    cosine_similarities = linear_kernel(tfidf[0:1], tfidf).flatten()[1:]
+
+    # Normalize
+    sum_cs = sum(cosine_similarities)
+    if sum_cs > 0:
+        cosine_similarities = [x / sum_cs for x in cosine_similarities]
+    else:
+        cosine_similarities = [1.0 / len(passages) for _ in range(len(passages))]
+
+    return cosine_similarities
+
+class EvalAnswerWriter:
+    '''Writes reference and candidate answers in the JSONL format of
+       eval/ms_marco_eval.py one query at a time. flush() after each batch
+       makes the answers so far readable while the rest of the split runs.
+    '''
+
+    def __init__(self, referencePath, candidatePath, referenceAnswers):
+        self.referenceAnswers = referenceAnswers
+        self.rf = open(referencePath, 'w', encoding='utf-8')
+        self.cf = open(candidatePath, 'w', encoding='utf-8')
+
+    def write(self, questionID, context, predictedBegin, predictedEnd):
+        predictedAnswer = ' '.join(context[predictedBegin : predictedEnd + 1])
+
+        reference = {}
+        candidate = {}
+        reference['query_id'] = questionID
+        reference['answers'] = [self.referenceAnswers[questionID]]
+
+        candidate['query_id'] = questionID
+        candidate['answers'] = [predictedAnswer]
+
+        print(json.dumps(reference, ensure_ascii=False), file=self.rf)
+        print(json.dumps(candidate, ensure_ascii=False), file=self.cf)
+
+    def flush(self):
+        self.rf.flush()
+        self.cf.flush()
+
+    def close(self):
+        self.rf.close()
+        self.cf.close()
+
 class Data:
     def __init__(self, config):
         self.config = config
@@ -16,14 +90,10 @@ class Data:
         self.keep_prob = config.keep_prob
         self.valBatchNum = 0
         self.testBatchNum = 0
+        # Tokens of the file being split, by (query id, field, index), written by split_data.py --tokenize
+        self.tokenCache = {}
 
-        if config.smart_unk:
-            self.unknown_classes = [re.compile('\d+'), # contains a number
-                                    re.compile('^[\s{}]+$'.format(re.escape(string.punctuation))), # punctuation
-                                    re.compile('^[a-z]+$'), # misspelled word
-                                    re.compile('.*')] # catch all
-        else:
-            self.unknown_classes = [re.compile('.*')]
+        self.unknown_classes = get_unknown_classes(config.smart_unk)
 
         print('Preparing embedding matrix.')
 
@@ -41,14 +111,17 @@ class Data:
 
         # load validation for eval data, parse, and split
         valEvalData = self.importMsmarco(config.val_path)
-        self.vmContext, self.vmXLen, self.vmQuestion, self.vmXqLen, self.vmQuestionID, self.vmUrl, \
-            self.maxLenVmContext, self.maxLenVmQuestion = self.splitMsmarcoDatasetsTest(valEvalData)
+        self.vmContext, self.vmXLen, self.vmQuestion, self.vmXqLen, self.vmQuestionID, self.vmUrl, self.vmSelected, \
+            self.vmAnswer, self.maxLenVmContext, self.maxLenVmQuestion = self.splitMsmarcoDatasetsTest(valEvalData)
+        # Reference answer of every dev query, so evaluation doesn't have to parse the dev file again
+        self.referenceAnswers = dict(zip(self.vmQuestionID, self.vmAnswer))
 
         # load test data, parse, and split
         print('Loading in testing data...')
         testData = self.importMsmarco(config.test_path)
-        self.temContext, self.temXLen, self.teQuestion, self.teXqLen, self.teQuestionID, self.teUrl, \
-            self.maxLenTeContext, self.maxLenTeQuestion = self.splitMsmarcoDatasetsTest(testData)
+        self.temContext, self.temXLen, self.teQuestion, self.teXqLen, self.teQuestionID, self.teUrl, self.teSelected, \
+            self.teAnswer, self.maxLenTeContext, self.maxLenTeQuestion = self.splitMsmarcoDatasetsTest(testData)
+        self.tokenCache = {}
 
         print('Building vocabulary...')
         # build a vocabulary over all training and validation context paragraphs and question words
@@ -60,11 +133,70 @@ class Data:
 
         self.vocab_size = len(vocab)
         word_index = dict((c, i) for i, c in enumerate(vocab))
+
+        # Only keep the sentences of each context that overlap the question the most. vmPassage and temPassage
+        # hold the passages the reader sees, and vmTokenPosition and temTokenPosition map their tokens back to
+        # positions in vmContext and temContext
+        if config.sentence_filter:
+            print('Keeping the {} best sentences of each context...'.format(config.sentence_filter))
+            sentenceFilter = SentenceFilter(self.tContext + [p for c in self.vmContext for p in c]
+                                            + [p for c in self.temContext for p in c], config.sentence_filter)
+
+            keep, self.tContext, self.tAnswerBegin, self.tAnswerEnd = self.filterAnswerContexts(
+                sentenceFilter, self.tContext, self.tQuestion, self.tAnswerBegin, self.tAnswerEnd)
+            self.tQuestion, self.tXqLen, self.tQuestionID, self.tAnswerText = self.selectExamples(
+                keep, self.tQuestion, self.tXqLen, self.tQuestionID, self.tAnswerText)
+            self.tXLen = [len(c) for c in self.tContext]
+
+            keep, self.vContext, self.vAnswerBegin, self.vAnswerEnd = self.filterAnswerContexts(
+                sentenceFilter, self.vContext, self.vQuestion, self.vAnswerBegin, self.vAnswerEnd)
+            self.vQuestion, self.vXqLen, self.vQuestionID, self.vAnswerText = self.selectExamples(
+                keep, self.vQuestion, self.vXqLen, self.vQuestionID, self.vAnswerText)
+            self.vXLen = [len(c) for c in self.vContext]
+
+            self.vmPassage, self.vmTokenPosition = self.filterPassages(sentenceFilter, self.vmContext, self.vmQuestion)
+            self.temPassage, self.temTokenPosition = self.filterPassages(sentenceFilter, self.temContext, self.teQuestion)
+
+            self.maxLenTContext = max([0] + self.tXLen)
+            self.maxLenVmContext = max([0] + [len(p) for c in self.vmPassage for p in c])
+            self.maxLenTeContext = max([0] + [len(p) for c in self.temPassage for p in c])
+        else:
+            self.vmPassage = self.vmContext
+            self.vmTokenPosition = [[list(range(len(p))) for p in c] for c in self.vmContext]
+            self.temPassage = self.temContext
+            self.temTokenPosition = [[list(range(len(p))) for p in c] for c in self.temContext]
+
         self.max_context_size = max([self.maxLenTContext, self.maxLenVmContext, self.maxLenTeContext])
         self.max_ques_size = max([self.maxLenTQuestion, self.maxLenVmQuestion, self.maxLenTeQuestion])
 
+        # Split long contexts into overlapping windows, so the context size the models are built for
+        # is set by window_size instead of the longest passage in the corpus
+        window_size = config.window_size
+        window_stride = config.window_stride or max(1, window_size // 2)
+        if window_size:
+            print('Splitting contexts into windows of {} tokens...'.format(window_size))
+            self.max_context_size = min(self.max_context_size, window_size)
+
+            keep, self.tContext, self.tAnswerBegin, self.tAnswerEnd = self.windowAnswerContexts(
+                self.tContext, self.tAnswerBegin, self.tAnswerEnd, window_size, window_stride)
+            self.tQuestion, self.tXqLen, self.tQuestionID, self.tAnswerText = self.selectExamples(
+                keep, self.tQuestion, self.tXqLen, self.tQuestionID, self.tAnswerText)
+            self.tXLen = [len(c) for c in self.tContext]
+
+            keep, self.vContext, self.vAnswerBegin, self.vAnswerEnd = self.windowAnswerContexts(
+                self.vContext, self.vAnswerBegin, self.vAnswerEnd, window_size, window_stride)
+            self.vQuestion, self.vXqLen, self.vQuestionID, self.vAnswerText = self.selectExamples(
+                keep, self.vQuestion, self.vXqLen, self.vQuestionID, self.vAnswerText)
+            self.vXLen = [len(c) for c in self.vContext]
+
+        # Every passage of the multi passage splits is a single window when window_size is 0
+        self.vmWindow, self.vmXLen, self.vmWindowPassage, self.vmWindowOffset = self.windowPassages(
+            self.vmPassage, window_size, window_stride)
+        self.temWindow, self.temXLen, self.temWindowPassage, self.temWindowOffset = self.windowPassages(
+            self.temPassage, window_size, window_stride)
+
         # Note: Need to download and unzip Glove pre-train model files into same file as this script
-        embeddings_index = self.loadGloveModel('./datasets/glove/glove.6B.' + str(config.emb_size) + 'd.txt')
+        embeddings_index = self.loadGloveModel(config.glove_path)
         # Cutting down word_index to only include words represented by GloVe embeddings, and updating vocab to only
         # GloVe words
         self.embeddings, word_index = self.createEmbeddingMatrix(embeddings_index, word_index)
@@ -90,11 +222,11 @@ class Data:
                                                      self.max_context_size, self.max_ques_size)
 
         
-        self.vmX, self.vmXq = self.vectorizeDataMutli(self.vmContext, self.vmQuestion, word_index,
+        self.vmX, self.vmXq = self.vectorizeDataMutli(self.vmWindow, self.vmQuestion, word_index,
                                                      self.max_context_size, self.max_ques_size)
 
         print('Vectorizing test data...')
-        self.temX, self.teXq = self.vectorizeDataMutli(self.temContext, self.teQuestion, word_index,
+        self.temX, self.teXq = self.vectorizeDataMutli(self.temWindow, self.teQuestion, word_index,
                                                      self.max_context_size, self.max_ques_size)
 
         print('Vectorizing process completed.')
@@ -115,6 +247,7 @@ class Data:
         self.vmXLen = np.array(self.vmXLen)
         self.vXq = np.array(self.vXq)
         self.vmXq = np.array(self.vmXq)
+        self.vmXqLen = np.array(self.vmXqLen)
         self.vXqLen = np.array(self.vXqLen)
         self.vYBegin = np.array(self.vYBegin)
         self.vYEnd = np.array(self.vYEnd)
@@ -123,7 +256,11 @@ class Data:
         self.vQuestionID = np.array(self.vQuestionID, dtype=object)
         self.vmQuestionID = np.array(self.vmQuestionID, dtype=object)
         self.vmUrl = np.array(self.vmUrl, dtype=object)
+        self.vmSelected = np.array(self.vmSelected, dtype=object)
         self.vmPassWeight = np.array(self.vmPassWeight)
+        self.vmWindowPassage = np.array(self.vmWindowPassage, dtype=object)
+        self.vmWindowOffset = np.array(self.vmWindowOffset, dtype=object)
+        self.vmTokenPosition = np.array(self.vmTokenPosition, dtype=object)
 
         self.temX = np.array(self.temX)
         self.temXLen = np.array(self.temXLen)
@@ -133,6 +270,9 @@ class Data:
         self.teQuestionID = np.array(self.teQuestionID, dtype=object)
         self.temPassWeight = np.array(self.temPassWeight)
         self.teUrl = np.array(self.teUrl, dtype=object)
+        self.temWindowPassage = np.array(self.temWindowPassage, dtype=object)
+        self.temWindowOffset = np.array(self.temWindowOffset, dtype=object)
+        self.temTokenPosition = np.array(self.temTokenPosition, dtype=object)
 
 
     def getNumTrainBatches(self):
@@ -170,6 +310,21 @@ class Data:
         return {'vX': vX_batch, 'vXLen': vXLen_batch, 'vXq': vXq_batch,
                 'vXqLen':  vXqLen_batch, 'vYBegin': vYBegin_batch, 'vYEnd': vYEnd_batch}
 
+    def getValContextBatch(self):
+        '''The next batch of validation examples with a single context each, in order.'''
+        start = self.valBatchNum * self.batch_size
+        end = min(len(self.vX), (self.valBatchNum + 1) * self.batch_size)
+        points = np.arange(start, end)
+
+        self.valBatchNum += 1
+
+        if self.valBatchNum >= self.getNumValBatches():
+            self.valBatchNum = 0
+
+        return {'vContext': self.vContext[points], 'vQuestionID': self.vQuestionID[points],
+                'vX': self.vX[points], 'vXLen': self.vXLen[points], 'vXq': self.vXq[points],
+                'vXqLen': self.vXqLen[points], 'vYBegin': self.vYBegin[points], 'vYEnd': self.vYEnd[points]}
+
     def getValBatch(self):
         start = self.valBatchNum * self.batch_size
         end = min(len(self.vX), (self.valBatchNum + 1) * self.batch_size)
@@ -180,9 +335,13 @@ class Data:
         vmX_batch = self.vmX[points]
         vmXLen_batch = self.vmXLen[points]
         vmXq_batch = self.vmXq[points]
-        vmXqLen_batch = self.vXqLen[points]
+        vmXqLen_batch = self.vmXqLen[points]
         vmUrl_batch = self.vmUrl[points]
         vmXPassWeights_batch = self.vmPassWeight[points]
+        vmWindowPassage_batch = self.vmWindowPassage[points]
+        vmWindowOffset_batch = self.vmWindowOffset[points]
+        vmSelected_batch = self.vmSelected[points]
+        vmTokenPosition_batch = self.vmTokenPosition[points]
 
         self.valBatchNum += 1
 
@@ -191,7 +350,9 @@ class Data:
 
         return {'vmContext': vmContext_batch, 'vmQuestionID': vmQuestionID_batch,
                 'vmX': vmX_batch, 'vmXLen': vmXLen_batch, 'vmXq': vmXq_batch, 'vmXqLen': vmXqLen_batch,
-                'vmUrl': vmUrl_batch, 'vmXPassWeight': vmXPassWeights_batch}
+                'vmUrl': vmUrl_batch, 'vmXPassWeight': vmXPassWeights_batch,
+                'vmWindowPassage': vmWindowPassage_batch, 'vmWindowOffset': vmWindowOffset_batch,
+                'vmSelected': vmSelected_batch, 'vmTokenPosition': vmTokenPosition_batch}
 
     def getTestBatch(self):
         start = self.testBatchNum * self.batch_size
@@ -206,6 +367,9 @@ class Data:
         teXqLen_batch = self.teXqLen[points]
         teUrl_batch = self.teUrl[points]
         temXPassWeight_batch = self.temPassWeight[points]
+        temWindowPassage_batch = self.temWindowPassage[points]
+        temWindowOffset_batch = self.temWindowOffset[points]
+        temTokenPosition_batch = self.temTokenPosition[points]
 
         self.testBatchNum += 1
 
@@ -214,7 +378,9 @@ class Data:
 
         return {'temContext': temContext_batch, 'teQuestionID': teQuestionID_batch,
                 'temX': temX_batch, 'temXLen': temXLen_batch, 'teXq': teXq_batch, 'teXqLen': teXqLen_batch,
-                'teUrl': teUrl_batch, 'temXPassWeight': temXPassWeight_batch}
+                'teUrl': teUrl_batch, 'temXPassWeight': temXPassWeight_batch,
+                'temWindowPassage': temWindowPassage_batch, 'temWindowOffset': temWindowOffset_batch,
+                'temTokenPosition': temTokenPosition_batch}
 
     def loadGloveModel(self, gloveFile):
         print("Loading Glove Model...")
@@ -253,15 +419,15 @@ class Data:
         print('Number of Unknown Words:', len(unknown))
         return embedding_matrix, new_word_index
 
-    def tokenize(self, sent):
-        '''Return the tokens of a context including punctuation. Wrapper around nltk.word_tokenize to
-           fix weird quotation marks.
+    def tokenize(self, sent, key=None):
+        '''Tokens of sent, taken from the tokens split_data.py wrote when key,
+           the (query id, field, index) of the unchanged text sent was read
+           from, is among them.
         '''
-        tokens = []
-        for token in nltk.word_tokenize(sent):
-            token = token.replace("``", '"').replace("''", '"').replace('’', "'").replace('‘', "'").replace('”', '"').replace('“', '"')
-            tokens.append(token)
-        return tokens
+        tokens = self.tokenCache.get(key) if key is not None else None
+        if tokens is not None:
+            return list(tokens)
+        return tokenize(sent)
 
     def join(self, sent):
         def join_punctuation(seq, characters='.,;?!'):
@@ -296,13 +462,15 @@ class Data:
 
         # For now only pick out selected passages that have answers directly inside the passage
         for data in f['data']:
-            for passage in data['passages']:
+            for passage_index, passage in enumerate(data['passages']):
                 if passage['is_selected'] == 0:
                     continue
                 context = passage['passage_text']
                 context = context.replace("''", '" ')
                 context = context.replace("``", '" ')
-                contextTokenized = self.tokenize(context.lower())
+                # The tokens split_data.py wrote are of the text before the replacements
+                key = (data['query_id'], 'passages', passage_index) if context == passage['passage_text'] else None
+                contextTokenized = self.tokenize(context.lower(), key)
                 contextLength = len(contextTokenized)
                 if contextLength > maxLenContext:
                     maxLenContext = contextLength
@@ -310,7 +478,8 @@ class Data:
                 question = data['query']
                 question = question.replace("''", '" ')
                 question = question.replace("``", '" ')
-                questionTokenized = self.tokenize(question.lower())
+                key = (data['query_id'], 'query', 0) if question == data['query'] else None
+                questionTokenized = self.tokenize(question.lower(), key)
                 if len(questionTokenized) > maxLenQuestion:
                     maxLenQuestion = len(questionTokenized)
 
@@ -318,8 +487,8 @@ class Data:
 
                 answerFound = False
 
-                for answer in data['answers']:
-                    answerTokenized = self.tokenize(answer.lower())
+                for answer_index, answer in enumerate(data['answers']):
+                    answerTokenized = self.tokenize(answer.lower(), (question_id, 'answers', answer_index))
                     if len(answerTokenized) == 0:
                         continue
                     answerBeginIndex, answerEndIndex = self.findAnswer(contextTokenized, answerTokenized)
@@ -356,9 +525,9 @@ class Data:
             x_len = []
 
             answerFound = False
-            for passage in data['passages']:
+            for passage_index, passage in enumerate(data['passages']):
                 context = passage['passage_text']
-                contextTokenized = self.tokenize(context.lower())
+                contextTokenized = self.tokenize(context.lower(), (data['query_id'], 'passages', passage_index))
 
                 passages.append(contextTokenized)
                 x_len.append(len(contextTokenized))
@@ -369,8 +538,8 @@ class Data:
 
                 # Only worry about when the answer is verbatim in the text
                 if not answerFound and passage['is_selected'] == 1:
-                    for answer in data['answers']:
-                        answerTokenized = self.tokenize(answer.lower())
+                    for answer_index, answer in enumerate(data['answers']):
+                        answerTokenized = self.tokenize(answer.lower(), (data['query_id'], 'answers', answer_index))
                         answerBeginIndex, answerEndIndex = self.findAnswer(contextTokenized, answerTokenized)
                         if answerBeginIndex != None:
                             answerFound = True
@@ -390,6 +559,8 @@ class Data:
         xQuestion = [] # list of questions
         xQuestionID = [] # list of question id
         xUrl = [] # list of list of urls associated with the passages
+        xSelected = [] # list of list of is_selected flags of the passages
+        xAnswer = [] # list of the first answer of each question, lowercased, or '' if there is none
         xLen = []
         qLen = []
         maxLenContext = 0
@@ -399,21 +570,23 @@ class Data:
             passages = []
             x_len = []
             urls = []
+            selected = []
 
-            for passage in data['passages']:
+            for passage_index, passage in enumerate(data['passages']):
                 context = passage['passage_text']
-                contextTokenized = self.tokenize(context.lower())
+                contextTokenized = self.tokenize(context.lower(), (data['query_id'], 'passages', passage_index))
 
                 passages.append(contextTokenized)
                 x_len.append(len(contextTokenized))
                 urls.append(passage['url'])
+                selected.append(passage.get('is_selected', 0))
 
                 contextLength = len(contextTokenized)
                 if contextLength > maxLenContext:
                     maxLenContext = contextLength
 
             question = data['query']
-            questionTokenized = self.tokenize(question.lower())
+            questionTokenized = self.tokenize(question.lower(), (data['query_id'], 'query', 0))
             if len(questionTokenized) > maxLenQuestion:
                 maxLenQuestion = len(questionTokenized)
 
@@ -423,11 +596,103 @@ class Data:
             xQuestion.append(questionTokenized)
             xQuestionID.append(questionID)
             xUrl.append(urls)
+            xSelected.append(selected)
+            xAnswer.append(data['answers'][0].lower() if data.get('answers') else '')
             xLen.append(x_len)
             qLen.append(len(questionTokenized))
 
-        return xContext, xLen, xQuestion, qLen, xQuestionID, xUrl, maxLenContext, maxLenQuestion
+        return xContext, xLen, xQuestion, qLen, xQuestionID, xUrl, xSelected, xAnswer, maxLenContext, maxLenQuestion
+
+
+    def selectExamples(self, keep, *xs):
+        '''Returns each of the given lists with only the examples at the indices in keep.'''
+        return [[x[i] for i in keep] for x in xs]
+
+    def filterAnswerContexts(self, sentenceFilter, xContext, xQuestion, xAnswerBegin, xAnswerEnd):
+        '''Replaces each context with its best sentences, and moves the answer span to match. Contexts whose
+           answer is not entirely within the kept sentences are dropped, so the indices of the contexts that were
+           kept are returned too.
+        '''
+        keep = []
+        filtered = []
+        filteredBegin = []
+        filteredEnd = []
+        for i in range(len(xContext)):
+            tokens, positions = sentenceFilter.filter(xContext[i], xQuestion[i])
+            begin = bisect.bisect_left(positions, xAnswerBegin[i])
+            end = begin + xAnswerEnd[i] - xAnswerBegin[i]
+            if end >= len(positions) or positions[begin] != xAnswerBegin[i] or positions[end] != xAnswerEnd[i]:
+                continue
+            keep.append(i)
+            filtered.append(tokens)
+            filteredBegin.append(begin)
+            filteredEnd.append(end)
+
+        print('Contexts with the answer in the kept sentences: {}/{}'.format(len(keep), len(xContext)))
+        return keep, filtered, filteredBegin, filteredEnd
+
+    def filterPassages(self, sentenceFilter, xContext, xQuestion):
+        '''Filters the sentences of every passage of every query, returning the filtered passages and the
+           position of each of their tokens in the original passage.
+        '''
+        xPassage = []
+        xTokenPosition = []
+        for i in range(len(xContext)):
+            filtered = [sentenceFilter.filter(p, xQuestion[i]) for p in xContext[i]]
+            xPassage.append([tokens for tokens, _ in filtered])
+            xTokenPosition.append([positions for _, positions in filtered])
+
+        return xPassage, xTokenPosition
+
+    def windowAnswerContexts(self, xContext, xAnswerBegin, xAnswerEnd, window_size, window_stride):
+        '''Replaces each context with the window that best contains its answer, and moves the answer span
+           into that window. Contexts whose answer does not fit in any window are dropped, so the indices
+           of the contexts that were kept are returned too.
+        '''
+        keep = []
+        windows = []
+        windowBegin = []
+        windowEnd = []
+        for i in range(len(xContext)):
+            starts, contextWindows = chunking.split_windows(xContext[i], window_size, window_stride)
+            w = chunking.answer_window(starts, window_size, xAnswerBegin[i], xAnswerEnd[i])
+            if w is None:
+                continue
+            keep.append(i)
+            windows.append(contextWindows[w])
+            windowBegin.append(xAnswerBegin[i] - starts[w])
+            windowEnd.append(xAnswerEnd[i] - starts[w])
+
+        print('Contexts with the answer inside a window: {}/{}'.format(len(keep), len(xContext)))
+        return keep, windows, windowBegin, windowEnd
+
+    def windowPassages(self, xContext, window_size, window_stride):
+        '''Splits every passage of every query into windows. Returns the windows of each query, their lengths,
+           and the passage each window came from along with its offset in that passage.
+        '''
+        xWindow = []
+        xLen = []
+        xWindowPassage = []
+        xWindowOffset = []
+        for passages in xContext:
+            windows = []
+            passageIndices = []
+            offsets = []
+            for p in range(len(passages)):
+                if window_size:
+                    starts, passageWindows = chunking.split_windows(passages[p], window_size, window_stride)
+                else:
+                    starts, passageWindows = [0], [passages[p]]
+                windows.extend(passageWindows)
+                passageIndices.extend([p] * len(starts))
+                offsets.extend(starts)
+
+            xWindow.append(windows)
+            xLen.append([len(w) for w in windows])
+            xWindowPassage.append(passageIndices)
+            xWindowOffset.append(offsets)
 
+        return xWindow, xLen, xWindowPassage, xWindowOffset
 
     def findAnswer(self, contextTokenized, answerTokenized):
         contextLen = len(contextTokenized)
@@ -528,99 +793,119 @@ class Data:
     def passageRevelevance(self, xContext, xQuestion):
         cs = []
         for i in tqdm(range(len(xContext))):
-            passages = [' '.join(p) for p in xContext[i]]
-
-            tfidf = TfidfVectorizer(stop_words='english', binary=True).fit_transform([' '.join(xQuestion[i])] + passages)
-            cosine_similarities = linear_kernel(tfidf[0:1], tfidf).flatten()[1:]
-
-            # Normalize
-            sum_cs = sum(cosine_similarities)
-            if sum_cs > 0:
-                cosine_similarities = [x / sum_cs for x in cosine_similarities]
-            else:
-                cosine_similarities = [1.0 / len(passages) for _ in range(len(passages))]
-
-            cs.append(cosine_similarities)
+            cs.append(passage_weights(xContext[i], xQuestion[i]))
 
         return cs
 
-    def saveAnswersForEvalVal(self, questionType, modelName, vContextPred, vQuestionID, predictedBegin, predictedEnd):
-        ref_fn = './references/' + questionType + '.json'
-        can_fn = './candidates/' + questionType + '_' + modelName + '.json'
-
-        rf = open(ref_fn, 'w', encoding='utf-8')
-        cf = open(can_fn, 'w', encoding='utf-8')
-
-        answers = {}
-        with open('./datasets/msmarco/dev/' + questionType + '.json', encoding='utf-8') as f:
-            for line in f:
-                sample = json.loads(line)
-                if len(sample['answers']) > 0:
-                    answers[sample['query_id']] = sample['answers'][0].lower()
-                else:
-                    answers[sample['query_id']] = ''
+    def openAnswersForEvalVal(self, questionType, modelName):
+        '''Returns an EvalAnswerWriter for the reference and candidate files of the validation answers.'''
+        return EvalAnswerWriter('./references/' + questionType + '.json',
+                                './candidates/' + questionType + '_' + modelName + '.json',
+                                self.referenceAnswers)
 
+    def saveAnswersForEvalVal(self, questionType, modelName, vContextPred, vQuestionID, predictedBegin, predictedEnd):
+        writer = self.openAnswersForEvalVal(questionType, modelName)
         for i in range(len(vContextPred)):
-            predictedAnswer = ' '.join(vContextPred[i][predictedBegin[i] : predictedEnd[i] + 1])
+            writer.write(vQuestionID[i], vContextPred[i], predictedBegin[i], predictedEnd[i])
+        writer.close()
 
-            reference = {}
-            candidate = {}
-            reference['query_id'] = vQuestionID[i]
-            reference['answers'] = [answers[vQuestionID[i]]]
+    def demoAnswerDir(self):
+        answerDir = ('../cse481n-blog/demo/data/answers/{}'
+                     .format(self.config.model))
 
-            candidate['query_id'] = vQuestionID[i]
-            candidate['answers'] = [predictedAnswer]
+        if not os.path.exists(answerDir):
+            os.makedirs(answerDir)
+        return answerDir
 
-            print(json.dumps(reference, ensure_ascii=False), file=rf)
-            print(json.dumps(candidate, ensure_ascii=False), file=cf)
-
-        rf.close()
-        cf.close()
+    def openDemoWriter(self):
+        '''Returns a DemoWriter for the test answers in the binary format, so that queries can be added as they
+           are answered.
+        '''
+        return DemoWriter(self.demoAnswerDir(), self.config.demo_shard_size, self.config.demo_top_k)
+
+    def demoCandidate(self, queryID, context, urls, passageWeights, logitsStart, logitsEnd, passageIndex,
+                      predictedBegin, predictedEnd):
+        '''The demo answer of one query, with its passages by decreasing relevance.'''
+        def get_passage(passage_index):
+            return {
+                'tokens': context[passage_index],
+                'relevance': passageWeights[passage_index],
+                'logits_start': logitsStart[passage_index],
+                'logits_end': logitsEnd[passage_index],
+                'url': urls[passage_index],
+            }
+
+        passages = [get_passage(i)
+                    for i in range(len(context))]
+
+        selected_passage = passages[passageIndex]
+        selected_passage['selected'] = True
+        selected_passage['start_index'] = predictedBegin
+        selected_passage['end_index'] = predictedEnd
+
+        passages.sort(key=lambda p: p['relevance'], reverse=True)
+
+        return {
+            'query_id': queryID,
+            'passages': passages,
+        }
 
     def saveAnswersForEvalTestDemo(self, questionType, candidateName, teContext, teQuestionID, teUrl, predictedBegin, predictedEnd, passageWeights, logitsStart, logitsEnd, tePassageIndex):
-        ANSWER_DIR = ('../cse481n-blog/demo/data/answers/{}'
-                      .format(self.config.model))
+        ANSWER_DIR = self.demoAnswerDir()
 
-        if not os.path.exists(ANSWER_DIR):
-            os.makedirs(ANSWER_DIR)
+        # The binary format keeps the probabilities as float16 in a few indexed shards instead of one JSON file per query
+        writer = None
+        if self.config.demo_format == 'binary':
+            writer = self.openDemoWriter()
 
         for query_index in range(len(teContext)):
             query_id = teQuestionID[query_index]
+            candidate = self.demoCandidate(query_id, teContext[query_index], teUrl[query_index],
+                                           passageWeights[query_index], logitsStart[query_index],
+                                           logitsEnd[query_index], tePassageIndex[query_index],
+                                           predictedBegin[query_index], predictedEnd[query_index])
 
-            def get_passage(passage_index):
-                return {
-                    'tokens': teContext[query_index][passage_index],
-                    'relevance': passageWeights[query_index][passage_index],
-                    'logits_start': logitsStart[query_index][passage_index],
-                    'logits_end': logitsEnd[query_index][passage_index],
-                    'url': teUrl[query_index][passage_index],
-                }
+            if writer is not None:
+                writer.add(candidate)
+                continue
 
             with open('{}/{}.json'.format(ANSWER_DIR, query_id), 'w+') as out:
-                passages = [get_passage(i)
-                            for i in range(len(teContext[query_index]))]
-
-                selected_passage = passages[tePassageIndex[query_index]]
-                selected_passage['selected'] = True
-                selected_passage['start_index'] = predictedBegin[query_index]
-                selected_passage['end_index'] = predictedEnd[query_index]
-
-                passages.sort(key=lambda p: p['relevance'], reverse=True)
-
-                candidate = {
-                    'query_id': query_id,
-                    'passages': passages,
-                }
-
                 json.dump(candidate, out, ensure_ascii=False)
 
+        if writer is not None:
+            writer.close()
+
     def importMsmarco(self, json_file):
         data = {}
         data['data'] = []
         with open(json_file, encoding='utf-8') as f:
             data['data'] = [json.loads(line) for line in f]
+        self.loadTokens(json_file, data['data'])
         return data
 
+    def loadTokens(self, json_file, records):
+        '''Replaces the tokens tokenize looks up before running the tokenizer with those split_data.py --tokenize
+           wrote next to json_file, if they are there and up to date, so that only one file's tokens are held.
+        '''
+        self.tokenCache = {}
+        tokens_file = os.path.splitext(json_file)[0] + '.tokens.json'
+        if not os.path.exists(tokens_file) or os.path.getmtime(tokens_file) < os.path.getmtime(json_file):
+            return
+
+        with open(tokens_file, encoding='utf-8') as f:
+            for record, line in zip(records, f):
+                tokens = json.loads(line)
+                if tokens['query_id'] != record['query_id']:
+                    print('{} does not match {}, tokenizing instead'.format(tokens_file, json_file))
+                    self.tokenCache = {}
+                    return
+                query_id = record['query_id']
+                self.tokenCache[(query_id, 'query', 0)] = tokens['query']
+                for i, passageTokens in enumerate(tokens['passages']):
+                    self.tokenCache[(query_id, 'passages', i)] = passageTokens
+                for i, answerTokens in enumerate(tokens['answers']):
+                    self.tokenCache[(query_id, 'answers', i)] = answerTokens
+
     def buildVocab(self, sentences):
         '''Accepts a list of list of words. For example, a list of contexts or questions that are tokenized.
            Returns a sorted list of strings that comprise the vocabulary.
@@ -0,0 +1,126 @@
+import nltk
+nltk.download('punkt', quiet=True)
+
+import argparse
+import json
+import os
+import sqlite3
+
+INDEX_VERSION = 1
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Indexes MS MARCO records by query id, with tokenized passages.')
+    parser.add_argument('data_paths', nargs='+') # e.g. datasets/msmarco/dev/location.json
+    parser.add_argument('--index_path', '-i', default=None) # defaults to <data_path>.sqlite for each file
+    parser.add_argument('--batch_size', '-b', type=int, default=1000) # records per transaction
+
+    return parser
+
+
+def tokenize(string):
+    return (token.replace("``", '"').replace("''", '"')
+            for token in nltk.word_tokenize(string))
+
+
+def clean(text):
+    '''Lowercased and tokenized text, as error analysis compares answers
+       with passages.
+    '''
+    return ' '.join(tokenize(text.lower()))
+
+
+def source_signature(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime, INDEX_VERSION]
+
+
+class DatasetIndex:
+    '''Records of MS MARCO JSON lines files in a SQLite database, keyed by
+       query id, along with the cleaned text of every passage so that lookups
+       don't scan the files or tokenize again. Each source file is indexed
+       once and indexed again only if it changes.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(path)
+        self.db.execute('CREATE TABLE IF NOT EXISTS queries (query_id INTEGER PRIMARY KEY, query_type TEXT, '
+                        'source TEXT, record TEXT, passages TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, signature TEXT)')
+        self.db.commit()
+
+    @classmethod
+    def for_data(cls, data_path, index_path=None):
+        '''Opens the index of data_path, <data_path>.sqlite by default, and
+           brings it up to date.
+        '''
+        index = cls(index_path or data_path + '.sqlite')
+        index.add_file(data_path)
+        return index
+
+    def is_current(self, data_path):
+        row = self.db.execute('SELECT signature FROM sources WHERE path = ?',
+                              (os.path.abspath(data_path),)).fetchone()
+        return row is not None and json.loads(row[0]) == source_signature(data_path)
+
+    def add_file(self, data_path, batch_size=1000):
+        if self.is_current(data_path):
+            return False
+
+        source = os.path.abspath(data_path)
+        self.db.execute('DELETE FROM queries WHERE source = ?', (source,))
+        batch = []
+        with open(data_path, encoding='utf-8') as data_file:
+            for line in data_file:
+                record = json.loads(line)
+                passages = [clean(p['passage_text']) for p in record['passages']]
+                batch.append((record['query_id'], record.get('query_type'), source, line.strip(),
+                              json.dumps(passages, ensure_ascii=False)))
+                if len(batch) == batch_size:
+                    self.db.executemany('INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)', batch)
+                    batch = []
+        self.db.executemany('INSERT OR REPLACE INTO queries VALUES (?, ?, ?, ?, ?)', batch)
+        self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?)',
+                        (source, json.dumps(source_signature(data_path))))
+        self.db.commit()
+        return True
+
+    def get(self, query_id):
+        '''The record of query_id with the cleaned text of its passages under
+           'passage_texts', or None.
+        '''
+        row = self.db.execute('SELECT record, passages FROM queries WHERE query_id = ?',
+                              (query_id,)).fetchone()
+        if row is None:
+            return None
+        query = json.loads(row[0])
+        query['passage_texts'] = json.loads(row[1])
+        return query
+
+    def __contains__(self, query_id):
+        return self.db.execute('SELECT 1 FROM queries WHERE query_id = ?', (query_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM queries').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    config = get_parser().parse_args()
+    for data_path in config.data_paths:
+        index = DatasetIndex(config.index_path or data_path + '.sqlite')
+        if index.add_file(data_path, config.batch_size):
+            print('Indexed {} in {}'.format(data_path, index.path))
+        else:
+            print('{} is up to date in {}'.format(data_path, index.path))
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
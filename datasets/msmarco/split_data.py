@@ -1,48 +1,142 @@
 import json
 import argparse
+import collections
+import gzip
+import multiprocessing
 import os
+import re
+import sys
+
+# For corpus, and data.tokenize so that --tokenize gives the tokens Data would
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from corpus import chunk_ranges
+
+# The key is only matched outside of strings, where its quotes aren't escaped
+QUERY_TYPE = re.compile(rb'(?<!\\)"query_type"\s*:\s*"([^"\\]*)"')
 
 def get_parser():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--train_path', default='./train_v1.1.json')
+    parser.add_argument('--train_path', default='./train_v1.1.json.gz')
     parser.add_argument('--train_dir', default='./train/')
-    parser.add_argument('--dev_path', default='./dev_v1.1.json')
+    parser.add_argument('--dev_path', default='./dev_v1.1.json.gz')
     parser.add_argument('--dev_dir', default='./dev/')
-    parser.add_argument('--test_path', default='./test_public_v1.1.json')
+    parser.add_argument('--test_path', default='./test_public_v1.1.json.gz')
     parser.add_argument('--test_dir', default='./test/')
-    
+    parser.add_argument('--process_count', '-p', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--chunk_mb', '-cm', type=int, default=16) # size of the chunks split by each task
+    parser.add_argument('--tokenize', '-t', type=int, default=0) # also writes <type>.tokens.json for Data
+
     return parser
 
-def split(path, dest_dir):
+def find_path(path):
+    '''path, or the gunzipped or gzipped file next to it if only that one exists.'''
+    if not os.path.exists(path):
+        other = path[:-len('.gz')] if path.endswith('.gz') else path + '.gz'
+        if os.path.exists(other):
+            return other
+    return path
+
+def read_chunks(path, chunk_bytes):
+    '''Chunks of whole lines of a gzipped file, as it is decompressed.'''
+    with gzip.open(path, 'rb') as data_file:
+        while True:
+            chunk = data_file.read(chunk_bytes)
+            if not chunk:
+                break
+            yield chunk + data_file.readline()
+
+def record_tokens(record):
+    '''Tokens of the texts Data tokenizes, in the order of the record.'''
+    from data import tokenize
+    return {'query_id': record['query_id'],
+            'query': tokenize(record['query'].lower()),
+            'passages': [tokenize(p['passage_text'].lower()) for p in record['passages']],
+            'answers': [tokenize(a.lower()) for a in record.get('answers', [])]}
+
+def split_chunk(task):
+    '''Lines of a chunk grouped by query type, along with their tokens when
+       tokenize is set. Records are only parsed when the query type can't be
+       read off the line or they are tokenized.
+    '''
+    chunk, tokenize = task
+    if isinstance(chunk, tuple):
+        path, start, end = chunk
+        with open(path, 'rb') as data_file:
+            data_file.seek(start)
+            chunk = data_file.read(end - start)
+
+    lines = collections.OrderedDict()
+    tokens = collections.OrderedDict()
+    for line in chunk.splitlines():
+        if not line.strip():
+            continue
+        match = QUERY_TYPE.search(line)
+        record = json.loads(line.decode('utf-8')) if match is None or tokenize else None
+        answer_type = match.group(1).decode('utf-8') if match is not None else record['query_type']
+
+        lines.setdefault(answer_type, []).append(line)
+        if tokenize:
+            tokens.setdefault(answer_type, []).append(json.dumps(record_tokens(record), ensure_ascii=False))
+
+    return ([(answer_type, b'\n'.join(group) + b'\n') for answer_type, group in lines.items()],
+            [(answer_type, ('\n'.join(group) + '\n').encode('utf-8')) for answer_type, group in tokens.items()])
+
+def ordered_map(pool, function, tasks, window):
+    '''pool.imap, but with at most window tasks read ahead, so chunks aren't
+       all decompressed into memory before they are split.
+    '''
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def split(path, dest_dir, process_count=1, chunk_bytes=16 * 2 ** 20, tokenize=False):
     question_files = {}
 
     if not os.path.exists(dest_dir):
         os.makedirs(dest_dir)
 
-    with open(path, encoding='utf-8') as data_file:    
-        for line in data_file:
-            question = json.loads(line)
-            answer_type = question['query_type']
+    if path.endswith('.gz'):
+        chunks = read_chunks(path, chunk_bytes)
+    else:
+        chunks = [(path, start, end) for start, end in chunk_ranges(path, chunk_bytes)]
+    tasks = ((chunk, tokenize) for chunk in chunks)
 
-            # Initialization
-            if answer_type not in question_files:
-                question_files[answer_type] = open(dest_dir + answer_type + '.json', 'w', encoding='utf-8')
+    pool = multiprocessing.Pool(process_count) if process_count > 1 else None
+    try:
+        results = ordered_map(pool, split_chunk, tasks, 2 * process_count) if pool else map(split_chunk, tasks)
+        for lines, tokens in results:
+            for suffix, groups in [('.json', lines), ('.tokens.json', tokens)]:
+                for answer_type, content in groups:
+                    # Initialization
+                    name = answer_type + suffix
+                    if name not in question_files:
+                        question_files[name] = open(os.path.join(dest_dir, name), 'wb')
 
-            # Print question out to appropriate file
-            print(line, end='', file=question_files[answer_type])
+                    # Write the questions out to the appropriate file, in their original order
+                    question_files[name].write(content)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
         # Close all open files
-        for answer_type in question_files.keys():
-            question_files[answer_type].close()
+        for name in question_files.keys():
+            question_files[name].close()
 
 def main():
     parser = get_parser()
     config = parser.parse_args()
 
-    split(config.train_path, config.train_dir)
-    split(config.dev_path, config.dev_dir)
-    split(config.test_path, config.test_dir)
+    for path, dest_dir in [(config.train_path, config.train_dir),
+                           (config.dev_path, config.dev_dir),
+                           (config.test_path, config.test_dir)]:
+        path = find_path(path)
+        print('Splitting {} into {}...'.format(path, dest_dir))
+        split(path, dest_dir, config.process_count, config.chunk_mb * 2 ** 20, bool(config.tokenize))
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,160 @@
+import json
+import os
+import queue
+import struct
+import threading
+
+import numpy as np
+
+
+MANIFEST = 'manifest.json'
+HEADER = struct.Struct('<I')
+
+
+def encode_probs(probs, top_k):
+    '''Probabilities of one passage as float16, either all of them or just
+       the top_k largest along with their token indices.
+    '''
+    probs = np.asarray(probs, dtype=np.float32)
+    if not top_k or top_k >= len(probs):
+        return {'count': len(probs)}, probs.astype(np.float16).tobytes()
+
+    # Stable, so ties go to the earlier token
+    indices = np.sort(np.argsort(-probs, kind='mergesort')[:top_k]).astype(np.int32)
+    return ({'count': len(probs), 'top_k': len(indices)},
+            indices.tobytes() + probs[indices].astype(np.float16).tobytes())
+
+
+def decode_probs(meta, buffer, offset):
+    '''Inverse of encode_probs, returns the dense probabilities and the offset
+       past them.
+    '''
+    if 'top_k' not in meta:
+        probs = np.frombuffer(buffer, dtype=np.float16, count=meta['count'], offset=offset)
+        return probs.astype(np.float32), offset + 2 * meta['count']
+
+    k = meta['top_k']
+    indices = np.frombuffer(buffer, dtype=np.int32, count=k, offset=offset)
+    values = np.frombuffer(buffer, dtype=np.float16, count=k, offset=offset + 4 * k)
+    probs = np.zeros(meta['count'], dtype=np.float32)
+    probs[indices] = values
+    return probs, offset + 6 * k
+
+
+def encode_query(candidate, top_k):
+    '''A length prefixed JSON header with everything but the probabilities,
+       followed by the start and end probabilities of each passage.
+    '''
+    header = dict(candidate, passages=[])
+    arrays = []
+    for passage in candidate['passages']:
+        meta = dict((k, v) for k, v in passage.items() if k not in ('logits_start', 'logits_end'))
+        meta['logits_start'], start = encode_probs(passage['logits_start'], top_k)
+        meta['logits_end'], end = encode_probs(passage['logits_end'], top_k)
+        header['passages'].append(meta)
+        arrays += [start, end]
+
+    header = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return b''.join([HEADER.pack(len(header)), header] + arrays)
+
+
+def decode_query(buffer):
+    length, = HEADER.unpack_from(buffer, 0)
+    candidate = json.loads(buffer[HEADER.size:HEADER.size + length].decode('utf-8'))
+    offset = HEADER.size + length
+    for passage in candidate['passages']:
+        start, offset = decode_probs(passage['logits_start'], buffer, offset)
+        end, offset = decode_probs(passage['logits_end'], buffer, offset)
+        passage['logits_start'] = start.tolist()
+        passage['logits_end'] = end.tolist()
+    return candidate
+
+
+class DemoWriter:
+    '''Writes demo answers to shards of shard_size queries, encoding and
+       writing on a background thread so the caller only pays for queueing.
+       close() waits for the writes and saves a manifest with the shard and
+       byte range of every query.
+    '''
+
+    def __init__(self, directory, shard_size=1000, top_k=0):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.top_k = top_k
+        self.index = {}
+        self.shards = []
+        self.error = None
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.queue = queue.Queue(maxsize=1000)
+        self.worker = threading.Thread(target=self.loop, name='demo-writer')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def add(self, candidate):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(candidate)
+
+    def loop(self):
+        out = None
+        written = 0
+        try:
+            while True:
+                candidate = self.queue.get()
+                if candidate is None:
+                    break
+
+                if out is None or written == self.shard_size:
+                    if out is not None:
+                        out.close()
+                    self.shards.append('shard-{:05d}.bin'.format(len(self.shards)))
+                    out = open(os.path.join(self.directory, self.shards[-1]), 'wb')
+                    written = 0
+
+                record = encode_query(candidate, self.top_k)
+                self.index[str(candidate['query_id'])] = [len(self.shards) - 1, out.tell(), len(record)]
+                out.write(record)
+                written += 1
+        except Exception as e:
+            self.error = e
+            # Keep draining so add() and close() don't block
+            while self.queue.get() is not None:
+                pass
+        finally:
+            if out is not None:
+                out.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.worker.join()
+        if self.error is not None:
+            raise self.error
+
+        with open(os.path.join(self.directory, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump({'format': 'float16', 'top_k': self.top_k, 'shards': self.shards,
+                       'index': self.index}, f)
+
+
+class DemoReader:
+    '''Reads single queries back from the output of a DemoWriter, in the same
+       layout as the JSON export. Probabilities dropped by top_k are zero.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.shards = manifest['shards']
+        self.index = manifest['index']
+
+    def query_ids(self):
+        return list(self.index)
+
+    def get(self, query_id):
+        shard, offset, length = self.index[str(query_id)]
+        with open(os.path.join(self.directory, self.shards[shard]), 'rb') as f:
+            f.seek(offset)
+            return decode_query(f.read(length))
@@ -0,0 +1,277 @@
+import html
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval'))
+
+from rouge.rouge import Rouge
+
+from dataset_index import DatasetIndex, clean
+
+
+PAGE_NAME = 'page-{:04d}.html'
+
+PAGE_HEADER = '''<html>
+  <head>
+    <link rel="stylesheet" href="main.css" />
+  </head>
+  <body>
+    <div>
+      {navigation}
+      <table>
+        <tr>
+          <th>Reference</th>
+          {headers}
+        </tr>
+        <tr>
+          <td class="padding" colspan="{colspan}"></td>
+        </tr>
+'''
+
+PAGE_FOOTER = '''      </table>
+      {navigation}
+    </div>
+  </body>
+</html>
+'''
+
+ROW = '''        <tr>
+          <td class="query" colspan="{colspan}">{query}?</td>
+        </tr>
+        <tr class="passage">
+          <td class="reference">{reference}</td>
+          {candidates}
+        </tr>
+        <tr>
+          <td class="padding" colspan="{colspan}"></td>
+        </tr>
+'''
+
+
+def add_arguments(parser):
+    parser.add_argument('data_path')
+    parser.add_argument('reference_path')
+    parser.add_argument('candidate_paths', nargs='+')
+    parser.add_argument('--index_path', '-i', default=None) # defaults to <data_path>.sqlite
+    parser.add_argument('--output_dir', '-o', default='error_analysis') # must hold main.css
+    parser.add_argument('--page_size', '-ps', type=int, default=200) # queries per page
+    parser.add_argument('--question_type', '-q', nargs='+', default=None) # e.g. location numeric
+    parser.add_argument('--disagreement', '-d', type=int, default=0) # only queries where candidates differ
+    parser.add_argument('--min_score', '-mns', type=float, default=None) # ROUGE-L of the worst candidate
+    parser.add_argument('--max_score', '-mxs', type=float, default=None)
+
+
+def load_json_lines(path):
+    with open(path, encoding='utf-8') as json_file:
+        for line in json_file:
+            yield json.loads(line)
+
+
+class CandidateReader:
+    '''Rows of a candidate file by query id, read only as far ahead as the
+       next one asked for. Rows passed over on the way are kept until they
+       are asked for, so a missing or reordered row doesn't shift the rest.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = load_json_lines(path)
+        self.skipped = {}
+
+    def get(self, query_id):
+        if query_id in self.skipped:
+            return self.skipped.pop(query_id)
+        for row in self.rows:
+            if row['query_id'] == query_id:
+                return row
+            self.skipped[row['query_id']] = row
+        return None
+
+
+def format_parameter(parameter):
+    return '<span class="parameter">{}</span>'.format(html.escape(parameter))
+
+
+def format_candidate_header(path):
+    elements = path.split('-')
+    model_name = elements[0].split('/')[-1]
+    return '''
+      <th>
+        <span class="model-name">{}</span>
+        {}
+      </th>
+      '''.format(html.escape(model_name),
+                 '\n'.join(format_parameter(param) for param in elements[1:]))
+
+
+def highlight(text, span, css_class, breaks=()):
+    '''Escapes text and marks text[span[0]:span[1]], replacing the character
+       at each position in breaks, the space between two passages, with a
+       rule. Built left to right in one pass over the cut points.
+    '''
+    cuts = [(position, 1, '<hr>') for position in breaks]
+    if span is not None:
+        cuts.append((span[0], 2, '<mark class="{}">'.format(css_class)))
+        cuts.append((span[1], 0, '</mark>'))
+
+    parts = []
+    position = 0
+    for cut, kind, tag in sorted(cuts):
+        parts.append(html.escape(text[position:cut]))
+        parts.append(tag)
+        # A rule takes the place of the space it is at
+        position = cut + 1 if kind == 1 else cut
+    parts.append(html.escape(text[position:]))
+    return ''.join(parts)
+
+
+def find_span(text, answer):
+    start = text.find(answer)
+    return (start, start + len(answer)) if start >= 0 else None
+
+
+class ReportWriter:
+    '''Streams rows into pages of page_size queries, each a complete HTML
+       table with links to the pages before and after it, and writes an
+       index of the pages when closed.
+    '''
+
+    def __init__(self, directory, candidate_paths, page_size=200):
+        self.directory = directory
+        self.page_size = page_size
+        self.colspan = len(candidate_paths) + 1
+        self.headers = '\n'.join(format_candidate_header(path) for path in candidate_paths)
+        self.pages = [] # [rows, first query id, last query id]
+        self.out = None
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def navigation(self, page, has_next):
+        links = ['<a href="index.html">index</a>']
+        if page > 0:
+            links.insert(0, '<a href="{}">previous</a>'.format(PAGE_NAME.format(page)))
+        if has_next:
+            links.append('<a href="{}">next</a>'.format(PAGE_NAME.format(page + 2)))
+        return '<p class="navigation">{}</p>'.format(' | '.join(links))
+
+    def close_page(self, has_next):
+        self.out.write(PAGE_FOOTER.format(navigation=self.navigation(len(self.pages) - 1, has_next)))
+        self.out.close()
+        self.out = None
+
+    def add_row(self, query_id, query, reference, candidates):
+        # Pages are closed when the next row arrives, so the last one has no next link
+        if self.out is not None and self.pages[-1][0] == self.page_size:
+            self.close_page(has_next=True)
+        if self.out is None:
+            self.pages.append([0, query_id, query_id])
+            self.out = open(os.path.join(self.directory, PAGE_NAME.format(len(self.pages))), 'w', encoding='utf-8')
+            self.out.write(PAGE_HEADER.format(navigation=self.navigation(len(self.pages) - 1, False),
+                                              headers=self.headers, colspan=self.colspan))
+
+        self.out.write(ROW.format(colspan=self.colspan, query=html.escape(query), reference=reference,
+                                  candidates='\n          '.join(candidates)))
+        self.pages[-1][0] += 1
+        self.pages[-1][2] = query_id
+
+    def close(self, summary=''):
+        if self.out is not None:
+            self.close_page(has_next=False)
+
+        with open(os.path.join(self.directory, 'index.html'), 'w', encoding='utf-8') as index:
+            index.write('<html>\n  <head>\n    <link rel="stylesheet" href="main.css" />\n  </head>\n'
+                        '  <body>\n    <div>\n      <p>{}</p>\n      <table>\n'.format(html.escape(summary)))
+            index.write('        <tr><th>Page</th><th>Queries</th><th>First query id</th><th>Last query id</th></tr>\n')
+            for i, (rows, first, last) in enumerate(self.pages):
+                index.write('        <tr><td><a href="{0}">{1}</a></td><td>{2}</td><td>{3}</td><td>{4}</td></tr>\n'
+                            .format(PAGE_NAME.format(i + 1), i + 1, rows, first, last))
+            index.write('      </table>\n    </div>\n  </body>\n</html>\n')
+
+
+def selected_passage(query, reference):
+    '''The first selected passage that contains the reference, as
+       error_analysis.py shows it, or None.
+    '''
+    for passage, text in zip(query['passages'], query['passage_texts']):
+        if passage['is_selected'] == 1 and reference in text:
+            return text, ()
+    return None
+
+
+def all_passages(query, reference):
+    '''All passages joined by spaces, with the positions of those spaces, as
+       error_analysis_multi.py shows them.
+    '''
+    texts = query['passage_texts']
+    breaks = []
+    position = -1
+    for text in texts[:-1]:
+        position += len(text) + 1
+        breaks.append(position)
+    return ' '.join(texts), breaks
+
+
+def write_report(config, get_passage, clean_answers):
+    '''Writes the report of config.reference_path and config.candidate_paths
+       to config.output_dir, reading them one query at a time, matched by
+       query id, and looking queries up in the index of config.data_path. get_passage
+       gives the text shown for a query and its passage breaks, and
+       clean_answers whether answers are cleaned like the passages first.
+    '''
+    dataset = DatasetIndex.for_data(config.data_path, config.index_path)
+    writer = ReportWriter(config.output_dir, config.candidate_paths, config.page_size)
+    rouge = Rouge()
+    question_types = set(config.question_type) if config.question_type else None
+    counts = {'written': 0, 'filtered': 0, 'missing': 0}
+
+    candidate_readers = [CandidateReader(path) for path in config.candidate_paths]
+    for reference_row in load_json_lines(config.reference_path):
+        query_id = reference_row['query_id']
+        candidate_rows = [reader.get(query_id) for reader in candidate_readers]
+        missing = [reader.path for reader, row in zip(candidate_readers, candidate_rows) if row is None]
+        if missing:
+            print('query id {} is missing from {}'.format(query_id, ', '.join(missing)), file=sys.stderr)
+            counts['missing'] += 1
+            continue
+
+        query = dataset.get(query_id)
+        if query is None:
+            counts['missing'] += 1
+            continue
+        if question_types is not None and query.get('query_type') not in question_types:
+            counts['filtered'] += 1
+            continue
+
+        reference = reference_row['answers'][0]
+        candidates = [row['answers'][0] for row in candidate_rows]
+        if clean_answers:
+            reference = clean(reference)
+            candidates = [clean(candidate) for candidate in candidates]
+
+        if config.disagreement and len(set(candidates)) == 1:
+            counts['filtered'] += 1
+            continue
+        scores = [rouge.calc_score([candidate], [reference]) for candidate in candidates]
+        if (config.min_score is not None and min(scores) < config.min_score) or \
+           (config.max_score is not None and min(scores) > config.max_score):
+            counts['filtered'] += 1
+            continue
+
+        passage = get_passage(query, reference)
+        if passage is None:
+            counts['missing'] += 1
+            continue
+        text, breaks = passage
+
+        cells = ['<td class="candidate" title="ROUGE-L {:.3f}">{}</td>'.format(
+                     score, highlight(text, find_span(text, candidate), 'candidate', breaks))
+                 for candidate, score in zip(candidates, scores)]
+        writer.add_row(query_id, query['query'], highlight(text, find_span(text, reference), 'reference', breaks),
+                       cells)
+        counts['written'] += 1
+
+    writer.close('{written} queries, {filtered} filtered out, {missing} without a query or passage'.format(**counts))
+    dataset.close()
+    return counts
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+#
+# File Name : fast_bleu.py
+#
+# Description : BLEU with n-gram counting on NumPy arrays of token ids and
+# cooked references that can be cached on disk. Gives the same scores as
+# BleuScorer.compute_score(option='closest').
+
+'''Provides:
+CookedRefs(refs, n=4): The n-gram counts of a list of reference sets, one per segment.
+sufficient_stats(crefs, tests): testlen, reflen, guess and correct counts of each segment.
+score_stats(stats): Corpus and per segment BLEU from sufficient statistics.
+FastBleu(n=4, cache_dir=None): Drop-in replacement for Bleu.
+'''
+
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+
+def tokenize(sentences, vocab, grow=True):
+    '''Token ids of all sentences, concatenated, and the length of each
+    sentence. Words missing from vocab are added if grow, otherwise they get
+    the id len(vocab), which matches nothing.'''
+    ids = []
+    lengths = np.zeros(len(sentences), dtype=np.int64)
+    unknown = len(vocab)
+    for i, s in enumerate(sentences):
+        words = s.split()
+        lengths[i] = len(words)
+        if grow:
+            ids.extend(vocab.setdefault(w, len(vocab)) for w in words)
+        else:
+            ids.extend(vocab.get(w, unknown) for w in words)
+    return np.array(ids, dtype=np.int64), lengths
+
+
+def positions(lengths):
+    '''Sentence of every token and the number of tokens after it in its sentence.'''
+    sentence = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    remaining = lengths[sentence] - (np.arange(len(sentence)) - starts[sentence])
+    return sentence, remaining
+
+
+def group_max(keys, values):
+    '''Unique keys and the largest value of each.'''
+    unique, inverse = np.unique(keys, return_inverse=True)
+    result = np.zeros(len(unique), dtype=values.dtype)
+    np.maximum.at(result, inverse, values)
+    return unique, result
+
+
+class CookedRefs(object):
+    '''Reference n-grams of every segment, kept as sorted arrays of integer
+    keys. Every distinct reference k-gram gets a dense id, its index in
+    gram_keys[k], where the key of a k-gram is the id of its first k-1 words
+    times the vocabulary size plus the id of its last word. This keeps the
+    ids exact, without hash collisions, and small enough for int64.
+
+    For each order, max_keys holds segment * number of k-grams + k-gram id,
+    sorted, and max_counts the largest count of that k-gram in any of the
+    segment's references.'''
+
+    def __init__(self, refs=None, n=4):
+        self.n = n
+        if refs is None:
+            return
+
+        self.vocab = {}
+        ref_segment = np.repeat(np.arange(len(refs)), [len(r) for r in refs])
+        tokens, self.ref_lengths = tokenize([s for r in refs for s in r], self.vocab)
+        self.ref_segment = ref_segment.astype(np.int64)
+        self.vocab_size = len(self.vocab)
+
+        sentence, remaining = positions(self.ref_lengths)
+        self.gram_keys = [None]
+        self.max_keys = []
+        self.max_counts = []
+        grams = tokens
+        for k in range(1, n + 1):
+            valid = remaining >= k
+            if k > 1:
+                # Positions that start a k-gram also start a (k-1)-gram
+                combined = grams[valid] * self.vocab_size + tokens[np.flatnonzero(valid) + k - 1]
+                keys, dense = np.unique(combined, return_inverse=True)
+                self.gram_keys.append(keys)
+                grams = np.zeros(len(tokens), dtype=np.int64)
+                grams[valid] = dense
+            gram_count = self.gram_count(k)
+
+            # Count of each k-gram in each reference, then the max over the references of a segment
+            ref_keys, counts = np.unique(sentence[valid] * gram_count + grams[valid], return_counts=True)
+            segment_keys = self.ref_segment[ref_keys // gram_count] * gram_count + ref_keys % gram_count
+            keys, max_counts = group_max(segment_keys, counts.astype(np.int64))
+            self.max_keys.append(keys)
+            self.max_counts.append(max_counts)
+
+    def gram_count(self, k):
+        return max(self.vocab_size if k == 1 else len(self.gram_keys[k - 1]), 1)
+
+    def size(self):
+        return int(self.ref_segment[-1]) + 1 if len(self.ref_segment) else 0
+
+    def save(self, path):
+        '''Writes path.npz, then path.json, which load looks for first. Each
+        is written under another name first, so a reader never sees half a
+        file.'''
+        arrays = {'ref_lengths': self.ref_lengths, 'ref_segment': self.ref_segment}
+        for k in range(1, self.n + 1):
+            if k > 1:
+                arrays['gram_keys_%d' % k] = self.gram_keys[k - 1]
+            arrays['max_keys_%d' % k] = self.max_keys[k - 1]
+            arrays['max_counts_%d' % k] = self.max_counts[k - 1]
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path + '.npz', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path + '.npz', path + '.npz')
+
+        vocab = sorted(self.vocab, key=self.vocab.get)
+        with open(temp_path + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'n': self.n, 'vocab': vocab}, f, ensure_ascii=False)
+        os.replace(temp_path + '.json', path + '.json')
+
+    @classmethod
+    def load(cls, path):
+        with open(path + '.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        crefs = cls(n=meta['n'])
+        crefs.vocab = dict((w, i) for i, w in enumerate(meta['vocab']))
+        crefs.vocab_size = len(crefs.vocab)
+
+        arrays = np.load(path + '.npz')
+        crefs.ref_lengths = arrays['ref_lengths']
+        crefs.ref_segment = arrays['ref_segment']
+        crefs.gram_keys = [None] + [arrays['gram_keys_%d' % k] for k in range(2, crefs.n + 1)]
+        crefs.max_keys = [arrays['max_keys_%d' % k] for k in range(1, crefs.n + 1)]
+        crefs.max_counts = [arrays['max_counts_%d' % k] for k in range(1, crefs.n + 1)]
+        return crefs
+
+
+def closest_reflen(crefs, testlen):
+    '''Length of the reference closest to the test length in every segment,
+    the shorter one on ties, like cook_test with eff="closest".'''
+    lengths = crefs.ref_lengths
+    diff = np.abs(lengths - testlen[crefs.ref_segment])
+    order = np.lexsort((lengths, diff, crefs.ref_segment))
+    _, first = np.unique(crefs.ref_segment[order], return_index=True)
+    return lengths[order[first]]
+
+
+def sufficient_stats(crefs, tests):
+    '''Takes one test sentence per segment of crefs and returns a dict of
+    testlen, reflen, guess and correct arrays, with guess and correct of
+    shape [segments, n].'''
+    assert len(tests) == crefs.size(), 'refs/test mismatch! %d<>%d' % (crefs.size(), len(tests))
+    n = crefs.n
+    tokens, testlen = tokenize(tests, crefs.vocab, grow=False)
+    sentence, remaining = positions(testlen)
+
+    guess = np.zeros((len(tests), n), dtype=np.int64)
+    correct = np.zeros((len(tests), n), dtype=np.int64)
+    grams = tokens
+    known = tokens < crefs.vocab_size
+    for k in range(1, n + 1):
+        guess[:, k - 1] = np.maximum(0, testlen - k + 1)
+        valid = remaining >= k
+        if k > 1:
+            # Look the k-gram up among the reference k-grams, it can only be there if its prefix is
+            index = np.flatnonzero(valid)
+            last = tokens[index + k - 1]
+            known_k = known[index] & (last < crefs.vocab_size)
+            combined = np.where(known_k, grams[index] * crefs.vocab_size + last, -1)
+            keys = crefs.gram_keys[k - 1]
+            found = np.minimum(np.searchsorted(keys, combined), max(len(keys) - 1, 0))
+            known_k &= (keys[found] == combined) if len(keys) else False
+            grams = np.zeros(len(tokens), dtype=np.int64)
+            grams[index] = found
+            known = np.zeros(len(tokens), dtype=bool)
+            known[index] = known_k
+        matched = valid & known
+        if not matched.any():
+            continue
+
+        gram_count = crefs.gram_count(k)
+        test_keys, counts = np.unique(sentence[matched] * gram_count + grams[matched], return_counts=True)
+        max_keys = crefs.max_keys[k - 1]
+        found = np.minimum(np.searchsorted(max_keys, test_keys), len(max_keys) - 1)
+        max_counts = np.where(max_keys[found] == test_keys, crefs.max_counts[k - 1][found], 0)
+        correct[:, k - 1] = np.bincount(test_keys // gram_count, weights=np.minimum(counts, max_counts),
+                                        minlength=len(tests)).astype(np.int64)
+
+    return {'testlen': testlen, 'reflen': closest_reflen(crefs, testlen), 'guess': guess, 'correct': correct}
+
+
+def score_stats(stats):
+    '''Corpus BLEU-1..n and the list of per segment BLEU-k scores, computed
+    exactly as BleuScorer.compute_score does from the same statistics.'''
+    small = 1e-9
+    tiny = 1e-15 ## so that if guess is 0 still return 0
+    testlen = stats['testlen'].tolist()
+    reflen = stats['reflen'].tolist()
+    guess = stats['guess'].tolist()
+    correct = stats['correct'].tolist()
+    n = stats['guess'].shape[1]
+
+    bleu_list = [[] for _ in range(n)]
+    for i in range(len(testlen)):
+        bleu = 1.
+        for k in range(n):
+            bleu *= (float(correct[i][k]) + tiny) \
+                    /(float(guess[i][k]) + small)
+            bleu_list[k].append(bleu ** (1./(k+1)))
+        ratio = (testlen[i] + tiny) / (reflen[i] + small) ## N.B.: avoid zero division
+        if ratio < 1:
+            for k in range(n):
+                bleu_list[k][-1] *= math.exp(1 - 1/ratio)
+
+    total_testlen = sum(testlen)
+    total_reflen = sum(reflen)
+    total_guess = stats['guess'].sum(axis=0).tolist()
+    total_correct = stats['correct'].sum(axis=0).tolist()
+
+    bleus = []
+    bleu = 1.
+    for k in range(n):
+        bleu *= float(total_correct[k] + tiny) \
+                / (total_guess[k] + small)
+        bleus.append(bleu ** (1./(k+1)))
+    ratio = (total_testlen + tiny) / (total_reflen + small) ## N.B.: avoid zero division
+    if ratio < 1:
+        for k in range(n):
+            bleus[k] *= math.exp(1 - 1/ratio)
+
+    return bleus, bleu_list
+
+
+class FastBleu:
+    '''Same interface and scores as Bleu. Cooked references are kept for
+    every reference set seen, and saved under cache_dir if given, so scoring
+    several candidate files against the same references cooks them once.'''
+
+    def __init__(self, n=4, cache_dir=None):
+        self._n = n
+        self.cache_dir = cache_dir
+        self.crefs = {}
+
+    def cook_refs(self, ids, gts):
+        refs = [gts[id] for id in ids]
+        key = hashlib.sha1(json.dumps([self._n, ids, refs], ensure_ascii=False)
+                           .encode('utf-8')).hexdigest()
+        if key in self.crefs:
+            return self.crefs[key]
+
+        path = os.path.join(self.cache_dir, 'cooked_refs_' + key) if self.cache_dir else None
+        if path is not None and os.path.exists(path + '.json'):
+            crefs = CookedRefs.load(path)
+        else:
+            crefs = CookedRefs(refs, self._n)
+            if path is not None:
+                if not os.path.exists(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                crefs.save(path)
+
+        self.crefs[key] = crefs
+        return crefs
+
+    def compute_stats(self, gts, res):
+        assert(list(gts.keys()) == list(res.keys()))
+        imgIds = list(gts.keys())
+
+        for id in imgIds:
+            hypo = res[id]
+            ref = gts[id]
+
+            # Sanity check.
+            assert(type(hypo) is list)
+            assert(len(hypo) == 1)
+            assert(type(ref) is list)
+            assert(len(ref) >= 1)
+
+        crefs = self.cook_refs(imgIds, gts)
+        return sufficient_stats(crefs, [res[id][0] for id in imgIds])
+
+    def compute_score(self, gts, res):
+        return score_stats(self.compute_stats(gts, res))
+
+    def method(self):
+        return "Bleu"
@@ -0,0 +1,73 @@
+"""
+This module performs unit tests for bleu/fast_bleu.py .
+
+Command line:
+/ms_marco_metrics$ PYTHONPATH=./bleu python bleu_test.py
+"""
+
+import random
+import shutil
+import tempfile
+import unittest
+
+from bleu.bleu_scorer import BleuScorer
+from bleu.fast_bleu import FastBleu
+
+WORDS = ['the', 'cat', 'sat', 'on', 'a', 'mat', '.']
+
+def random_data(seed, segments):
+    """Random references and candidates, with some empty sentences and words missing from the references."""
+
+    rng = random.Random(seed)
+    gts = {}
+    res = {}
+    for i in range(segments):
+        gts[i] = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, 20)))
+                  for _ in range(rng.randint(1, 3))]
+        res[i] = [' '.join(rng.choice(WORDS + ['dog']) for _ in range(rng.randint(0, 20)))]
+    return gts, res
+
+def bleu_scorer_score(gts, res, n=4):
+    """Scores with BleuScorer, as bleu.Bleu does."""
+
+    bleu_scorer = BleuScorer(n=n)
+    for id in gts:
+        bleu_scorer += (res[id][0], gts[id])
+    return bleu_scorer.compute_score(option='closest')
+
+class Test(unittest.TestCase):
+    """Unit tests for bleu/fast_bleu.py ."""
+
+    def test_same_as_bleu_scorer(self):
+        """Unit test for identical corpus and per segment scores."""
+
+        for seed in range(50):
+            gts, res = random_data(seed, random.Random(seed).randint(1, 40))
+            self.assertEqual(FastBleu(4).compute_score(gts, res), bleu_scorer_score(gts, res))
+
+    def test_orders(self):
+        """Unit test for lower maximum n-gram orders (BleuScorer always cooks up to 4-grams)."""
+
+        gts, res = random_data(0, 30)
+        for n in [1, 2, 3]:
+            self.assertEqual(FastBleu(n).compute_score(gts, res), bleu_scorer_score(gts, res, n))
+
+    def test_cooked_refs_cache(self):
+        """Unit test for scores with cooked references loaded from disk."""
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            gts, res = random_data(1, 30)
+            expected = bleu_scorer_score(gts, res)
+            self.assertEqual(FastBleu(4, cache_dir).compute_score(gts, res), expected)
+
+            bleu = FastBleu(4, cache_dir)
+            self.assertEqual(bleu.compute_score(gts, res), expected)
+            _, other_res = random_data(2, 30)
+            self.assertEqual(bleu.compute_score(gts, other_res), bleu_scorer_score(gts, other_res))
+            self.assertEqual(len(bleu.crefs), 1)
+        finally:
+            shutil.rmtree(cache_dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,7 @@ This module computes evaluation metrics for MS MaRCo data set.
 For first time execution, please use run.sh to download necessary dependencies.
 Command line:
 /ms_marco_metrics$ PYTHONPATH=./bleu python ms_marco_eval.py <path_to_reference_file> <path_to_candidate_file>
+    [--normalizer fast|spacy] [--cache_dir <path_to_cache_directory>] [--process_count <n>]
 
 Creation Date : Dec-15-2016
 Last Modified : Fri 16 December 2016 07:00:00 PT
@@ -12,43 +13,61 @@ Authors : Tri Nguyen <trnguye@microsoft.com>, Xia Song <xiaso@microsoft.com>, To
 
 from __future__ import print_function
 
+import argparse
 import json
-import sys
+import multiprocessing
 
-from bleu.bleu import Bleu
+import numpy as np
+
+from bleu.fast_bleu import FastBleu, score_stats
+from normalizer import NormalizedFileCache, get_normalizer
 from rouge.rouge import Rouge
-from spacy.en import English as NlpEnglish
 
 QUERY_ID_JSON_ID = 'query_id'
 ANSWERS_JSON_ID = 'answers'
-NLP = None
 MAX_BLEU_ORDER = 4
+# spaCy gives the official scores; the fast normalizer splits a few answers differently
+DEFAULT_NORMALIZER = 'spacy'
+SHARDS_PER_PROCESS = 4
 
-def normalize_batch(p_iter, p_batch_size=1000, p_thread_count=5):
+def normalize_batch(p_iter, p_normalizer=DEFAULT_NORMALIZER):
     """Normalize and tokenize strings.
 
     Args:
     p_iter (iter): iter over strings to normalize and tokenize.
-    p_batch_size (int): number of batches.
-    p_thread_count (int): number of threads running.
+    p_normalizer (str): name of the normalizer, 'fast' or 'spacy'.
 
     Returns:
     iter: iter over normalized and tokenized string.
     """
 
-    global NLP
-    if not NLP:
-        NLP = NlpEnglish(parser=False)
+    return get_normalizer(p_normalizer).normalize_batch(p_iter)
 
-    output_iter = NLP.pipe(p_iter, \
-                           batch_size=p_batch_size, \
-                           n_threads=p_thread_count)
+def normalize_answers(p_query_ids, p_answers, p_normalizer=DEFAULT_NORMALIZER):
+    """Normalize answers and group them by query.
 
-    for doc in output_iter:
-        tokens = [str(w).strip().lower() for w in doc]
-        yield ' '.join(tokens)
+    Args:
+    p_query_ids (list): query id of every answer.
+    p_answers (list): answer strings.
+    p_normalizer (str): name of the normalizer, 'fast' or 'spacy'.
 
-def load_file(p_path_to_data):
+    Returns:
+    query_id_to_answers_map (dict):
+        dictionary mapping from query_id to normalized answers (list of strings).
+    """
+
+    all_normalized_answers = normalize_batch(p_answers, p_normalizer)
+
+    query_id_to_answers_map = {}
+    for i, normalized_answer in enumerate(all_normalized_answers):
+        query_id = p_query_ids[i]
+        if query_id not in query_id_to_answers_map:
+            query_id_to_answers_map[query_id] = []
+        query_id_to_answers_map[query_id].append(normalized_answer)
+
+    return query_id_to_answers_map
+
+def load_file(p_path_to_data, p_normalizer=DEFAULT_NORMALIZER, p_cache_dir=None):
     """Load data from json file.
 
     Args:
@@ -56,6 +75,9 @@ def load_file(p_path_to_data):
         File should be in format:
             {QUERY_ID_JSON_ID: <a_query_id_int>,
              ANSWERS_JSON_ID: [<list_of_answers_string>]}
+    p_normalizer (str): name of the normalizer, 'fast' or 'spacy'.
+    p_cache_dir (str): directory to keep the normalized file in, keyed by
+        its content, so loading it again skips normalization.
 
     Returns:
     query_id_to_answers_map (dict):
@@ -63,6 +85,15 @@ def load_file(p_path_to_data):
     no_answer_query_ids (set): set of query ids of no-answer queries.
     """
 
+    cache = NormalizedFileCache(p_cache_dir) if p_cache_dir else None
+    if cache is not None:
+        cache_path = cache.path(p_path_to_data, p_normalizer)
+        cached = cache.get(cache_path)
+        if cached is not None:
+            # Pairs rather than a json object, which would turn query ids into strings
+            return dict((query_id, answers) for query_id, answers in cached['answers']), \
+                   set(cached['no_answer_query_ids'])
+
     all_answers = []
     query_ids = []
     no_answer_query_ids = set()
@@ -92,20 +123,95 @@ def load_file(p_path_to_data):
             all_answers.extend(answers)
             query_ids.extend([query_id]*len(answers))
 
-    all_normalized_answers = normalize_batch(all_answers)
+    query_id_to_answers_map = normalize_answers(query_ids, all_answers, p_normalizer)
 
-    query_id_to_answers_map = {}
-    for i, normalized_answer in enumerate(all_normalized_answers):
-        query_id = query_ids[i]
-        if query_id not in query_id_to_answers_map:
-            query_id_to_answers_map[query_id] = []
-        query_id_to_answers_map[query_id].append(normalized_answer)
+    if cache is not None:
+        cache.put(cache_path, {'answers': list(query_id_to_answers_map.items()),
+                               'no_answer_query_ids': list(no_answer_query_ids)})
 
     return query_id_to_answers_map, no_answer_query_ids
 
+def score_shard(p_shard):
+    """Score one shard of queries in a worker process.
+
+    Args:
+    p_shard (tuple): reference and candidate dictionaries of the shard,
+        sharing the same query ids in the same order, and the maximum n
+        order in bleu_n calculation, None to only compute ROUGE-L.
+
+    Returns:
+    bleu_stats (dict): BLEU sufficient statistics of every query, or None.
+    rouge_scores (numpy.ndarray): ROUGE-L score of every query.
+    """
+
+    reference_dictionary, candidate_dictionary, max_bleu_order = p_shard
+    bleu_stats = None
+    if max_bleu_order is not None:
+        bleu_stats = FastBleu(max_bleu_order).compute_stats(reference_dictionary, candidate_dictionary)
+    _, rouge_scores = Rouge().compute_score(reference_dictionary, candidate_dictionary)
+    return bleu_stats, rouge_scores
+
+def compute_scores_parallel(p_reference_dictionary,
+                            p_candidate_dictionary,
+                            p_max_bleu_order,
+                            p_process_count,
+                            p_cache_dir=None):
+    """Compute BLEU-N and ROUGE-L scores over shards of queries in a process pool.
+
+    BLEU sufficient statistics (test and reference lengths, guess and correct
+    n-gram counts) and ROUGE-L of every query are merged in the order of
+    p_reference_dictionary, so the scores are the same as scoring all
+    queries in one process. With p_cache_dir, the references are cooked
+    once here, or loaded from the cache under the same key as when scoring
+    in one process, and the BLEU statistics are computed here from them;
+    the shards then only compute ROUGE-L.
+
+    Args:
+    p_reference_dictionary (dict): query_id to normalized reference answers.
+    p_candidate_dictionary (dict): query_id to the normalized candidate answer.
+    p_max_bleu_order: the maximum n order in bleu_n calculation.
+    p_process_count (int): number of worker processes.
+    p_cache_dir (str): directory to keep the cooked references in.
+
+    Returns:
+    bleu_scores (list): bleu_1 to bleu_n.
+    rouge_score (float): rouge_l.
+    """
+
+    query_ids = list(p_reference_dictionary.keys())
+    shard_size = max(1, -(-len(query_ids) // (p_process_count * SHARDS_PER_PROCESS)))
+    bleu_stats = None
+    if p_cache_dir is not None:
+        bleu_stats = FastBleu(p_max_bleu_order, p_cache_dir).compute_stats(p_reference_dictionary, \
+                                                                           p_candidate_dictionary)
+
+    shards = []
+    for start in range(0, len(query_ids), shard_size):
+        shard_ids = query_ids[start:start + shard_size]
+        shards.append(({query_id: p_reference_dictionary[query_id] for query_id in shard_ids},
+                       {query_id: p_candidate_dictionary[query_id] for query_id in shard_ids},
+                       p_max_bleu_order if bleu_stats is None else None))
+
+    pool = multiprocessing.Pool(p_process_count)
+    try:
+        results = pool.map(score_shard, shards)
+    finally:
+        pool.close()
+        pool.join()
+
+    if bleu_stats is None:
+        bleu_stats = {key: np.concatenate([stats[key] for stats, _ in results]) \
+                      for key in results[0][0]}
+    bleu_scores, _ = score_stats(bleu_stats)
+    rouge_score = np.mean(np.concatenate([rouge_scores for _, rouge_scores in results]))
+    return bleu_scores, rouge_score
+
 def compute_metrics_from_files(p_path_to_reference_file,
                                p_path_to_candidate_file,
-                               p_max_bleu_order):
+                               p_max_bleu_order,
+                               p_cache_dir=None,
+                               p_normalizer=DEFAULT_NORMALIZER,
+                               p_process_count=1):
     """Compute BLEU-N and ROUGE-L metrics.
     IMPORTANT: No-answer reference will be excluded from calculation.
 
@@ -116,22 +222,50 @@ def compute_metrics_from_files(p_path_to_reference_file,
             {QUERY_ID_JSON_ID: <a_query_id_int>,
              ANSWERS_JSON_ID: [<list_of_answers_string>]}
     p_max_bleu_order: the maximum n order in bleu_n calculation.
+    p_cache_dir (str): directory to keep normalized and cooked references
+        in, so later candidates scored against the same references skip
+        normalizing and cooking them.
+    p_normalizer (str): name of the normalizer, 'fast' or 'spacy'.
+    p_process_count (int): number of processes to score shards of the
+        queries in, 1 scores them all in this process.
 
     Returns:
     dict: dictionary of {'bleu_n': <bleu_n score>, 'rouge_l': <rouge_l score>}
     """
 
     reference_dictionary, reference_no_answer_query_ids = \
-        load_file(p_path_to_reference_file)
-    candidate_dictionary, _ = load_file(p_path_to_candidate_file)
+        load_file(p_path_to_reference_file, p_normalizer, p_cache_dir)
+    candidate_dictionary, _ = load_file(p_path_to_candidate_file, p_normalizer)
+
+    return compute_metrics(reference_dictionary,
+                           reference_no_answer_query_ids,
+                           candidate_dictionary,
+                           p_max_bleu_order,
+                           p_cache_dir,
+                           p_process_count)
+
+def filter_dictionaries(p_reference_dictionary,
+                        p_reference_no_answer_query_ids,
+                        p_candidate_dictionary):
+    """Drop no-answer queries and check that references and candidates match.
+
+    Args:
+    p_reference_dictionary (dict): query_id to normalized reference answers.
+    p_reference_no_answer_query_ids (set): query ids of no-answer references.
+    p_candidate_dictionary (dict): query_id to normalized candidate answers.
+
+    Returns:
+    filtered_reference_dictionary (dict): references of the queries to score.
+    filtered_candidate_dictionary (dict): candidates of the same queries, in the same order.
+    """
 
     filtered_reference_dictionary = \
-        {key: value for key, value in reference_dictionary.items() \
-                    if key not in reference_no_answer_query_ids}
+        {key: value for key, value in p_reference_dictionary.items() \
+                    if key not in p_reference_no_answer_query_ids}
 
     filtered_candidate_dictionary = \
-        {key: value for key, value in candidate_dictionary.items() \
-                    if key not in reference_no_answer_query_ids}
+        {key: value for key, value in p_candidate_dictionary.items() \
+                    if key not in p_reference_no_answer_query_ids}
 
     for query_id, answers in filtered_candidate_dictionary.items():
         assert \
@@ -146,28 +280,134 @@ def compute_metrics_from_files(p_path_to_reference_file,
             (len(common_query_ids) == len(candidate_query_ids)), \
            'Reference and candidate files must share same query ids'
 
+    # Scored in the order of the references, whatever the order of the candidate file
+    filtered_candidate_dictionary = \
+        {key: filtered_candidate_dictionary[key] for key in filtered_reference_dictionary}
+
+    return filtered_reference_dictionary, filtered_candidate_dictionary
+
+def compute_metrics(p_reference_dictionary,
+                    p_reference_no_answer_query_ids,
+                    p_candidate_dictionary,
+                    p_max_bleu_order,
+                    p_cache_dir=None,
+                    p_process_count=1,
+                    p_bleu_scorer=None):
+    """Compute BLEU-N and ROUGE-L metrics of normalized answers, as loaded by load_file.
+    IMPORTANT: No-answer reference will be excluded from calculation.
+
+    Args:
+    p_reference_dictionary (dict): query_id to normalized reference answers.
+    p_reference_no_answer_query_ids (set): query ids of no-answer references.
+    p_candidate_dictionary (dict): query_id to normalized candidate answers.
+    p_max_bleu_order: the maximum n order in bleu_n calculation.
+    p_cache_dir (str): directory to keep cooked references in.
+    p_process_count (int): number of processes to score shards of the
+        queries in, 1 scores them all in this process.
+    p_bleu_scorer (FastBleu): scorer to reuse, with the references it has
+        cooked, when scoring in this process.
+
+    Returns:
+    dict: dictionary of {'bleu_n': <bleu_n score>, 'rouge_l': <rouge_l score>}
+    """
+
+    filtered_reference_dictionary, filtered_candidate_dictionary = \
+        filter_dictionaries(p_reference_dictionary, \
+                            p_reference_no_answer_query_ids, \
+                            p_candidate_dictionary)
+
     all_scores = {}
-    bleu_scores, _ = \
-        Bleu(p_max_bleu_order).compute_score(filtered_reference_dictionary, \
-                                             filtered_candidate_dictionary)
+    if p_process_count > 1 and filtered_reference_dictionary:
+        bleu_scores, rouge_score = \
+            compute_scores_parallel(filtered_reference_dictionary, \
+                                    filtered_candidate_dictionary, \
+                                    p_max_bleu_order, \
+                                    p_process_count, \
+                                    p_cache_dir)
+    else:
+        bleu_scorer = p_bleu_scorer or FastBleu(p_max_bleu_order, p_cache_dir)
+        bleu_scores, _ = bleu_scorer.compute_score(filtered_reference_dictionary, \
+                                                   filtered_candidate_dictionary)
+        rouge_score, _ = Rouge().compute_score(filtered_reference_dictionary, \
+                                               filtered_candidate_dictionary)
+
     for i, bleu_score in enumerate(bleu_scores):
         all_scores['bleu_%d' % (i+1)] = bleu_score
-
-    rouge_score, _ = Rouge().compute_score(filtered_reference_dictionary, \
-                                           filtered_candidate_dictionary)
     all_scores['rouge_l'] = rouge_score
 
     return all_scores
 
+class AnswerScorer(object):
+    """Compute BLEU-N and ROUGE-L metrics in memory, without reading or writing files.
+
+    References are normalized once, and their BLEU n-grams are cooked once
+    for every set of queries scored, so the same dev split can be scored
+    again cheaply, e.g. at the end of every training epoch. Scores are the
+    same as writing the answers to files and using compute_metrics_from_files.
+
+    Args:
+    p_references (dict): query_id to reference answers (list of strings),
+        empty for no-answer queries.
+    p_max_bleu_order: the maximum n order in bleu_n calculation.
+    p_normalizer (str): name of the normalizer, 'fast' or 'spacy'.
+    """
+
+    def __init__(self, p_references, p_max_bleu_order=MAX_BLEU_ORDER, p_normalizer=DEFAULT_NORMALIZER):
+        self.max_bleu_order = p_max_bleu_order
+        self.normalizer = p_normalizer
+        self.no_answer_query_ids = set(query_id for query_id, answers in p_references.items() if not answers)
+
+        query_ids = []
+        all_answers = []
+        for query_id, answers in p_references.items():
+            answers = answers or ['']
+            all_answers.extend(answers)
+            query_ids.extend([query_id]*len(answers))
+        self.reference_dictionary = normalize_answers(query_ids, all_answers, p_normalizer)
+        self.bleu_scorer = FastBleu(p_max_bleu_order)
+
+    def score(self, p_predictions):
+        """Score predicted answers.
+
+        Args:
+        p_predictions (iter): (query_id, answer) pairs, the answer being a
+            list of tokens, joined with spaces, or a string.
+
+        Returns:
+        dict: dictionary of {'bleu_n': <bleu_n score>, 'rouge_l': <rouge_l score>}
+        """
+
+        query_ids = []
+        answers = []
+        for query_id, answer in p_predictions:
+            query_ids.append(query_id)
+            answers.append(answer if isinstance(answer, str) else ' '.join(answer))
+        candidate_dictionary = normalize_answers(query_ids, answers, self.normalizer)
+
+        reference_dictionary = {query_id: self.reference_dictionary[query_id] for query_id in candidate_dictionary}
+        return compute_metrics(reference_dictionary,
+                               self.no_answer_query_ids,
+                               candidate_dictionary,
+                               self.max_bleu_order,
+                               p_bleu_scorer=self.bleu_scorer)
+
 def main():
     """Command line: /ms_marco_metrics$ PYTHONPATH=./bleu python ms_marco_eval.py <path_to_reference_file> <path_to_candidate_file>"""
 
-    path_to_referene_file = sys.argv[1]
-    path_to_candidate_file = sys.argv[2]
-
-    metrics = compute_metrics_from_files(path_to_referene_file, \
-                                         path_to_candidate_file, \
-                                         MAX_BLEU_ORDER)
+    parser = argparse.ArgumentParser(description='Computes BLEU-N and ROUGE-L metrics for MS MaRCo.')
+    parser.add_argument('path_to_reference_file')
+    parser.add_argument('path_to_candidate_file')
+    parser.add_argument('--normalizer', '-n', default=DEFAULT_NORMALIZER, choices=['fast', 'spacy'])
+    parser.add_argument('--cache_dir', '-c', default=None) # keeps normalized and cooked references
+    parser.add_argument('--process_count', '-p', type=int, default=1) # scores shards of queries in parallel
+    config = parser.parse_args()
+
+    metrics = compute_metrics_from_files(config.path_to_reference_file, \
+                                         config.path_to_candidate_file, \
+                                         MAX_BLEU_ORDER, \
+                                         config.cache_dir, \
+                                         config.normalizer, \
+                                         config.process_count)
 
     print('############################')
     for metric in sorted(metrics):
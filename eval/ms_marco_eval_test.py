@@ -9,10 +9,12 @@ Last Modified : Fri 16 December 2016 07:00:00 PT
 Authors : Tri Nguyen <trnguye@microsoft.com>, Xia Song <xiaso@microsoft.com>, Tong Wang <tongw@microsoft.com>
 """
 
+import json
 import os
+import tempfile
 import unittest
 
-from ms_marco_eval import compute_metrics_from_files
+from ms_marco_eval import AnswerScorer, compute_metrics_from_files
 
 TEST_DATA_FOLDER = 'sample_test_data'
 MAX_BLEU_ORDER = 4
@@ -88,5 +90,77 @@ class Test(unittest.TestCase):
         self.assertEqual("%.5f" % scores['bleu_4'], '0.07623')
         self.assertEqual("%.5f" % scores['rouge_l'], '0.12077')
 
+    def test_dev_set_fast_normalizer(self):
+        """Unit test for dev set with the fast normalizer, which splits a few of
+        its answers differently from the spaCy that scored it above."""
+
+        reference_file = 'dev_as_references.json'
+        candidate_file = 'dev_first_sentence_as_candidates.json'
+
+        scores = compute_metrics_from_files(generate_directory(reference_file),
+                                            generate_directory(candidate_file),
+                                            MAX_BLEU_ORDER,
+                                            p_normalizer='fast')
+        self.assertAlmostEqual(scores['bleu_1'], 0.17634, places=4)
+        self.assertAlmostEqual(scores['bleu_2'], 0.11419, places=4)
+        self.assertAlmostEqual(scores['bleu_3'], 0.08906, places=4)
+        self.assertAlmostEqual(scores['bleu_4'], 0.07623, places=4)
+        self.assertAlmostEqual(scores['rouge_l'], 0.12077, places=4)
+
+    def test_parallel(self):
+        """Unit test for scoring shards of queries in several processes."""
+
+        for reference_file, candidate_file in [('dev_as_references.json', 'dev_first_sentence_as_candidates.json'),
+                                               ('sample_references.json', 'sample_candidates.json'),
+                                               ('no_answer_test_references.json', 'no_answer_test_candidates.json')]:
+            scores = compute_metrics_from_files(generate_directory(reference_file),
+                                                generate_directory(candidate_file),
+                                                MAX_BLEU_ORDER)
+            parallel_scores = compute_metrics_from_files(generate_directory(reference_file),
+                                                         generate_directory(candidate_file),
+                                                         MAX_BLEU_ORDER,
+                                                         p_process_count=3)
+            self.assertEqual(parallel_scores, scores)
+
+    def test_parallel_cache(self):
+        """Unit test for scoring in several processes with cooked references
+        cached once, under the same key as when scoring in one process."""
+
+        reference_file = 'sample_references.json'
+        candidate_file = 'sample_candidates.json'
+        with tempfile.TemporaryDirectory() as cache_dir:
+            scores = compute_metrics_from_files(generate_directory(reference_file),
+                                                generate_directory(candidate_file),
+                                                MAX_BLEU_ORDER,
+                                                p_cache_dir=cache_dir)
+            cached = sorted(os.listdir(cache_dir))
+            parallel_scores = compute_metrics_from_files(generate_directory(reference_file),
+                                                         generate_directory(candidate_file),
+                                                         MAX_BLEU_ORDER,
+                                                         p_cache_dir=cache_dir,
+                                                         p_process_count=3)
+            self.assertEqual(parallel_scores, scores)
+            self.assertEqual(sorted(os.listdir(cache_dir)), cached)
+
+    def test_answer_scorer(self):
+        """Unit test for scoring answers in memory against scoring files."""
+
+        for reference_file, candidate_file in [('dev_as_references.json', 'dev_first_sentence_as_candidates.json'),
+                                               ('no_answer_test_references.json', 'no_answer_test_candidates.json')]:
+            with open(generate_directory(reference_file), encoding='utf-8') as data_file:
+                references = dict((json_object['query_id'], json_object['answers'])
+                                  for json_object in map(json.loads, data_file))
+            with open(generate_directory(candidate_file), encoding='utf-8') as data_file:
+                predictions = [(json_object['query_id'], (json_object['answers'] or [''])[0].split(' '))
+                               for json_object in map(json.loads, data_file)]
+
+            scorer = AnswerScorer(references, MAX_BLEU_ORDER)
+            expected = compute_metrics_from_files(generate_directory(reference_file),
+                                                  generate_directory(candidate_file),
+                                                  MAX_BLEU_ORDER)
+            self.assertEqual(scorer.score(predictions), expected)
+            # Again, with the references already cooked
+            self.assertEqual(scorer.score(predictions), expected)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,276 @@
+"""
+This module normalizes answer strings for ms_marco_eval.py .
+
+Answers are tokenized and every token is stripped and lowercased, as the
+evaluation has done with spaCy. FastNormalizer does this without loading
+spaCy: it reimplements the spaCy English tokenizer (prefix, suffix and
+infix rules and special cases, as in the spaCy release the sample test
+data was scored with) on the standard re module. SpacyNormalizer still runs
+spaCy itself. NormalizedFileCache keeps normalized files on disk, keyed by
+a hash of their content, so a reference file is normalized once.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+PREFIXES = [',', '"', '(', '[', '{', '*', '<', '$', '£', '“', "'", '``', '`', '#',
+            'US$', 'C$', 'A$', 'a-', '‘', '....', '...']
+
+# '’\.\.' is one suffix, as in spaCy
+SUFFIXES = [r',', r'\"', r'\)', r'\]', r'\}', r'\*', r'\!', r'\?', r'%', r'\$', r'>', r':', r';',
+            r"'", r'”', r"''", r"'s", r"'S", r'’s', r'’S', r'’\.\.', r'\.\.\.', r'\.\.\.\.',
+            r'(?<=[a-z0-9)\]”"\'%\)])\.', r'(?<=[0-9])km']
+
+INFIXES = [r'\.\.\.+', r'(?<=[a-z])\.(?=[A-Z])', r'(?<=[a-zA-Z])-(?=[a-zA-z])',
+           r'(?<=[a-zA-Z])--(?=[a-zA-z])', r'(?<=[0-9])-(?=[0-9])', r'(?<=[A-Za-z]),(?=[A-Za-z])']
+
+# Special cases, each written as its tokens separated by spaces
+EXCEPTIONS = [
+    '")', "''", "'S", "'em", "'ol", "'s", '(:', '(=', '(^_^)', '-_-', '-__-', '10 a.m.', '10 am',
+    '10 p.m.', '10 pm', '11 a.m.', '11 am', '11 p.m.', '11 pm', '12 a.m.', '12 am', '12 p.m.', '12 pm',
+    '1 a.m.', '1 am', '1 p.m.', '1 pm', '2 a.m.', '2 am', '2 p.m.', '2 pm', '3 a.m.', '3 am', '3 p.m.',
+    '3 pm', '4 a.m.', '4 am', '4 p.m.', '4 pm', '5 a.m.', '5 am', '5 p.m.', '5 pm', '6 a.m.', '6 am',
+    '6 p.m.', '6 pm', '7 a.m.', '7 am', '7 p.m.', '7 pm', '8 a.m.', '8 am', '8 p.m.', '8 pm', '9 a.m.',
+    '9 am', '9 p.m.', '9 pm', ":')", ':(', ':((', ':(((', ':)', ':))', ':-)', ':-/', ':-P', ':/', ':0',
+    ':3', ':>', ':O', ':P', ':Y', ':]', ':p', ';(', ';)', ';-)', ';-p', ';D', ';p', '<3', '<33', '<333',
+    '=)', '=3', '=D', '=[[', '=]', 'Adm.', "Ai n't", 'Ai nt', 'Ala.', 'Apr.', "Are n't", 'Are nt',
+    'Ariz.', 'Ark.', 'Aug.', 'Bros.', 'Calif.', "Ca n't", 'Can not', 'Ca nt', 'Co.', 'Colo.', 'Conn.',
+    'Corp.', "Could 've", "Could n't", "Could n't 've", 'Could nt', 'Could nt ve', 'Could ve', 'D.C.',
+    'Dec.', 'Del.', "Did n't", 'Did nt', "Does n't", 'Does nt', "Do n't", 'Do nt', 'Dr.', 'E.G.',
+    'E.g.', 'Feb.', 'Fla.', 'Ga.', 'Gen.', 'Gov.', "Had n't", "Had n't 've", 'Had nt', 'Had nt ve',
+    "Has n't", 'Has nt', "Have n't", 'Have nt', "He 'd", "He 'd 've", "He 'll", "He 's", 'He d',
+    'He d ve', 'He s', "How 'd", "How 'll", "How 's", 'How d', 'How ll', 'How s', "I 'd", "I 'd 've",
+    "I 'll", "I 'm", "I 'ma", "I 've", 'I.E.', 'I.e.', 'I d ve', 'Ill.', 'I m', 'I ma', 'Inc.', 'Ind.',
+    "Is n't", 'Is nt', "It 'd", "It 'd 've", "It 'll", "It 's", 'It d', 'It d ve', 'It ll', 'I ve',
+    'Jan.', 'Jr.', 'Jul.', 'Jun.', 'Kan.', 'Kans.', 'Ky.', 'La.', "Let 's", 'Ltd.', 'Mar.', 'Mass.',
+    'May.', 'Md.', 'Messrs.', 'Mich.', "Might 've", "Might n't", "Might n't 've", 'Might nt',
+    'Might nt ve', 'Might ve', 'Minn.', 'Miss.', 'Mo.', 'Mont.', 'Mr.', 'Mrs.', 'Ms.', 'Mt.',
+    "Must 've", "Must n't", 'Must nt', 'Must ve', 'N.C.', 'N.D.', 'N.H.', 'N.J.', 'N.M.', 'N.Y.',
+    'Neb.', 'Nebr.', "Need n't", 'Need nt', 'Nev.', "Not 've", 'Not ve', 'Nov.', 'Oct.', 'Okla.',
+    'Ore.', 'Pa.', 'Ph.D.', 'Rep.', 'Rev.', 'Sen.', 'Sep.', 'Sept.', "Sha n't", 'Sha nt', "She 'd",
+    "She 'd 've", "She 'll", "She 's", 'She d ve', 'She s', "Should 've", "Should n't",
+    "Should n't 've", 'Should nt', 'Should nt ve', 'Should ve', 'St.', 'Tenn.', "That 's", 'That s',
+    "There 'd", "There 'd 've", "There 'll", "There 's", 'There d', 'There d ve', 'There ll', "They 'd",
+    "They 'd 've", "They 'll", "They 're", "They 've", 'They d', 'They d ve', 'They ll', 'They re',
+    'They ve', 'V_V', 'Va.', 'Wash.', "Was n't", 'Was nt', "We 'd", "We 'd 've", "We 'll", "We 're",
+    "We 've", 'We d ve', "Were n't", 'Were nt', 'We ve', "What 'll", "What 're", "What 's", "What 've",
+    'What ll', 'What re', 'What s', 'What ve', "When 's", 'When s', "Where 'd", "Where 's", "Where 've",
+    'Where d', 'Where s', 'Where ve', "Who 'd", "Who 'll", "Who 're", "Who 's", "Who 've", 'Who d',
+    'Who ll', 'Who s', 'Who ve', "Why 'll", "Why 're", "Why 's", 'Why ll', 'Why re', 'Why s', 'Wis.',
+    "Wo n't", 'Wo nt', "Would 've", "Would n't", "Would n't 've", 'Would nt', 'Would nt ve', 'Would ve',
+    "You 'd", "You 'd 've", "You 'll", "You 're", "You 've", 'You d', 'You d ve', 'You ll', 'You re',
+    'You ve', '^_^', 'a.', 'a.m.', "ai n't", 'ai nt', 'and/or', "are n't", 'are nt', 'b.', 'c.',
+    "ca n't", 'can not', 'ca nt', 'co.', "could 've", "could n't", "could n't 've", 'could nt',
+    'could nt ve', 'could ve', 'd.', "did n't", 'did nt', "does n't", 'does nt', "do n't", 'do nt',
+    'e.', 'e.g.', 'f.', 'g.', 'h.', "had n't", "had n't 've", 'had nt', 'had nt ve', "has n't",
+    'has nt', "have n't", 'have nt', "he 'd", "he 'd 've", "he 'll", "he 's", 'he d', 'he d ve', 'he s',
+    "how 'd", "how 'll", "how 's", 'how d', 'how ll', 'how s', "i 'd", "i 'd 've", "i 'll", "i 'm",
+    "i 'ma", "i 've", 'i.', 'i.e.', 'i d ve', 'i m', 'i ma', "is n't", 'is nt', "it 'd", "it 'd 've",
+    "it 'll", "it 's", 'it d', 'it d ve', 'it ll', 'i ve', 'j.', 'k.', 'l.', "let 's", 'm.',
+    "might 've", "might n't", "might n't 've", 'might nt', 'might nt ve', 'might ve', "must 've",
+    "must n't", 'must nt', 'must ve', 'n.', "need n't", 'need nt', "not 've", 'not ve', 'o.', 'o.O',
+    'o_O', 'o_o', 'p.', 'p.m.', 'q.', 'r.', 's.', "sha n't", 'sha nt', "she 'd", "she 'd 've",
+    "she 'll", "she 's", 'she d ve', 'she s', "should 've", "should n't", "should n't 've", 'should nt',
+    'should nt ve', 'should ve', 't.', "that 's", 'that s', "there 'd", "there 'd 've", "there 'll",
+    "there 's", 'there d', 'there d ve', 'there ll', "they 'd", "they 'd 've", "they 'll", "they 're",
+    "they 've", 'they d', 'they d ve', 'they ll', 'they re', 'they ve', 'u.', 'v.', 'vs.', 'w.',
+    "was n't", 'was nt', "we 'd", "we 'd 've", "we 'll", "we 're", "we 've", 'we d ve', "were n't",
+    'were nt', 'we ve', "what 'll", "what 're", "what 's", "what 've", 'what ll', 'what re', 'what s',
+    'what ve', "when 's", 'when s', "where 'd", "where 's", "where 've", 'where d', 'where s',
+    'where ve', "who 'd", "who 'll", "who 're", "who 's", "who 've", 'who d', 'who ll', 'who s',
+    'who ve', "why 'll", "why 're", "why 's", 'why ll', 'why re', 'why s', "wo n't", 'wo nt',
+    "would 've", "would n't", "would n't 've", 'would nt', 'would nt ve', 'would ve', 'x.', 'xD', 'xDD',
+    'y.', "you 'd", "you 'd 've", "you 'll", "you 're", "you 've", 'you d', 'you d ve', 'you ll',
+    'you re', 'you ve', 'z.', '—', '‘S', '‘s'
+]
+
+
+class Tokenizer(object):
+    """The spaCy English tokenizer, for token strings only.
+
+    Text is split on whitespace, keeping one token for every run of
+    whitespace other than a single space. Each remaining span is a special
+    case, or prefixes and suffixes are split off until none are left or a
+    special case is found, and what is left is split on infixes.
+    """
+
+    def __init__(self, prefixes=PREFIXES, suffixes=SUFFIXES, infixes=INFIXES, exceptions=EXCEPTIONS):
+        self.prefix_search = re.compile('|'.join('^' + re.escape(p) for p in prefixes)).search
+        self.suffix_search = re.compile('|'.join(s + '$' for s in suffixes)).search
+        self.infix_finditer = re.compile('|'.join(infixes)).finditer
+        self.specials = dict((e.replace(' ', ''), e.split(' ')) for e in exceptions)
+        self.cache = {}
+
+    def __call__(self, text):
+        tokens = []
+        if not text:
+            return tokens
+
+        in_space = text[0].isspace()
+        start = 0
+        for i, char in enumerate(text):
+            if char.isspace() != in_space:
+                if start < i:
+                    tokens.extend(self.tokenize_span(text[start:i]))
+                start = i + 1 if char == ' ' else i
+                in_space = not in_space
+        if start < len(text):
+            tokens.extend(self.tokenize_span(text[start:]))
+        return tokens
+
+    def tokenize_span(self, span):
+        if span in self.cache:
+            return self.cache[span]
+        if span in self.specials:
+            return self.specials[span]
+
+        prefixes = []
+        suffixes = []
+        string = self.split_affixes(span, prefixes, suffixes)
+        tokens = prefixes + self.split_infixes(string) + suffixes[::-1]
+        self.cache[span] = tokens
+        return tokens
+
+    def split_affixes(self, string, prefixes, suffixes):
+        last_size = 0
+        while string and len(string) != last_size:
+            last_size = len(string)
+            match = self.prefix_search(string)
+            pre_len = match.end() if match else 0
+            if pre_len:
+                prefix = string[:pre_len]
+                minus_pre = string[pre_len:]
+                if minus_pre in self.specials:
+                    prefixes.append(prefix)
+                    return minus_pre
+
+            match = self.suffix_search(string)
+            suf_len = len(string) - match.start() if match else 0
+            if suf_len:
+                suffix = string[-suf_len:]
+                minus_suf = string[:-suf_len]
+                if minus_suf in self.specials:
+                    suffixes.append(suffix)
+                    return minus_suf
+
+            if pre_len and suf_len and pre_len + suf_len <= len(string):
+                string = string[pre_len:-suf_len]
+                prefixes.append(prefix)
+                suffixes.append(suffix)
+            elif pre_len:
+                string = minus_pre
+                prefixes.append(prefix)
+            elif suf_len:
+                string = minus_suf
+                suffixes.append(suffix)
+
+            if string in self.specials:
+                break
+        return string
+
+    def split_infixes(self, string):
+        if not string:
+            return []
+        if string in self.cache:
+            return self.cache[string]
+        if string in self.specials:
+            return self.specials[string]
+
+        tokens = []
+        start = 0
+        for match in self.infix_finditer(string):
+            # A match at the start of what is left is not split off
+            if match.start() == start:
+                continue
+            tokens.append(string[start:match.start()])
+            tokens.append(match.group())
+            start = match.end()
+        tokens.append(string[start:])
+        return tokens
+
+
+class FastNormalizer(object):
+    """Tokenizes with Tokenizer."""
+
+    name = 'fast'
+
+    def __init__(self):
+        self.tokenizer = Tokenizer()
+
+    def normalize_batch(self, strings):
+        for string in strings:
+            yield ' '.join(token.strip().lower() for token in self.tokenizer(string))
+
+
+class SpacyNormalizer(object):
+    """Tokenizes with the spaCy English pipeline, loaded on first use."""
+
+    name = 'spacy'
+
+    def __init__(self, batch_size=1000, thread_count=5):
+        self.batch_size = batch_size
+        self.thread_count = thread_count
+        self.nlp = None
+
+    def normalize_batch(self, strings):
+        if self.nlp is None:
+            from spacy.en import English
+            self.nlp = English(parser=False)
+
+        for doc in self.nlp.pipe(strings, batch_size=self.batch_size, n_threads=self.thread_count):
+            yield ' '.join(str(w).strip().lower() for w in doc)
+
+
+NORMALIZERS = {'fast': FastNormalizer, 'spacy': SpacyNormalizer}
+_INSTANCES = {}
+
+def get_normalizer(name='spacy'):
+    """Shared normalizer by name, one of NORMALIZERS."""
+
+    if name not in NORMALIZERS:
+        raise ValueError('Unknown normalizer "%s", expected one of %s' % (name, ', '.join(sorted(NORMALIZERS))))
+    if name not in _INSTANCES:
+        _INSTANCES[name] = NORMALIZERS[name]()
+    return _INSTANCES[name]
+
+
+def file_sha1(p_path_to_data):
+    """Hex sha1 of the content of a file."""
+
+    sha1 = hashlib.sha1()
+    with open(p_path_to_data, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class NormalizedFileCache(object):
+    """Results of normalizing files, saved as json under cache_dir.
+
+    Entries are keyed by the sha1 of the file content and the normalizer
+    name, so an edited file or a different normalizer is a miss.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def path(self, p_path_to_data, normalizer_name):
+        return os.path.join(self.cache_dir, 'normalized_%s_%s.json' % (normalizer_name, file_sha1(p_path_to_data)))
+
+    def get(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+
+    def put(self, path, value):
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Written under another name first, so a reader never sees half a file
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(value, cache_file, ensure_ascii=False)
+        os.replace(temp_path, path)
+
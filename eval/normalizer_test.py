@@ -0,0 +1,60 @@
+"""
+This module performs unit tests for normalizer.py .
+
+Command line:
+/ms_marco_metrics$ PYTHONPATH=./bleu python normalizer_test.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ms_marco_eval import load_file
+from normalizer import NormalizedFileCache, Tokenizer, get_normalizer
+
+TEST_DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'sample_test_data')
+
+class Test(unittest.TestCase):
+    """Unit tests for normalizer.py ."""
+
+    def test_tokenizer(self):
+        """Unit test for affixes, infixes and special cases."""
+
+        tokenize = Tokenizer()
+        self.assertEqual(tokenize('"Hello," she said.'), ['"', 'Hello', ',', '"', 'she', 'said', '.'])
+        self.assertEqual(tokenize("Don't (can't) stop!"), ['Do', "n't", '(', 'ca', "n't", ')', 'stop', '!'])
+        self.assertEqual(tokenize('Mr. Smith lives in the U.S.'), ['Mr.', 'Smith', 'lives', 'in', 'the', 'U.S.'])
+        self.assertEqual(tokenize('a well-known 10-20 range'), ['a', 'well', '-', 'known', '10', '-', '20', 'range'])
+        self.assertEqual(tokenize('$3.50 at 5pm...'), ['$', '3.50', 'at', '5', 'pm', '...'])
+        self.assertEqual(tokenize('one  two\nthree'), ['one', ' ', 'two', '\n', 'three'])
+        self.assertEqual(tokenize(''), [])
+
+    def test_normalize_batch(self):
+        """Unit test for stripping and lowercasing, keeping whitespace tokens as empty strings."""
+
+        normalized = list(get_normalizer('fast').normalize_batch(["It's  Fine.", '']))
+        self.assertEqual(normalized, ["it 's  fine .", ''])
+
+    def test_unknown_normalizer(self):
+        """Unit test for a normalizer name that does not exist."""
+
+        self.assertRaises(ValueError, get_normalizer, 'nltk')
+
+    def test_cache(self):
+        """Unit test for loading a normalized file back from the cache."""
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(TEST_DATA_FOLDER, 'no_answer_test_references.json')
+            expected = load_file(path, 'fast')
+            self.assertEqual(load_file(path, 'fast', cache_dir), expected)
+            cache_path = NormalizedFileCache(cache_dir).path(path, 'fast')
+            self.assertTrue(os.path.exists(cache_path))
+            self.assertEqual(load_file(path, 'fast', cache_dir), expected)
+            self.assertNotEqual(NormalizedFileCache(cache_dir).path(path, 'spacy'), cache_path)
+        finally:
+            shutil.rmtree(cache_dir)
+
+if __name__ == '__main__':
+    unittest.main()
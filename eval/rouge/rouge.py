@@ -33,6 +33,36 @@ def my_lcs(string, sub):
 
     return lengths[len(string)][len(sub)]
 
+def match_masks(tokens):
+    """
+    Bit masks of the positions of every distinct token, for lcs_length
+    :param tokens : list of str : tokens from a string split using whitespace
+    :returns: masks (dict of str to int): bit i of masks[t] is set if tokens[i] == t
+    """
+    masks = {}
+    for i, token in enumerate(tokens):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    return masks
+
+def lcs_length(masks, length, string):
+    """
+    Same as my_lcs, using the bit-parallel algorithm of Allison and Dix (1986)
+    in the form given by Hyyro (2004), with Python ints as bit vectors. It takes
+    len(string) big integer operations instead of filling a len(string) by
+    length table.
+    :param masks : dict of str to int : match_masks of the other string
+    :param length : int : number of tokens in the other string
+    :param string : list of str : tokens from a string split using whitespace
+    :returns: length (int): length of the longest common subsequence between the two strings
+    """
+    all_ones = (1 << length) - 1
+    v = all_ones
+    for token in string:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & all_ones
+    # Every zero bit left in v is a matched token
+    return length - bin(v).count('1')
+
 class Rouge():
     '''
     Class for computing ROUGE-L score for a set of candidate sentences for the MS COCO test set
@@ -49,30 +79,47 @@ class Rouge():
         :param refs: list of str : COCO reference sentences for the particular image to be evaluated
         :returns score: int (ROUGE-L score for the candidate evaluated against references)
         """
-        assert(len(candidate)==1)	
-        assert(len(refs)>0)         
-        prec = []
-        rec = []
-
-        # split into tokens
-        token_c = candidate[0].split(" ")
-    	
-        for reference in refs:
-            # split into tokens
-            token_r = reference.split(" ")
-            # compute the longest common subsequence
-            lcs = my_lcs(token_r, token_c)
-            prec.append(lcs/float(len(token_c)))
-            rec.append(lcs/float(len(token_r)))
-
-        prec_max = max(prec)
-        rec_max = max(rec)
-
-        if(prec_max!=0 and rec_max !=0):
-            score = ((1 + self.beta**2)*prec_max*rec_max)/float(rec_max + self.beta**2*prec_max)
-        else:
-            score = 0.0
-        return score
+        assert(len(candidate)==1)
+        assert(len(refs)>0)
+        return float(self.calc_scores([candidate], [refs])[0])
+
+    def calc_scores(self, candidates, refs):
+        """
+        Compute ROUGE-L scores of many candidates at once: the LCS lengths of
+        every candidate and reference pair are collected first, and precision,
+        recall and F are then computed over all of them as arrays
+        :param candidates: list of list of str : one candidate sentence for each example
+        :param refs: list of list of str : reference sentences of each example
+        :returns scores: numpy array of float : ROUGE-L score of each example, as given by calc_score
+        """
+        assert(len(candidates) == len(refs))
+        lcs = []
+        candidate_lengths = []
+        ref_lengths = []
+        starts = []
+        for candidate, references in zip(candidates, refs):
+            assert(len(candidate)==1)
+            assert(len(references)>0)
+            # split into tokens, the candidate's masks serve all its references
+            token_c = candidate[0].split(" ")
+            masks_c = match_masks(token_c)
+            starts.append(len(lcs))
+            for reference in references:
+                token_r = reference.split(" ")
+                # compute the longest common subsequence
+                lcs.append(lcs_length(masks_c, len(token_c), token_r))
+                candidate_lengths.append(len(token_c))
+                ref_lengths.append(len(token_r))
+        if not starts:
+            return np.zeros(0)
+
+        lcs = np.array(lcs, dtype=np.float64)
+        prec_max = np.maximum.reduceat(lcs / np.array(candidate_lengths, dtype=np.float64), starts)
+        rec_max = np.maximum.reduceat(lcs / np.array(ref_lengths, dtype=np.float64), starts)
+
+        nonzero = (prec_max != 0) & (rec_max != 0)
+        denominator = np.where(nonzero, rec_max + self.beta**2*prec_max, 1.0)
+        return np.where(nonzero, ((1 + self.beta**2)*prec_max*rec_max)/denominator, 0.0)
 
     def compute_score(self, gts, res):
         """
@@ -85,21 +132,19 @@ class Rouge():
         assert(list(gts.keys()) == list(res.keys()))
         imgIds = list(gts.keys())
 
-        score = []
         for id in imgIds:
             hypo = res[id]
             ref  = gts[id]
 
-            score.append(self.calc_score(hypo, ref))
-
             # Sanity check.
             assert(type(hypo) is list)
             assert(len(hypo) == 1)
             assert(type(ref) is list)
             assert(len(ref) > 0)
 
-        average_score = np.mean(np.array(score))
-        return average_score, np.array(score)
+        score = self.calc_scores([res[id] for id in imgIds], [gts[id] for id in imgIds])
+        average_score = np.mean(score)
+        return average_score, score
 
     def method(self):
         return "Rouge"
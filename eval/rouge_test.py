@@ -0,0 +1,82 @@
+"""
+This module performs unit tests for rouge/rouge.py .
+
+Command line:
+/ms_marco_metrics$ python rouge_test.py
+"""
+
+import random
+import unittest
+
+from rouge.rouge import Rouge, lcs_length, match_masks, my_lcs
+
+def dp_score(candidate, refs, beta=1.2):
+    """ROUGE-L score of one candidate as calc_score computed it with my_lcs."""
+
+    token_c = candidate[0].split(" ")
+    prec = []
+    rec = []
+    for reference in refs:
+        token_r = reference.split(" ")
+        lcs = my_lcs(token_r, token_c)
+        prec.append(lcs/float(len(token_c)))
+        rec.append(lcs/float(len(token_r)))
+    prec_max = max(prec)
+    rec_max = max(rec)
+    if prec_max != 0 and rec_max != 0:
+        return ((1 + beta**2)*prec_max*rec_max)/float(rec_max + beta**2*prec_max)
+    return 0.0
+
+def lcs(string, sub):
+    """LCS length of two token lists with lcs_length."""
+
+    return lcs_length(match_masks(sub), len(sub), string)
+
+class Test(unittest.TestCase):
+    """Unit tests for rouge/rouge.py ."""
+
+    def test_lcs_examples(self):
+        """Unit test for small known LCS lengths."""
+
+        self.assertEqual(lcs('a b c d'.split(' '), 'a c d'.split(' ')), 3)
+        self.assertEqual(lcs('a b a b'.split(' '), 'b a b a'.split(' ')), 3)
+        self.assertEqual(lcs('a b c'.split(' '), 'x y z'.split(' ')), 0)
+        self.assertEqual(lcs('a b c'.split(' '), []), 0)
+        self.assertEqual(lcs([], 'a b c'.split(' ')), 0)
+
+    def test_lcs_matches_dp(self):
+        """Unit test for bit-parallel LCS against the DP table, including strings longer than a machine word."""
+
+        rng = random.Random(0)
+        for _ in range(300):
+            string = [rng.choice('abcde') for _ in range(rng.randint(1, 150))]
+            sub = [rng.choice('abcdef') for _ in range(rng.randint(1, 150))]
+            self.assertEqual(lcs(string, sub), my_lcs(string, sub))
+            self.assertEqual(lcs(sub, string), my_lcs(string, sub))
+
+    def test_calc_scores(self):
+        """Unit test for batch scores against the my_lcs based scores."""
+
+        rng = random.Random(1)
+        words = ['the', 'cat', 'sat', 'on', 'a', 'mat', '.']
+        candidates = [[' '.join(rng.choice(words) for _ in range(rng.randint(1, 30)))] for _ in range(50)]
+        candidates.append(['dog'])
+        refs = [[' '.join(rng.choice(words) for _ in range(rng.randint(1, 30))) for _ in range(rng.randint(1, 3))]
+                for _ in range(50)]
+        refs.append(['the cat', 'on a mat'])
+
+        rouge = Rouge()
+        scores = rouge.calc_scores(candidates, refs)
+        for i in range(len(candidates)):
+            self.assertAlmostEqual(scores[i], dp_score(candidates[i], refs[i]))
+            self.assertAlmostEqual(rouge.calc_score(candidates[i], refs[i]), dp_score(candidates[i], refs[i]))
+        self.assertEqual(scores[-1], 0.0)
+        self.assertEqual(len(rouge.calc_scores([], [])), 0)
+
+        gts = dict(enumerate(refs))
+        res = dict(enumerate(candidates))
+        average_score, _ = rouge.compute_score(gts, res)
+        self.assertAlmostEqual(average_score, scores.mean())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+"""
+This module scores many candidate files against their reference files in one run.
+
+Candidate files are named <reference_name>_<model>.json, as the training
+scripts write them to candidates/ for the references in references/. Every
+reference file is loaded, normalized and cooked for BLEU once, and so is
+every candidate file, all in this process, so that workers never load a
+normalizer or write to the cache. The candidates are scored in a process
+pool.
+
+Command line:
+/ms_marco_metrics$ PYTHONPATH=./bleu python score_matrix.py --references <reference_files_or_directory>
+    --candidates <candidate_files_or_directory> [--normalizer fast|spacy] [--cache_dir <path_to_cache_directory>]
+    [--process_count <n>] [--csv <path_to_csv_file>]
+"""
+
+from __future__ import print_function
+
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+
+from bleu.fast_bleu import FastBleu
+from ms_marco_eval import DEFAULT_NORMALIZER, MAX_BLEU_ORDER, compute_metrics, load_file
+
+REFERENCES = None
+BLEU_SCORER = None
+
+def list_files(p_paths):
+    """Json files of a list of files and directories."""
+
+    files = []
+    for path in p_paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*.json'))))
+        else:
+            files.append(path)
+    return files
+
+def match_candidates(p_reference_files, p_candidate_files):
+    """Pair every candidate file with its reference file.
+
+    Args:
+    p_reference_files (list): paths of <reference_name>.json files.
+    p_candidate_files (list): paths of <reference_name>_<model>.json files.
+
+    Returns:
+    list: (reference_name, model, path_to_candidate_file) tuples.
+    """
+
+    reference_names = [os.path.splitext(os.path.basename(path))[0] for path in p_reference_files]
+    pairs = []
+    for path in p_candidate_files:
+        name = os.path.splitext(os.path.basename(path))[0]
+        # The longest reference name is the most specific
+        matches = [reference for reference in reference_names if name.startswith(reference + '_')]
+        assert matches, 'No reference file for candidate file \"%s\"' % path
+        reference = max(matches, key=len)
+        pairs.append((reference, name[len(reference) + 1:], path))
+    return pairs
+
+def init_worker(p_references, p_bleu_scorer):
+    """Keep the normalized references in the worker, and the BLEU scorer
+    holding their cooked references."""
+
+    global REFERENCES, BLEU_SCORER
+    REFERENCES = p_references
+    BLEU_SCORER = p_bleu_scorer
+
+def cook_references(p_references, p_max_bleu_order, p_cache_dir):
+    """A BLEU scorer with every reference set cooked, or loaded from
+    p_cache_dir, under the same keys as compute_metrics looks them up by.
+
+    Args:
+    p_references (dict): reference name to the normalized reference
+        dictionary and no-answer query ids, as load_file returns them.
+    p_max_bleu_order: the maximum n order in bleu_n calculation.
+    p_cache_dir (str): directory to keep cooked references in.
+
+    Returns:
+    FastBleu: the scorer, without a cache directory, so that copies of it
+        in workers never write to the cache.
+    """
+
+    bleu_scorer = FastBleu(p_max_bleu_order, p_cache_dir)
+    for reference_dictionary, reference_no_answer_query_ids in p_references.values():
+        filtered_reference_dictionary = {key: value for key, value in reference_dictionary.items() \
+                                         if key not in reference_no_answer_query_ids}
+        if filtered_reference_dictionary:
+            bleu_scorer.cook_refs(list(filtered_reference_dictionary.keys()), filtered_reference_dictionary)
+    bleu_scorer.cache_dir = None
+    return bleu_scorer
+
+def score_candidate(p_task):
+    """Score one normalized candidate file in a worker."""
+
+    reference, model, candidate_dictionary, max_bleu_order = p_task
+    reference_dictionary, reference_no_answer_query_ids = REFERENCES[reference]
+    scores = compute_metrics(reference_dictionary,
+                             reference_no_answer_query_ids,
+                             candidate_dictionary,
+                             max_bleu_order,
+                             p_bleu_scorer=BLEU_SCORER)
+    return reference, model, scores
+
+def compute_metrics_matrix(p_reference_files,
+                           p_candidate_files,
+                           p_max_bleu_order=MAX_BLEU_ORDER,
+                           p_cache_dir=None,
+                           p_normalizer=DEFAULT_NORMALIZER,
+                           p_process_count=1):
+    """Compute BLEU-N and ROUGE-L metrics of every candidate file.
+
+    Args:
+    p_reference_files (list): paths of reference files.
+    p_candidate_files (list): paths of candidate files, named after their
+        reference file as <reference_name>_<model>.json .
+    p_max_bleu_order: the maximum n order in bleu_n calculation.
+    p_cache_dir (str): directory to keep normalized and cooked references in.
+    p_normalizer (str): name of the normalizer, 'fast' or 'spacy'.
+    p_process_count (int): number of processes to score candidate files in.
+
+    Returns:
+    dict: dictionary of {(reference_name, model): {'bleu_n': <bleu_n score>, 'rouge_l': <rouge_l score>}}
+    """
+
+    pairs = match_candidates(p_reference_files, p_candidate_files)
+    needed = set(reference for reference, _, _ in pairs)
+    references = {}
+    for path in p_reference_files:
+        reference = os.path.splitext(os.path.basename(path))[0]
+        if reference in needed:
+            references[reference] = load_file(path, p_normalizer, p_cache_dir)
+
+    bleu_scorer = cook_references(references, p_max_bleu_order, p_cache_dir)
+
+    # Normalized here, so that workers don't each load a normalizer such as spaCy
+    tasks = [(reference, model, load_file(path, p_normalizer)[0], p_max_bleu_order)
+             for reference, model, path in sorted(pairs)]
+    if p_process_count > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(p_process_count, len(tasks)), init_worker, (references, bleu_scorer))
+        try:
+            results = pool.map(score_candidate, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        init_worker(references, bleu_scorer)
+        results = [score_candidate(task) for task in tasks]
+
+    return {(reference, model): scores for reference, model, scores in results}
+
+def format_table(p_metrics):
+    """One row per reference and model, one column per metric."""
+
+    metric_names = sorted(next(iter(p_metrics.values()))) if p_metrics else []
+    rows = [['reference', 'model'] + metric_names]
+    for reference, model in sorted(p_metrics):
+        scores = p_metrics[(reference, model)]
+        rows.append([reference, model] + ['%.5f' % scores[name] for name in metric_names])
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() for row in rows)
+
+def main():
+    """Command line: /ms_marco_metrics$ PYTHONPATH=./bleu python score_matrix.py --references <paths> --candidates <paths>"""
+
+    parser = argparse.ArgumentParser(description='Computes BLEU-N and ROUGE-L metrics of many candidate files.')
+    parser.add_argument('--references', '-r', nargs='+', required=True) # e.g. ../references
+    parser.add_argument('--candidates', '-a', nargs='+', required=True) # e.g. ../candidates
+    parser.add_argument('--normalizer', '-n', default=DEFAULT_NORMALIZER, choices=['fast', 'spacy'])
+    parser.add_argument('--cache_dir', '-c', default=None) # keeps normalized and cooked references
+    parser.add_argument('--process_count', '-p', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--csv', default=None) # also writes the table to a csv file
+    config = parser.parse_args()
+
+    metrics = compute_metrics_matrix(list_files(config.references),
+                                     list_files(config.candidates),
+                                     MAX_BLEU_ORDER,
+                                     config.cache_dir,
+                                     config.normalizer,
+                                     config.process_count)
+    print(format_table(metrics))
+
+    if config.csv:
+        metric_names = sorted(next(iter(metrics.values()))) if metrics else []
+        with open(config.csv, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['reference', 'model'] + metric_names)
+            for reference, model in sorted(metrics):
+                writer.writerow([reference, model] + [metrics[(reference, model)][name] for name in metric_names])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+This module performs unit tests for score_matrix.py .
+
+Command line:
+/ms_marco_metrics$ PYTHONPATH=./bleu python score_matrix_test.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ms_marco_eval import compute_metrics_from_files
+from score_matrix import compute_metrics_matrix, match_candidates
+
+TEST_DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'sample_test_data')
+MAX_BLEU_ORDER = 4
+
+class Test(unittest.TestCase):
+    """Unit tests for score_matrix.py ."""
+
+    def test_match_candidates(self):
+        """Unit test for pairing candidate files with the longest matching reference name."""
+
+        pairs = match_candidates(['references/entity.json', 'references/entity_people.json'],
+                                 ['candidates/entity_bidaf.json', 'candidates/entity_people_bidaf_v2.json'])
+        self.assertEqual(pairs, [('entity', 'bidaf', 'candidates/entity_bidaf.json'),
+                                 ('entity_people', 'bidaf_v2', 'candidates/entity_people_bidaf_v2.json')])
+        self.assertRaises(AssertionError, match_candidates, ['references/entity.json'], ['candidates/person_bidaf.json'])
+
+    def test_matrix(self):
+        """Unit test for scores of every pair against scoring the files one pair at a time."""
+
+        directory = tempfile.mkdtemp()
+        try:
+            files = {'dev': 'dev_as_references.json', 'dev_first_sentence': 'dev_first_sentence_as_candidates.json',
+                     'same': 'same_answer_test_references.json', 'same_answer': 'same_answer_test_candidates.json',
+                     'sample': 'sample_references.json',
+                     'sample_model': 'sample_candidates.json'}
+            for name, test_data_file in files.items():
+                shutil.copy(os.path.join(TEST_DATA_FOLDER, test_data_file), os.path.join(directory, name + '.json'))
+            references = [os.path.join(directory, name + '.json') for name in ['dev', 'same', 'sample']]
+            candidates = [os.path.join(directory, name + '.json') for name in ['dev_first_sentence', 'same_answer', 'sample_model']]
+
+            for process_count in [1, 2]:
+                metrics = compute_metrics_matrix(references, candidates, MAX_BLEU_ORDER,
+                                                 p_process_count=process_count)
+                self.assertEqual(sorted(metrics), [('dev', 'first_sentence'), ('same', 'answer'), ('sample', 'model')])
+                for (reference, model), scores in metrics.items():
+                    expected = compute_metrics_from_files(os.path.join(directory, reference + '.json'),
+                                                          os.path.join(directory, '%s_%s.json' % (reference, model)),
+                                                          MAX_BLEU_ORDER)
+                    self.assertEqual(scores, expected)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_cache(self):
+        """Unit test for cooking each reference set once, before the workers
+        score the candidates against it."""
+
+        directory = tempfile.mkdtemp()
+        try:
+            files = {'same': 'same_answer_test_references.json', 'same_answer': 'same_answer_test_candidates.json',
+                     'sample': 'sample_references.json',
+                     'sample_model': 'sample_candidates.json'}
+            for name, test_data_file in files.items():
+                shutil.copy(os.path.join(TEST_DATA_FOLDER, test_data_file), os.path.join(directory, name + '.json'))
+            references = [os.path.join(directory, name + '.json') for name in ['same', 'sample']]
+            candidates = [os.path.join(directory, name + '.json') for name in ['same_answer', 'sample_model']]
+            cache_dir = os.path.join(directory, 'cache')
+
+            expected = compute_metrics_matrix(references, candidates, MAX_BLEU_ORDER, p_normalizer='fast')
+            metrics = compute_metrics_matrix(references, candidates, MAX_BLEU_ORDER, cache_dir, 'fast', 2)
+            self.assertEqual(metrics, expected)
+            cooked = [name for name in os.listdir(cache_dir) if name.startswith('cooked_refs_')]
+            self.assertEqual(sorted(os.path.splitext(name)[1] for name in cooked), ['.json', '.json', '.npz', '.npz'])
+            self.assertEqual(compute_metrics_matrix(references, candidates, MAX_BLEU_ORDER, cache_dir, 'fast', 2),
+                             expected)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+"""
+This module tests whether differences in BLEU-N and ROUGE-L between systems are significant.
+
+Queries are resampled with replacement many times (paired bootstrap), with
+the same resamples for every system. Each resample is a row of an index
+matrix, turned into the number of times every query is drawn, so the corpus
+scores of all resamples are matrix products with per-query statistics:
+BLEU sufficient statistics (test and reference lengths, guess and correct
+n-gram counts), from which corpus BLEU is recomputed exactly as
+compute_score does, and ROUGE-L. Per-query statistics are kept under
+cache_dir, keyed by the content of the reference and candidate files.
+
+Command line:
+/ms_marco_metrics$ PYTHONPATH=./bleu python significance.py <path_to_reference_file> <path_to_candidate_file>
+    <path_to_candidate_file> [...] [--samples 10000] [--confidence 0.95] [--seed 0] [--cache_dir <path_to_cache_directory>]
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import os
+
+import numpy as np
+
+from bleu.fast_bleu import FastBleu
+from ms_marco_eval import DEFAULT_NORMALIZER, MAX_BLEU_ORDER, filter_dictionaries, load_file
+from normalizer import file_sha1
+from rouge.rouge import Rouge
+
+STAT_KEYS = ['testlen', 'reflen', 'guess', 'correct', 'rouge_l']
+
+def compute_query_stats(p_reference_dictionary,
+                        p_reference_no_answer_query_ids,
+                        p_candidate_dictionary,
+                        p_max_bleu_order=MAX_BLEU_ORDER,
+                        p_bleu_scorer=None):
+    """Per-query statistics of normalized answers, in the order of the references.
+
+    Returns:
+    dict: 'testlen' and 'reflen' of shape [queries], 'guess' and 'correct' of
+        shape [queries, p_max_bleu_order], and 'rouge_l' of shape [queries].
+    """
+
+    reference_dictionary, candidate_dictionary = \
+        filter_dictionaries(p_reference_dictionary, p_reference_no_answer_query_ids, p_candidate_dictionary)
+    bleu_scorer = p_bleu_scorer or FastBleu(p_max_bleu_order)
+    stats = bleu_scorer.compute_stats(reference_dictionary, candidate_dictionary)
+    _, stats['rouge_l'] = Rouge().compute_score(reference_dictionary, candidate_dictionary)
+    return stats
+
+def load_query_stats(p_path_to_reference_file,
+                     p_path_to_candidate_file,
+                     p_max_bleu_order=MAX_BLEU_ORDER,
+                     p_normalizer=DEFAULT_NORMALIZER,
+                     p_cache_dir=None,
+                     p_bleu_scorer=None):
+    """Per-query statistics of a candidate file, from the cache if it has them."""
+
+    cache_path = None
+    if p_cache_dir:
+        key = hashlib.sha1(('%s %s %s %d' % (file_sha1(p_path_to_reference_file),
+                                             file_sha1(p_path_to_candidate_file),
+                                             p_normalizer, p_max_bleu_order)).encode('utf-8')).hexdigest()
+        cache_path = os.path.join(p_cache_dir, 'query_stats_%s.npz' % key)
+        if os.path.exists(cache_path):
+            arrays = np.load(cache_path)
+            return {stat: arrays[stat] for stat in STAT_KEYS}
+
+    reference_dictionary, reference_no_answer_query_ids = \
+        load_file(p_path_to_reference_file, p_normalizer, p_cache_dir)
+    candidate_dictionary, _ = load_file(p_path_to_candidate_file, p_normalizer)
+    stats = compute_query_stats(reference_dictionary, reference_no_answer_query_ids, candidate_dictionary,
+                                p_max_bleu_order, p_bleu_scorer)
+
+    if cache_path is not None:
+        if not os.path.exists(p_cache_dir):
+            os.makedirs(p_cache_dir)
+        np.savez(cache_path, **stats)
+    return stats
+
+def resample_counts(p_query_count, p_samples, p_seed=0, p_chunk_size=1000):
+    """Yield how often every query is drawn in each resample, for chunks of resamples.
+
+    Returns:
+    iter: arrays of shape [<= p_chunk_size, p_query_count].
+    """
+
+    rng = np.random.RandomState(p_seed)
+    for start in range(0, p_samples, p_chunk_size):
+        rows = min(p_chunk_size, p_samples - start)
+        indices = rng.randint(0, p_query_count, size=(rows, p_query_count))
+        indices += np.arange(rows)[:, None] * p_query_count
+        yield np.bincount(indices.ravel(), minlength=rows * p_query_count).reshape(rows, p_query_count)
+
+def corpus_bleu(p_testlen, p_reflen, p_guess, p_correct):
+    """Corpus BLEU-1..n of many corpora at once from their summed statistics,
+    computed as score_stats does.
+
+    Args:
+    p_testlen, p_reflen (numpy.ndarray): shape [corpora].
+    p_guess, p_correct (numpy.ndarray): shape [corpora, n].
+
+    Returns:
+    numpy.ndarray: shape [corpora, n].
+    """
+
+    small = 1e-9
+    tiny = 1e-15
+    orders = np.arange(1, p_guess.shape[1] + 1)
+    bleus = np.cumprod((p_correct + tiny) / (p_guess + small), axis=1) ** (1. / orders)
+    ratio = (p_testlen + tiny) / (p_reflen + small)
+    with np.errstate(over='ignore'):
+        brevity = np.where(ratio < 1, np.exp(1 - 1 / ratio), 1.)
+    return bleus * brevity[:, None]
+
+def corpus_scores(p_stats, p_counts):
+    """BLEU-1..n and ROUGE-L of corpora made of queries repeated p_counts times.
+
+    Args:
+    p_stats (dict): per-query statistics, from compute_query_stats.
+    p_counts (numpy.ndarray): shape [corpora, queries].
+
+    Returns:
+    numpy.ndarray: shape [corpora, n + 1], BLEU-1..n then ROUGE-L.
+    """
+
+    n = p_stats['guess'].shape[1]
+    columns = np.column_stack([p_stats['testlen'], p_stats['reflen'], p_stats['guess'], p_stats['correct'],
+                               p_stats['rouge_l']]).astype(np.float64)
+    # Counts are exact in float64, and the product runs on BLAS
+    totals = p_counts.astype(np.float64).dot(columns)
+    bleus = corpus_bleu(totals[:, 0], totals[:, 1], totals[:, 2:2 + n], totals[:, 2 + n:2 + 2 * n])
+    rouge = totals[:, -1] / p_counts.sum(axis=1)
+    return np.column_stack([bleus, rouge])
+
+def bootstrap(p_stats_list, p_samples=10000, p_seed=0, p_chunk_size=1000):
+    """Scores of every system on the same resamples of the queries.
+
+    Returns:
+    observed (list): shape [n + 1] arrays, the scores of each system on all queries.
+    resampled (list): shape [p_samples, n + 1] arrays, its scores on each resample.
+    """
+
+    query_count = len(p_stats_list[0]['testlen'])
+    for stats in p_stats_list:
+        assert len(stats['testlen']) == query_count, 'Systems must be scored on the same queries'
+
+    observed = [corpus_scores(stats, np.ones((1, query_count)))[0] for stats in p_stats_list]
+    chunks = [[] for _ in p_stats_list]
+    for counts in resample_counts(query_count, p_samples, p_seed, p_chunk_size):
+        for i, stats in enumerate(p_stats_list):
+            chunks[i].append(corpus_scores(stats, counts))
+    return observed, [np.concatenate(chunk) for chunk in chunks]
+
+def compare(p_observed_a, p_resampled_a, p_observed_b, p_resampled_b, p_confidence=0.95):
+    """Confidence intervals of two systems and of their difference, and the
+    two-sided p-value of the difference, for every metric.
+
+    Returns:
+    list: one dict per metric with 'a', 'b' and 'delta' (b - a), each with
+        '_low' and '_high' bounds, and 'p_value'.
+    """
+
+    alpha = (1 - p_confidence) / 2 * 100
+    deltas = p_resampled_b - p_resampled_a
+    a_low, a_high = np.percentile(p_resampled_a, [alpha, 100 - alpha], axis=0)
+    b_low, b_high = np.percentile(p_resampled_b, [alpha, 100 - alpha], axis=0)
+    delta_low, delta_high = np.percentile(deltas, [alpha, 100 - alpha], axis=0)
+    # How often the difference vanishes or flips sign, on either side
+    p_values = np.minimum(1, 2 * np.minimum((deltas <= 0).mean(axis=0), (deltas >= 0).mean(axis=0)))
+
+    comparisons = []
+    for m in range(len(p_observed_a)):
+        comparisons.append({'a': p_observed_a[m], 'a_low': a_low[m], 'a_high': a_high[m],
+                            'b': p_observed_b[m], 'b_low': b_low[m], 'b_high': b_high[m],
+                            'delta': p_observed_b[m] - p_observed_a[m],
+                            'delta_low': delta_low[m], 'delta_high': delta_high[m],
+                            'p_value': p_values[m]})
+    return comparisons
+
+def main():
+    """Command line: /ms_marco_metrics$ PYTHONPATH=./bleu python significance.py <path_to_reference_file> <path_to_candidate_file> <path_to_candidate_file>"""
+
+    parser = argparse.ArgumentParser(description='Compares candidate files with a paired bootstrap over queries.')
+    parser.add_argument('path_to_reference_file')
+    parser.add_argument('paths_to_candidate_files', nargs='+') # the first is compared with each of the others
+    parser.add_argument('--samples', '-s', type=int, default=10000)
+    parser.add_argument('--confidence', '-ci', type=float, default=0.95)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--normalizer', '-n', default=DEFAULT_NORMALIZER, choices=['fast', 'spacy'])
+    parser.add_argument('--cache_dir', '-c', default=None) # keeps normalized references and per-query statistics
+    config = parser.parse_args()
+    assert len(config.paths_to_candidate_files) >= 2, 'Expected at least two candidate files to compare'
+
+    bleu_scorer = FastBleu(MAX_BLEU_ORDER)
+    stats_list = [load_query_stats(config.path_to_reference_file, path, MAX_BLEU_ORDER, config.normalizer,
+                                   config.cache_dir, bleu_scorer)
+                  for path in config.paths_to_candidate_files]
+    observed, resampled = bootstrap(stats_list, config.samples, config.seed)
+
+    metric_names = ['bleu_%d' % (i + 1) for i in range(MAX_BLEU_ORDER)] + ['rouge_l']
+    baseline = config.paths_to_candidate_files[0]
+    for i, path in enumerate(config.paths_to_candidate_files[1:], 1):
+        print('############################')
+        print('a: %s' % baseline)
+        print('b: %s' % path)
+        print('%d resamples of %d queries, %g%% intervals' % (config.samples, len(stats_list[0]['testlen']),
+                                                             config.confidence * 100))
+        print('%-8s %-26s %-26s %-28s %s' % ('metric', 'a', 'b', 'b - a', 'p'))
+        comparisons = compare(observed[0], resampled[0], observed[i], resampled[i], config.confidence)
+        for name, c in zip(metric_names, comparisons):
+            print('%-8s %.5f [%.5f, %.5f] %.5f [%.5f, %.5f] %+.5f [%+.5f, %+.5f] %.4f' % (
+                name, c['a'], c['a_low'], c['a_high'], c['b'], c['b_low'], c['b_high'],
+                c['delta'], c['delta_low'], c['delta_high'], c['p_value']))
+    print('############################')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+This module performs unit tests for significance.py .
+
+Command line:
+/ms_marco_metrics$ PYTHONPATH=./bleu python significance_test.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from bleu.fast_bleu import score_stats
+from ms_marco_eval import compute_metrics_from_files
+from significance import bootstrap, compare, corpus_scores, load_query_stats, resample_counts
+
+TEST_DATA_FOLDER = os.path.join(os.path.dirname(__file__), 'sample_test_data')
+REFERENCE_FILE = os.path.join(TEST_DATA_FOLDER, 'dev_as_references.json')
+CANDIDATE_FILE = os.path.join(TEST_DATA_FOLDER, 'dev_first_sentence_as_candidates.json')
+MAX_BLEU_ORDER = 4
+
+class Test(unittest.TestCase):
+    """Unit tests for significance.py ."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stats = load_query_stats(REFERENCE_FILE, CANDIDATE_FILE, MAX_BLEU_ORDER)
+
+    def test_observed_scores(self):
+        """Unit test for corpus scores from per-query statistics against ms_marco_eval.py ."""
+
+        scores = corpus_scores(self.stats, np.ones((1, len(self.stats['testlen']))))[0]
+        expected = compute_metrics_from_files(REFERENCE_FILE, CANDIDATE_FILE, MAX_BLEU_ORDER)
+        for i in range(MAX_BLEU_ORDER):
+            self.assertAlmostEqual(scores[i], expected['bleu_%d' % (i + 1)], places=12)
+        self.assertAlmostEqual(scores[-1], expected['rouge_l'], places=12)
+
+    def test_resampled_scores(self):
+        """Unit test for the scores of a resample against scoring the resampled queries directly."""
+
+        query_count = len(self.stats['testlen'])
+        indices = np.random.RandomState(1).randint(0, query_count, size=query_count)
+        counts = np.bincount(indices, minlength=query_count)[None, :]
+        scores = corpus_scores(self.stats, counts)[0]
+
+        bleus, _ = score_stats({key: self.stats[key][indices] for key in ['testlen', 'reflen', 'guess', 'correct']})
+        for i in range(MAX_BLEU_ORDER):
+            self.assertAlmostEqual(scores[i], bleus[i], places=12)
+        self.assertAlmostEqual(scores[-1], self.stats['rouge_l'][indices].mean(), places=12)
+
+    def test_resample_counts(self):
+        """Unit test for resamples drawing every query count times in total, the same for a seed."""
+
+        chunks = list(resample_counts(50, 25, p_seed=3, p_chunk_size=10))
+        self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+        for chunk in chunks:
+            self.assertTrue((chunk.sum(axis=1) == 50).all())
+        again = list(resample_counts(50, 25, p_seed=3, p_chunk_size=10))
+        self.assertTrue(all((a == b).all() for a, b in zip(chunks, again)))
+
+    def test_compare(self):
+        """Unit test for comparing a system with itself and with a worse one."""
+
+        worse = dict(self.stats, correct=self.stats['correct'] // 2, rouge_l=self.stats['rouge_l'] / 2)
+        observed, resampled = bootstrap([self.stats, self.stats, worse], p_samples=200)
+
+        for c in compare(observed[0], resampled[0], observed[1], resampled[1]):
+            self.assertEqual(c['delta'], 0)
+            self.assertEqual(c['p_value'], 1)
+            self.assertTrue(c['a_low'] <= c['a'] <= c['a_high'])
+
+        for c in compare(observed[0], resampled[0], observed[2], resampled[2]):
+            self.assertLess(c['delta'], 0)
+            self.assertLess(c['delta_high'], 0)
+            self.assertEqual(c['p_value'], 0)
+
+    def test_cache(self):
+        """Unit test for per-query statistics loaded back from the cache."""
+
+        cache_dir = tempfile.mkdtemp()
+        try:
+            first = load_query_stats(REFERENCE_FILE, CANDIDATE_FILE, MAX_BLEU_ORDER, p_cache_dir=cache_dir)
+            self.assertEqual(len([f for f in os.listdir(cache_dir) if f.startswith('query_stats_')]), 1)
+            second = load_query_stats(REFERENCE_FILE, CANDIDATE_FILE, MAX_BLEU_ORDER, p_cache_dir=cache_dir)
+            for key in first:
+                self.assertTrue((first[key] == second[key]).all())
+                self.assertTrue((first[key] == self.stats[key]).all())
+        finally:
+            shutil.rmtree(cache_dir)
+
+if __name__ == '__main__':
+    unittest.main()
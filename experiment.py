@@ -1,4 +1,7 @@
 import argparse
+import json
+import math
+import os
 import subprocess
 
 
@@ -39,8 +42,12 @@ def get_args():
     parser.add_argument('--batch_size', '-bs', type=int, default=256, nargs='+')
     parser.add_argument('--learning_rate', '-lr', type=float, default=0.01, nargs='+')
     parser.add_argument('--model', '-m', default='baseline', nargs='+', choices=MODELS + ['all'])
-    parser.add_argument('--cell', '-c', default='lstm', choices=['lstm', 'gru'], nargs='+')
+    parser.add_argument('--cell', '-c', default=None, nargs='+',
+                        choices=['lstm', 'gru', 'lstm_block', 'gru_block', 'lstm_fused'])
     parser.add_argument('--highway_network', '-hwn', type=int, default=1)
+    parser.add_argument('--search', '-s', default='grid', choices=['grid', 'halving'])
+    parser.add_argument('--min_epochs', '-me', type=int, default=1)
+    parser.add_argument('--reduction_factor', '-rf', type=int, default=3)
 
     args = vars(parser.parse_args())
     if 'all' in args['question_type']:
@@ -53,6 +60,8 @@ def get_args():
 
 def format_args(args):
     for name, value in args.items():
+        if value is None:
+            continue
         yield '--{}'.format(name)
         yield str(value)
 
@@ -64,13 +73,100 @@ def get_experiment_name(options, non_default_args):
     return '{}-{}'.format(options['model'], option_summary)
 
 
-args = get_args()
-non_default_args = [name for name, value in args.items()
-                    if isinstance(value, list)]
+def get_save_model_path(options):
+    # Must match the path main.py saves checkpoints to
+    return './saved_models/{}_{}.json'.format(options['question_type'],
+                                              options['tensorboard_name'])
 
-for options in get_permutations(args):
-    print(options)
-    options['tensorboard_name'] = get_experiment_name(options, non_default_args)
-    args = ['python', 'main.py'] + list(format_args(options))
-    subprocess.call(args)
 
+def run_trial(options, epochs, resume):
+    """ Trains a configuration for `epochs` more epochs, continuing from its
+        last checkpoint if `resume` is set, and returns its best validation
+        loss so far.
+    """
+
+    trial_options = options.copy()
+    trial_options['epochs'] = epochs
+    trial_options['load_model'] = int(resume)
+    trial_options['predict'] = 0
+
+    # A fresh trial must not report the results of an earlier search with the same options
+    results_path = get_save_model_path(options) + '/results.json'
+    if not resume and os.path.exists(results_path):
+        os.remove(results_path)
+
+    if subprocess.call(['python', 'main.py'] + list(format_args(trial_options))) != 0:
+        print('Trial failed: {}'.format(options['tensorboard_name']))
+        return float('Inf')
+    if not os.path.exists(results_path):
+        return float('Inf')
+    with open(results_path, encoding='utf-8') as f:
+        return json.load(f)['min_val_loss']
+
+
+def successive_halving(trials, min_epochs, max_epochs, reduction_factor):
+    """ Trains every trial for `min_epochs`, then repeatedly keeps the best
+        1 / `reduction_factor` of them by validation loss and trains the
+        survivors for `reduction_factor` times as many epochs in total, until
+        `max_epochs` is reached or a single trial is left.
+    """
+
+    trained_epochs = {trial['tensorboard_name']: 0 for trial in trials}
+    budget = min(min_epochs, max_epochs)
+
+    while True:
+        print('Training {} trials to {} epochs'.format(len(trials), budget))
+        losses = {}
+        for trial in trials:
+            name = trial['tensorboard_name']
+            print(trial)
+            losses[name] = run_trial(trial, budget - trained_epochs[name],
+                                     resume=trained_epochs[name] > 0)
+            trained_epochs[name] = budget
+
+        trials = sorted(trials, key=lambda t: losses[t['tensorboard_name']])
+        for trial in trials:
+            print('{:.4f}\t{}'.format(losses[trial['tensorboard_name']],
+                                      trial['tensorboard_name']))
+
+        if budget >= max_epochs or len(trials) == 1:
+            return trials
+
+        trials = trials[:int(math.ceil(len(trials) / reduction_factor))]
+        budget = min(budget * reduction_factor, max_epochs)
+
+
+def main():
+    args = get_args()
+    search = args.pop('search')
+    min_epochs = args.pop('min_epochs')
+    reduction_factor = args.pop('reduction_factor')
+
+    if search == 'halving':
+        # Epochs are the maximum budget rather than an option to search over
+        epochs = args.pop('epochs')
+        max_epochs = max(epochs) if isinstance(epochs, list) else epochs
+
+    non_default_args = [name for name, value in args.items()
+                        if isinstance(value, list)]
+
+    trials = []
+    for options in get_permutations(args):
+        options['tensorboard_name'] = get_experiment_name(options, non_default_args)
+        trials.append(options)
+
+    if search == 'halving':
+        # Validation losses are only comparable within a question type
+        for question_type in sorted(set(t['question_type'] for t in trials)):
+            best = successive_halving([t for t in trials if t['question_type'] == question_type],
+                                      min_epochs, max_epochs, reduction_factor)
+            print('Best configuration for {}:'.format(question_type), best[0])
+    else:
+        for options in trials:
+            print(options)
+            args = ['python', 'main.py'] + list(format_args(options))
+            subprocess.call(args)
+
+
+if __name__ == '__main__':
+    main()
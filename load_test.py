@@ -0,0 +1,174 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+STAGES = ['tokenize', 'relevance', 'vectorize', 'model', 'decode']
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Replays MS MARCO queries against the answering path and '
+                                                 'reports throughput and latency.')
+    parser.add_argument('queries') # e.g. ./datasets/msmarco/dev/location.json
+    parser.add_argument('--url', '-u', default=None) # e.g. http://127.0.0.1:8000, otherwise runs in-process
+    parser.add_argument('--model_path', '-m', default=None) # for in-process runs
+    parser.add_argument('--requests', '-n', type=int, default=1000)
+    parser.add_argument('--concurrency', '-c', type=int, default=8)
+    parser.add_argument('--rate', '-r', type=float, default=0) # requests/sec, 0 sends as fast as possible
+    parser.add_argument('--warmup', '-wu', type=int, default=10) # requests left out of the report
+    parser.add_argument('--max_batch_size', '-b', type=int, default=64)
+    parser.add_argument('--max_wait_ms', '-w', type=float, default=5.0)
+    parser.add_argument('--output', '-o', default='./benchmarks/load_test.json')
+    parser.add_argument('--baseline', '-bl', default=None)
+    parser.add_argument('--tolerance', '-tol', type=float, default=0.2) # allowed latency increase
+
+    return parser
+
+
+def load_requests(path, limit):
+    '''Cycles through the queries of an MS MARCO JSONL file until there are
+       limit requests.
+    '''
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            sample = json.loads(line)
+            requests.append({'query_id': sample['query_id'], 'question': sample['query'],
+                             'passages': [p['passage_text'] for p in sample['passages']]})
+    if not requests:
+        raise ValueError('No queries in {}'.format(path))
+    return [requests[i % len(requests)] for i in range(limit)]
+
+
+def http_client(url):
+    def send(request):
+        body = json.dumps(request).encode('utf-8')
+        http_request = urllib.request.Request(url.rstrip('/') + '/answer', data=body,
+                                              headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(http_request) as response:
+            return json.loads(response.read().decode('utf-8'))
+    return send
+
+
+def in_process_client(model_path, max_batch_size, max_wait):
+    from server import Reader
+
+    reader = Reader(model_path, max_batch_size, max_wait)
+    return lambda request: reader.answer(request['question'], request['passages'])
+
+
+def run(send, requests, concurrency, rate):
+    '''Sends the requests from concurrency threads and returns the latency
+       and stage timings of each one. With a rate, request i is due at
+       i / rate seconds, and its latency is measured from then rather than
+       from when a thread got to it, so a slow server can't hide its queueing
+       delay by slowing the load down.
+    '''
+    results = [None] * len(requests)
+    start = time.perf_counter()
+
+    def worker(i):
+        due = start + i / rate if rate else time.perf_counter()
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        try:
+            response = send(requests[i])
+            results[i] = {'latency': time.perf_counter() - due, 'timing': response.get('timing', {})}
+        except Exception as e:
+            results[i] = {'latency': time.perf_counter() - due, 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(len(requests))))
+
+    return results, time.perf_counter() - start
+
+
+def percentiles(values):
+    values = np.array(values) * 1000
+    if len(values) == 0:
+        return {}
+    return {'mean': float(values.mean()),
+            'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(values.max())}
+
+
+def report(results, seconds, warmup):
+    measured = results[warmup:]
+    ok = [r for r in measured if 'error' not in r]
+    stages = dict((stage, percentiles([r['timing'][stage] for r in ok if stage in r['timing']]))
+                  for stage in STAGES)
+    return {
+        'requests': len(measured),
+        'errors': len(measured) - len(ok),
+        'throughput': len(results) / seconds,
+        'latency_ms': percentiles([r['latency'] for r in ok]),
+        'stages_ms': dict((stage, values) for stage, values in stages.items() if values),
+    }
+
+
+def print_report(summary):
+    print('{} requests, {} errors, {:.1f} requests/sec'.format(summary['requests'], summary['errors'],
+                                                              summary['throughput']))
+    print('{:12} {:>10} {:>10} {:>10} {:>10}'.format('ms', 'mean', 'p50', 'p90', 'p99'))
+    rows = [('total', summary['latency_ms'])] + [(stage, summary['stages_ms'][stage])
+                                                 for stage in STAGES if stage in summary['stages_ms']]
+    for name, values in rows:
+        if values:
+            print('{:12} {:10.2f} {:10.2f} {:10.2f} {:10.2f}'.format(name, values['mean'], values['p50'],
+                                                                    values['p90'], values['p99']))
+
+
+def compare(summary, baseline, tolerance):
+    '''Returns the latency percentiles that grew by more than the tolerance.'''
+    regressions = []
+    for name in ['p50', 'p90', 'p99']:
+        before = baseline['latency_ms'].get(name)
+        after = summary['latency_ms'].get(name)
+        if before and after and after > before * (1 + tolerance):
+            regressions.append('{} {:.2f} ms -> {:.2f} ms'.format(name, before, after))
+    return regressions
+
+
+def main():
+    config = get_parser().parse_args()
+    if config.url is None and config.model_path is None:
+        sys.exit('Pass --url to test a server or --model_path to test in-process')
+
+    if config.url is not None:
+        send = http_client(config.url)
+    else:
+        send = in_process_client(config.model_path, config.max_batch_size, config.max_wait_ms / 1000.0)
+
+    requests = load_requests(config.queries, config.requests + config.warmup)
+    results, seconds = run(send, requests, config.concurrency, config.rate)
+    summary = report(results, seconds, config.warmup)
+    summary['config'] = vars(config)
+    print_report(summary)
+
+    output_dir = os.path.dirname(config.output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(config.output, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+
+    if config.baseline is not None:
+        with open(config.baseline, encoding='utf-8') as f:
+            regressions = compare(summary, json.load(f), config.tolerance)
+        if regressions:
+            print('Latency regressed: ' + ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,23 @@
 import argparse
+import json
 import tensorflow as tf
 from tqdm import tqdm
 import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval'))
+
+from ms_marco_eval import DEFAULT_NORMALIZER, AnswerScorer
+
 import baseline_model
 import attention_model
 import coattention_model
 import bidaf_model
+import rnn_cells
 
 from data import Data
+from throughput import ThroughputMonitor
+from profiling import Profiler
 
 def get_parser():
     parser = argparse.ArgumentParser()
@@ -26,9 +34,19 @@ def get_parser():
     parser.add_argument('--model', '-m', default='baseline',
                         choices=['baseline', 'attention', 'coattention', 'bidaf'])
     parser.add_argument('--tensorboard_name', '-tn', default=None)
-    parser.add_argument('--cell', '-c', default='lstm')
+    parser.add_argument('--cell', '-c', default=None, choices=rnn_cells.CELLS) # defaults to the model's own
     parser.add_argument('--highway_network', '-hwn', type=int, default=1)
     parser.add_argument('--smart_unk', '-su', type=int, default=1)
+    parser.add_argument('--window_size', '-ws', type=int, default=0) # 0 pads to the longest passage instead
+    parser.add_argument('--window_stride', '-wst', type=int, default=0) # defaults to half a window
+    parser.add_argument('--sentence_filter', '-sf', type=int, default=0) # sentences kept per context, 0 keeps all
+    parser.add_argument('--predict', '-p', type=int, default=1)
+    parser.add_argument('--dev_metrics', '-dm', type=int, default=1) # BLEU and ROUGE-L on the dev split every epoch
+    parser.add_argument('--dev_normalizer', '-dn', default=DEFAULT_NORMALIZER, choices=['fast', 'spacy']) # spacy gives the official scores
+    parser.add_argument('--instrument', '-in', type=int, default=1)
+    parser.add_argument('--profile', '-pr', type=int, default=0)
+    parser.add_argument('--profile_start', '-ps', type=int, default=10) # skip warm up steps
+    parser.add_argument('--profile_steps', '-pn', type=int, default=5)
 
     return parser
 
@@ -37,18 +55,9 @@ def fill_paths(config):
     config.train_path = '{}{}.json'.format('./datasets/msmarco/train/', config.question_type)
     config.val_path = '{}{}.json'.format('./datasets/msmarco/dev/', config.question_type)
     config.test_path = '{}{}.json'.format('./datasets/msmarco/test/', config.question_type)
+    config.glove_path = './datasets/glove/glove.6B.{}d.txt'.format(config.emb_size)
 
-def main():
-    parser = get_parser()
-    config = parser.parse_args()
-    fill_paths(config)
-
-    load_model = config.load_model
-
-    tf.reset_default_graph()
-
-    data = Data(config)
-
+def get_model(config, data):
     if config.model == 'baseline':
         model = baseline_model.Model(config, data.max_context_size, data.max_ques_size)
         print("Using baseline model")
@@ -62,15 +71,12 @@ def main():
         model = bidaf_model.Model(config, data.max_context_size, data.max_ques_size)
         print("Using bidaf model")
 
-    if config.tensorboard_name is None:
-        config.tensorboard_name = model.model_name
-    tensorboard_path = './tensorboard_models/' + config.tensorboard_name
-    save_model_path = './saved_models/' + config.question_type + '_' + config.tensorboard_name + '.json'
-    if not os.path.exists(save_model_path):
-        os.makedirs(save_model_path)
-
-    print('Building tensorflow computation graph...')
+    return model
 
+def build_graph(config, data, model):
+    '''Adds the input placeholders, the embedding matrix and the model to the
+       default graph, and returns the placeholders.
+    '''
     # shape = batch_size by num_features
     x = tf.placeholder(tf.int32, shape=[None, data.tX[0].shape[0]], name='x')
     x_len = tf.placeholder(tf.int32, shape=[None], name='x_len')
@@ -93,6 +99,71 @@ def main():
 
     model.build(x, x_len, q, q_len, y_begin, y_end, emb_mat, keep_prob)
 
+    return x, x_len, q, q_len, y_begin, y_end, keep_prob
+
+def load_results(save_model_path):
+    results_path = save_model_path + '/results.json'
+    if not os.path.exists(results_path):
+        return {'epochs': 0, 'min_val_loss': float('Inf')}
+    with open(results_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_results(save_model_path, epochs, min_val_loss):
+    '''Record how far a model has been trained so that it can be resumed and
+       compared against other configurations.
+    '''
+    with open(save_model_path + '/results.json', 'w', encoding='utf-8') as f:
+        json.dump({'epochs': epochs, 'min_val_loss': float(min_val_loss)}, f)
+
+def get_feed(inputs, batch, prefix, keep_prob_value):
+    '''Feed of a batch from Data, the same for training, validation and
+       inference. Lengths are the padded ones, as main.py has always fed them.
+    '''
+    x, x_len, q, q_len, y_begin, y_end, keep_prob = inputs
+    return {x: batch[prefix + 'X'],
+            x_len: [len(batch[prefix + 'X'][i]) for i in range(len(batch[prefix + 'X']))],
+            q: batch[prefix + 'Xq'],
+            q_len: [len(batch[prefix + 'Xq'][i]) for i in range(len(batch[prefix + 'Xq']))],
+            y_begin: batch[prefix + 'YBegin'],
+            y_end: batch[prefix + 'YEnd'],
+            keep_prob: keep_prob_value}
+
+def score_dev(sess, data, scorer, inputs, predictions, number_of_val_batches):
+    '''Predicts answers for the whole dev split and scores them in memory
+       with the evaluation metrics, without writing answer files.
+    '''
+    answers = []
+    for i in range(number_of_val_batches):
+        valBatch = data.getValContextBatch()
+        begin, end = sess.run(predictions, feed_dict=get_feed(inputs, valBatch, 'v', 1.0))
+        for j in range(len(begin)):
+            answers.append((valBatch['vQuestionID'][j], valBatch['vContext'][j][begin[j] : end[j] + 1]))
+    return scorer.score(answers)
+
+def main():
+    parser = get_parser()
+    config = parser.parse_args()
+    fill_paths(config)
+
+    load_model = config.load_model
+
+    tf.reset_default_graph()
+
+    data = Data(config)
+
+    model = get_model(config, data)
+
+    if config.tensorboard_name is None:
+        config.tensorboard_name = model.model_name
+    tensorboard_path = './tensorboard_models/' + config.tensorboard_name
+    save_model_path = './saved_models/' + config.question_type + '_' + config.tensorboard_name + '.json'
+    if not os.path.exists(save_model_path):
+        os.makedirs(save_model_path)
+
+    print('Building tensorflow computation graph...')
+
+    inputs = build_graph(config, data, model)
+
     # Save these operation so that we can use them for the demo.
     tf.add_to_collection('logits', model.logits1)
     tf.add_to_collection('logits', model.logits2)
@@ -101,6 +172,12 @@ def main():
 
     train_step = tf.train.AdamOptimizer(config.learning_rate).minimize(model.loss)
 
+    if config.dev_metrics:
+        # References are normalized once, the answers of every epoch are scored against them
+        scorer = AnswerScorer(dict((query_id, [answer]) for query_id, answer in data.referenceAnswers.items()),
+                              p_normalizer=config.dev_normalizer)
+        predictions = [tf.cast(tf.argmax(model.logits1, 1), 'int32'), tf.cast(tf.argmax(model.logits2, 1), 'int32')]
+
     number_of_train_batches = data.getNumTrainBatches()
     number_of_val_batches = data.getNumValBatches()
 
@@ -115,6 +192,11 @@ def main():
     tf.add_to_collection('dimensions', data.max_ques_size)
     saver = tf.train.Saver()
     min_val_loss = float('Inf')
+    start_epoch = 0
+
+    if config.profile:
+        profiler = Profiler('./profiles/' + config.tensorboard_name, config.profile_start,
+                            config.profile_steps, train_writer)
 
     with tf.Session() as sess:
         train_writer.add_graph(sess.graph)
@@ -122,40 +204,47 @@ def main():
 
         sess.run(tf.global_variables_initializer())
 
+        # Resume from the best checkpoint of a previous run, e.g. a trial
+        # promoted to a longer budget by experiment.py
+        if load_model and tf.train.latest_checkpoint(save_model_path) is not None:
+            saver.restore(sess, tf.train.latest_checkpoint(save_model_path))
+            results = load_results(save_model_path)
+            start_epoch = results['epochs']
+            min_val_loss = results['min_val_loss']
+            print('Resuming from epoch {}'.format(start_epoch))
+
         if config.train:
-            for e in range(config.epochs):
-                print('Epoch {}/{}'.format(e + 1, config.epochs))
+            monitor = ThroughputMonitor(train_writer)
+            for e in range(start_epoch, start_epoch + config.epochs):
+                print('Epoch {}/{}'.format(e + 1, start_epoch + config.epochs))
                 for i in tqdm(range(number_of_train_batches)):
+                    if config.instrument:
+                        monitor.start_step()
+
                     trainBatch = data.getRandomTrainBatch()
 
-                    feed_dict={x: trainBatch['tX'],
-                                x_len: [len(trainBatch['tX'][i]) for i in range(len(trainBatch['tX']))],
-                                q: trainBatch['tXq'],
-                                q_len: [len(trainBatch['tXq'][i]) for i in range(len(trainBatch['tXq']))],
-                                y_begin: trainBatch['tYBegin'],
-                                y_end: trainBatch['tYEnd'],
-                                keep_prob: config.keep_prob}
-                    sess.run(train_step, feed_dict=feed_dict)
+                    feed_dict = get_feed(inputs, trainBatch, 't', config.keep_prob)
+
+                    if config.instrument:
+                        monitor.batch_ready()
+
+                    if config.profile:
+                        profiler.run(sess, train_step, feed_dict, 'train')
+                    else:
+                        sess.run(train_step, feed_dict=feed_dict)
+
+                    if config.instrument:
+                        monitor.end_step(e * number_of_train_batches + i,
+                                         examples=len(trainBatch['tX']),
+                                         real_tokens=trainBatch['tXLen'].sum() + trainBatch['tXqLen'].sum(),
+                                         padded_tokens=trainBatch['tX'].size + trainBatch['tXq'].size)
 
                 # Record results for tensorboard, once per epoch
-                feed_dict={x: trainBatch['tX'],
-                        x_len: [len(trainBatch['tX'][i]) for i in range(len(trainBatch['tX']))],
-                        q: trainBatch['tXq'],
-                        q_len: [len(trainBatch['tXq'][i]) for i in range(len(trainBatch['tXq']))],
-                        y_begin: trainBatch['tYBegin'],
-                        y_end: trainBatch['tYEnd'],
-                        keep_prob: 1.0}
-                train_sum = sess.run(model.merged_summary, feed_dict=feed_dict)
+                train_sum = sess.run(model.merged_summary, feed_dict=get_feed(inputs, trainBatch, 't', 1.0))
 
                 valBatch = data.getRandomValBatch()
-                feed_dict={x: valBatch['vX'],
-                        x_len: [len(valBatch['vX'][i]) for i in range(len(valBatch['vX']))],
-                        q: valBatch['vXq'],
-                        q_len: [len(valBatch['vXq'][i]) for i in range(len(valBatch['vXq']))],
-                        y_begin: valBatch['vYBegin'],
-                        y_end: valBatch['vYEnd'],
-                        keep_prob: 1.0}
-                val_sum, val_loss  = sess.run([model.merged_summary, model.loss], feed_dict=feed_dict)
+                val_sum, val_loss  = sess.run([model.merged_summary, model.loss],
+                                              feed_dict=get_feed(inputs, valBatch, 'v', 1.0))
                 if val_loss < min_val_loss:
                     saver.save(sess, save_model_path + '/model')
                     min_val_loss = val_loss
@@ -163,6 +252,21 @@ def main():
                 train_writer.add_summary(train_sum, e)
                 val_writer.add_summary(val_sum, e)
 
+                if config.dev_metrics:
+                    metrics = score_dev(sess, data, scorer, inputs, predictions, number_of_val_batches)
+                    print(' '.join('{}: {:.5f}'.format(name, metrics[name]) for name in sorted(metrics)))
+                    val_writer.add_summary(tf.Summary(value=[tf.Summary.Value(tag='metrics/' + name, simple_value=value)
+                                                             for name, value in metrics.items()]), e)
+
+            save_results(save_model_path, start_epoch + config.epochs, min_val_loss)
+            monitor.write_report(tensorboard_path + '/run_report.json', config)
+
+        if not config.predict:
+            if config.profile:
+                profiler.write_tables()
+                profiler.write_model_stats(sess.graph, model.model_name)
+            return
+
         # Load best graph on validation data
         try:
             new_saver = tf.train.import_meta_graph(save_model_path + '/model.meta')
@@ -171,43 +275,32 @@ def main():
             print('Must train model first with --train flag')
             sys.exit()
 
-        # Print out answers for one of the batches
-        vContext = []
-        vPassagePred = []
-        vQuestionID = []
-        predictedBegin = []
-        predictedEnd = []
-        trueBegin = []
-        trueEnd = []
+        # Answers are written as each batch completes rather than collected for the whole split
+        answer_writer = data.openAnswersForEvalVal(config.question_type, config.tensorboard_name)
 
-        print('Getting test data answers')
+        print('Getting val data answers')
         for i in range(number_of_val_batches):
-            valBatch = data.getValBatch()
+            valBatch = data.getValContextBatch()
 
             prediction_begin = tf.cast(tf.argmax(model.logits1, 1), 'int32')
             prediction_end = tf.cast(tf.argmax(model.logits2, 1), 'int32')
 
-            feed_dict={x: valBatch['vX'],
-                            x_len: [len(valBatch['vX'][i]) for i in range(len(valBatch['vX']))],
-                            q: valBatch['vXq'],
-                            q_len: [len(valBatch['vXq'][i]) for i in range(len(valBatch['vXq']))],
-                            y_begin: valBatch['vYBegin'],
-                            y_end: valBatch['vYEnd'],
-                            keep_prob: 1.0}
-            begin, end = sess.run([prediction_begin, prediction_end], feed_dict=feed_dict)
+            feed_dict = get_feed(inputs, valBatch, 'v', 1.0)
+            if config.profile:
+                begin, end = profiler.run(sess, [prediction_begin, prediction_end], feed_dict, 'inference')
+            else:
+                begin, end = sess.run([prediction_begin, prediction_end], feed_dict=feed_dict)
 
 
             for j in range(len(begin)):
-                vContext.append(valBatch['vContext'][j])
-                vPassagePred.append(valBatch['vContext'][j])
-                vQuestionID.append(valBatch['vQuestionID'][j])
-                predictedBegin.append(begin[j])
-                predictedEnd.append(end[j])
-                trueBegin.append(valBatch['vYBegin'][j])
-                trueEnd.append(valBatch['vYEnd'][j])
+                answer_writer.write(valBatch['vQuestionID'][j], valBatch['vContext'][j], begin[j], end[j])
+            answer_writer.flush()
+
 
+        if config.profile:
+            profiler.write_tables()
+            profiler.write_model_stats(sess.graph, model.model_name)
 
-        # data.saveAnswersForEval(config.question_type, config.tensorboard_name, vContext, vQuestionID, predictedBegin, predictedEnd, trueBegin, trueEnd)
-        data.saveAnswersForEvalVal(config.question_type, config.tensorboard_name, vContext, vPassagePred, vQuestionID, predictedBegin, predictedEnd, trueBegin, trueEnd)
+        answer_writer.close()
 if __name__ == "__main__":
     main()
@@ -1,4 +1,6 @@
 import argparse
+import json
+import numpy as np
 import tensorflow as tf
 from tqdm import tqdm
 import os
@@ -8,6 +10,11 @@ import baseline_model
 import attention_model
 import coattention_model
 import bidaf_model
+import rnn_cells
+import chunking
+import cascade
+import retrieval
+from answer_cache import AnswerCache, checkpoint_version
 
 from data import Data
 
@@ -26,18 +33,73 @@ def get_parser():
     parser.add_argument('--model', '-m', default='baseline',
                         choices=['baseline', 'attention', 'coattention', 'bidaf'])
     parser.add_argument('--tensorboard_name', '-tn', default=None)
-    parser.add_argument('--cell', '-c', default='lstm')
+    parser.add_argument('--cell', '-c', default=None, choices=rnn_cells.CELLS) # defaults to the model's own
     parser.add_argument('--highway_network', '-hwn', type=int, default=1)
     parser.add_argument('--smart_unk', '-su', type=int, default=1)
+    parser.add_argument('--window_size', '-ws', type=int, default=0) # 0 pads to the longest passage instead
+    parser.add_argument('--window_stride', '-wst', type=int, default=0) # defaults to half a window
+    parser.add_argument('--sentence_filter', '-sf', type=int, default=0) # sentences kept per context, 0 keeps all
+    parser.add_argument('--cascade_top_k', '-ck', type=int, default=0) # 0 reads every passage
+    parser.add_argument('--cascade_threshold', '-ct', type=float, default=0.0) # minimum relevance weight
+    parser.add_argument('--cache_size', '-cs', type=int, default=10000) # answers kept in memory, 0 disables
+    parser.add_argument('--cache_path', '-cp', default=None) # e.g. ./cache/location_answers.db to reuse answers across runs
+    parser.add_argument('--cache_logits', '-cl', type=int, default=0) # also cache the test answers with their logits for the demo
+    parser.add_argument('--demo_format', '-df', default='json', choices=['json', 'binary'])
+    parser.add_argument('--demo_shard_size', '-dss', type=int, default=1000) # queries per binary shard
+    parser.add_argument('--demo_top_k', '-dk', type=int, default=0) # probabilities kept per passage, 0 keeps all
+    parser.add_argument('--retrieval_index', '-ri', default=None) # e.g. ./retrieval_index to answer dev and test over the whole corpus
+    parser.add_argument('--retrieval_top_k', '-rk', type=int, default=10) # passages retrieved per question
 
     return parser
 
+def get_window_feed(x, x_len, q, q_len, y_begin, y_end, keep_prob, batch, prefix, question_prefix, i, p):
+    '''Feeds every window of passage p of query i as one batch, and returns the windows' offsets too.'''
+    windows = np.flatnonzero(np.array(batch[prefix + 'WindowPassage'][i]) == p)
+    feed_dict={x: [batch[prefix + 'X'][i][w] for w in windows],
+               x_len: [batch[prefix + 'XLen'][i][w] for w in windows],
+               q: [batch[question_prefix + 'Xq'][i]] * len(windows),
+               q_len: [batch[question_prefix + 'XqLen'][i]] * len(windows),
+               y_begin: [0] * len(windows),
+               y_end: [0] * len(windows),
+               keep_prob: 1.0}
+    return feed_dict, [batch[prefix + 'WindowOffset'][i][w] for w in windows]
+
+def merge_windows(passage_length, positions, offsets, probs_begin, probs_end):
+    '''Merges the start and end probabilities of a passage's windows, and returns the most likely start and
+       end in the passage, their probabilities, and the merged probabilities. positions maps the tokens the
+       reader saw back to the original passage, which may be longer if sentences were filtered out.
+    '''
+    positions = np.asarray(positions, dtype=np.int64)
+    length = max(len(positions), 1)
+    passage_begin = chunking.merge_window_scores(offsets, probs_begin, length)
+    passage_end = chunking.merge_window_scores(offsets, probs_end, length)
+    begin = int(np.argmax(passage_begin))
+    end = int(np.argmax(passage_end))
+    begin_prob = passage_begin[begin]
+    end_prob = passage_end[end]
+
+    # Filtered out tokens get no probability
+    original_begin = np.zeros(passage_length)
+    original_end = np.zeros(passage_length)
+    original_begin[positions] = passage_begin[:len(positions)]
+    original_end[positions] = passage_end[:len(positions)]
+    if len(positions):
+        begin = int(positions[begin])
+        end = int(positions[end])
+    return begin, end, begin_prob, end_prob, original_begin, original_end
+
 def main():
     parser = get_parser()
     config = parser.parse_args()
     config.train_path = '{}{}.json'.format('./datasets/msmarco/train/', config.question_type)
     config.val_path = '{}{}.json'.format('./datasets/msmarco/dev/', config.question_type)
     config.test_path = '{}{}.json'.format('./datasets/msmarco/test/', config.question_type)
+    config.glove_path = './datasets/glove/glove.6B.{}d.txt'.format(config.emb_size)
+
+    # Dev and test questions get passages retrieved from the index in place of their own
+    if config.retrieval_index:
+        config.val_path = retrieval.retrieved_path(config.retrieval_index, config.val_path, config.retrieval_top_k)
+        config.test_path = retrieval.retrieved_path(config.retrieval_index, config.test_path, config.retrieval_top_k)
 
     load_model = config.load_model
 
@@ -155,56 +217,101 @@ def main():
 
         # Load best graph on validation data
         new_saver = tf.train.import_meta_graph(save_model_path + '/model.meta')
-        new_saver.restore(sess, tf.train.latest_checkpoint(save_model_path))
+        checkpoint = tf.train.latest_checkpoint(save_model_path)
+        new_saver.restore(sess, checkpoint)
 
-        vQuestionID = []
-        vPassagePred = []
-        predictedBegin = []
-        predictedEnd = []
+        # Repeated questions over the same passages are answered once
+        answer_cache = None
+        if config.cache_size:
+            settings = dict((name, getattr(config, name)) for name in ['cascade_top_k', 'cascade_threshold',
+                                                                       'window_size', 'window_stride',
+                                                                       'sentence_filter', 'smart_unk'])
+            answer_cache = AnswerCache(config.cache_size, checkpoint_version(checkpoint, settings), config.cache_path)
 
-        begin_corr = 0
-        end_corr = 0
-        total = 0
+        # Answers are written as each batch completes rather than collected for the whole split
+        answer_writer = data.openAnswersForEvalVal(config.question_type, config.tensorboard_name)
+
+        # Only the passages that pass the relevance cut are sent to the reader
+        cascade_report = cascade.CascadeReport(config.cascade_top_k, config.cascade_threshold)
+
+        # Reader score of every passage, for recall@k in passage_relevance.py
+        if not os.path.exists(tensorboard_path):
+            os.makedirs(tensorboard_path)
+        passage_score_file = open(tensorboard_path + '/passage_scores.json', 'w', encoding='utf-8')
 
         print('Getting val data answers')
         for i in range(number_of_val_batches):
             valBatch = data.getValBatch()
 
-            prediction_begin = tf.cast(tf.argmax(model.logits1, 1), 'int32')
-            prediction_end = tf.cast(tf.argmax(model.logits2, 1), 'int32')
-            prediction_begin_prob = tf.reduce_max(tf.nn.softmax(model.logits1), 1)
-            prediction_end_prob = tf.reduce_max(tf.nn.softmax(model.logits2), 1)
+            softmax_begin = tf.nn.softmax(model.logits1)
+            softmax_end = tf.nn.softmax(model.logits2)
             for i in range(len(valBatch['vmXq'])):
+                passages = cascade.select_passages(valBatch['vmXPassWeight'][i], config.cascade_top_k,
+                                                   config.cascade_threshold)
                 max_passage_score = 0.0
-                passage_idx = 0
+                passage_idx = passages[0]
                 start_idx = 0
                 end_idx = 0
-
-                for p in range(len(valBatch['vmX'][i])):
-                    feed_dict={x: [valBatch['vmX'][i][p]],
-                                    x_len: [valBatch['vmXLen'][i][p]],
-                                    q: [valBatch['vmXq'][i]],
-                                    q_len: [valBatch['vmXqLen'][i]],
-                                    y_begin: [0],
-                                    y_end: [0],
-                                    keep_prob: 1.0}
-                    begin, end, begin_prob, end_prob= sess.run([prediction_begin, prediction_end,
-                                                                prediction_begin_prob, prediction_end_prob], feed_dict=feed_dict)
-                    
-                    passage_score = valBatch['vmXPassWeight'][i][p] * begin_prob[0] * end_prob[0]
-
-                    if passage_score > max_passage_score:
-                        max_passage_score = passage_score
-                        start_idx = begin[0].item()
-                        end_idx = end[0].item()
-                        passage_idx = p
-
-                vPassagePred.append(valBatch['vmContext'][i][passage_idx])
-                vQuestionID.append(valBatch['vmQuestionID'][i])
-                predictedBegin.append(start_idx)
-                predictedEnd.append(end_idx)
-
-        data.saveAnswersForEvalVal(config.question_type, config.tensorboard_name, vPassagePred, vQuestionID, predictedBegin, predictedEnd)
+                passage_scores = [0.0] * len(valBatch['vmContext'][i])
+
+                cache_key = None
+                cached = None
+                if answer_cache is not None:
+                    cache_key = answer_cache.key(valBatch['vmXq'][i], valBatch['vmContext'][i])
+                    cached = answer_cache.get(cache_key)
+                    if cached is not None and 'passage_scores' in cached:
+                        passage_idx, start_idx, end_idx = cached['passage_idx'], cached['start'], cached['end']
+                        passage_scores = cached['passage_scores']
+                    else:
+                        # Cached by the test loop, without the passage scores
+                        cached = None
+
+                if cached is None:
+                    cascade_report.start_reader()
+                    for p in passages:
+                        feed_dict, offsets = get_window_feed(x, x_len, q, q_len, y_begin, y_end, keep_prob,
+                                                             valBatch, 'vm', 'vm', i, p)
+                        probs_begin, probs_end = sess.run([softmax_begin, softmax_end], feed_dict=feed_dict)
+                        begin, end, begin_prob, end_prob, _, _ = merge_windows(len(valBatch['vmContext'][i][p]),
+                                                                               valBatch['vmTokenPosition'][i][p],
+                                                                               offsets, probs_begin, probs_end)
+
+                        passage_score = valBatch['vmXPassWeight'][i][p] * begin_prob * end_prob
+                        passage_scores[p] = float(passage_score)
+
+                        if passage_score > max_passage_score:
+                            max_passage_score = passage_score
+                            start_idx = begin
+                            end_idx = end
+                            passage_idx = p
+                    cascade_report.end_reader()
+
+                    costs = np.bincount(np.asarray(valBatch['vmWindowPassage'][i], dtype=np.int64), minlength=len(valBatch['vmContext'][i]))
+                    cascade_report.add_query(passages, valBatch['vmSelected'][i], costs.tolist())
+
+                    if cache_key is not None:
+                        answer_cache.put(cache_key, {'passage_idx': int(passage_idx), 'start': int(start_idx),
+                                                     'end': int(end_idx), 'passage_scores': passage_scores})
+                else:
+                    # The reader never ran, so the query is left out of the reader work and time
+                    cascade_report.add_cached_query()
+
+                answer_writer.write(valBatch['vmQuestionID'][i], valBatch['vmContext'][i][passage_idx], start_idx, end_idx)
+                passage_score_file.write(json.dumps({'query_id': int(valBatch['vmQuestionID'][i]),
+                                                     'passage_scores': passage_scores}) + '\n')
+            answer_writer.flush()
+
+        answer_writer.close()
+        passage_score_file.close()
+
+        # Recall of the selected passage against reader work for every top k, from the relevance weights alone
+        costs = [np.bincount(np.asarray(w, dtype=np.int64), minlength=len(c)).tolist() for w, c in zip(data.vmWindowPassage, data.vmContext)]
+        cascade_sweep = cascade.sweep(data.vmPassWeight, data.vmSelected, costs)
+        if not os.path.exists(tensorboard_path):
+            os.makedirs(tensorboard_path)
+        cascade_report.write_report(tensorboard_path + '/cascade_report.json', config.question_type, cascade_sweep)
+        if answer_cache is not None:
+            print('Answer cache: {}'.format(answer_cache.stats()))
 
 
         ####### FOR DEMO ####### 
@@ -224,46 +331,74 @@ def main():
         end_corr = 0
         total = 0
 
+        # Binary demo answers are written by a background thread as each query is answered
+        demo_writer = data.openDemoWriter() if config.demo_format == 'binary' else None
+
         print('Getting test data answers')
         for i in range(number_of_test_batches):
             testBatch = data.getTestBatch()
 
-            prediction_begin = tf.cast(tf.argmax(model.logits1, 1), 'int32')
-            prediction_end = tf.cast(tf.argmax(model.logits2, 1), 'int32')
-            prediction_begin_prob = tf.reduce_max(tf.nn.softmax(model.logits1), 1)
-            prediction_end_prob = tf.reduce_max(tf.nn.softmax(model.logits2), 1)
             softmax_begin = tf.nn.softmax(model.logits1)
             softmax_end = tf.nn.softmax(model.logits2)
 
             for i in range(len(testBatch['teXq'])):
+                passages = cascade.select_passages(testBatch['temXPassWeight'][i], config.cascade_top_k,
+                                                   config.cascade_threshold)
                 max_passage_score = 0.0
-                passage_idx = 0
+                passage_idx = passages[0]
                 start_idx = 0
                 end_idx = 0
                 logits_start = []
                 logits_end = []
-                for p in range(len(testBatch['temX'][i])):
-                    feed_dict={x: [testBatch['temX'][i][p]],
-                                    x_len: [testBatch['temXLen'][i][p]],
-                                    q: [testBatch['teXq'][i]],
-                                    q_len: [testBatch['teXqLen'][i]],
-                                    y_begin: [0],
-                                    y_end: [0],
-                                    keep_prob: 1.0}
-                    begin, end, begin_prob, end_prob, lb, le = sess.run([prediction_begin, prediction_end,
-                                                                prediction_begin_prob, prediction_end_prob,
-                                                                softmax_begin, softmax_end], feed_dict=feed_dict)
-
-                    passage_score = testBatch['temXPassWeight'][i][p] * begin_prob[0] * end_prob[0]
+
+                cache_key = None
+                cached = None
+                # Logits of every passage token are large, so test answers are only cached on request
+                if answer_cache is not None and config.cache_logits:
+                    cache_key = answer_cache.key(testBatch['teXq'][i], testBatch['temContext'][i])
+                    cached = answer_cache.get(cache_key)
+                    if cached is not None and 'logits_start' in cached:
+                        passage_idx, start_idx, end_idx = cached['passage_idx'], cached['start'], cached['end']
+                        logits_start, logits_end = cached['logits_start'], cached['logits_end']
+                    else:
+                        # Cached by the val loop, without the logits the demo needs
+                        cached = None
+
+                for p in (range(len(testBatch['temContext'][i])) if cached is None else []):
+                    if p not in passages:
+                        # Passages the reader skipped get no probability
+                        logits_start.append(np.zeros(len(testBatch['temContext'][i][p])))
+                        logits_end.append(np.zeros(len(testBatch['temContext'][i][p])))
+                        continue
+
+                    feed_dict, offsets = get_window_feed(x, x_len, q, q_len, y_begin, y_end, keep_prob,
+                                                         testBatch, 'tem', 'te', i, p)
+                    probs_begin, probs_end = sess.run([softmax_begin, softmax_end], feed_dict=feed_dict)
+                    begin, end, begin_prob, end_prob, lb, le = merge_windows(len(testBatch['temContext'][i][p]),
+                                                                             testBatch['temTokenPosition'][i][p],
+                                                                             offsets, probs_begin, probs_end)
+
+                    passage_score = testBatch['temXPassWeight'][i][p] * begin_prob * end_prob
                     if passage_score > max_passage_score:
                         max_passage_score = passage_score
-                        start_idx = begin[0].item()
-                        end_idx = end[0].item()
+                        start_idx = begin
+                        end_idx = end
                         passage_idx = p
 
-                    logits_start.append(lb[0].tolist())
-                    logits_end.append(le[0].tolist())
+                    logits_start.append(lb)
+                    logits_end.append(le)
 
+                if cache_key is not None and cached is None:
+                    answer_cache.put(cache_key, {'passage_idx': int(passage_idx), 'start': int(start_idx),
+                                                 'end': int(end_idx),
+                                                 'logits_start': [np.asarray(l).tolist() for l in logits_start],
+                                                 'logits_end': [np.asarray(l).tolist() for l in logits_end]})
+
+                if demo_writer is not None:
+                    demo_writer.add(data.demoCandidate(testBatch['teQuestionID'][i], testBatch['temContext'][i],
+                                                       testBatch['teUrl'][i], testBatch['temXPassWeight'][i],
+                                                       logits_start, logits_end, passage_idx, start_idx, end_idx))
+                    continue
 
                 tePassageIndex.append(passage_idx)
                 teContext.append(testBatch['temContext'][i])
@@ -271,12 +406,19 @@ def main():
                 predictedBegin.append(start_idx)
                 predictedEnd.append(end_idx)
                 relevanceWeights.append(testBatch['temXPassWeight'][i])
-                logitsStart.append(logits_start)
-                logitsEnd.append(logits_end)
+                logitsStart.append([np.asarray(l).tolist() for l in logits_start])
+                logitsEnd.append([np.asarray(l).tolist() for l in logits_end])
                 teUrl.append(testBatch['teUrl'][i])
 
-        data.saveAnswersForEvalTestDemo(config.question_type, config.tensorboard_name, teContext, teQuestionID, teUrl,
-                                        predictedBegin, predictedEnd, relevanceWeights, logitsStart, logitsEnd, tePassageIndex)
+        if demo_writer is not None:
+            demo_writer.close()
+        else:
+            data.saveAnswersForEvalTestDemo(config.question_type, config.tensorboard_name, teContext, teQuestionID, teUrl,
+                                            predictedBegin, predictedEnd, relevanceWeights, logitsStart, logitsEnd, tePassageIndex)
+
+        if answer_cache is not None:
+            print('Answer cache: {}'.format(answer_cache.stats()))
+            answer_cache.close()
 
 if __name__ == "__main__":
     main()
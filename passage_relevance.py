@@ -1,89 +1,282 @@
+import argparse
+import collections
+import csv
 import json
-import collections 
+import multiprocessing
+import os
+
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+from corpus import bm25, bm25_idf, chunk_ranges
+
+QUESTION_TYPES = ['description', 'numeric', 'entity', 'location', 'person']
+RANKERS = ['tfidf', 'bm25', 'reader']
+
+# Corpus statistics of the current split, set in each worker
+STATISTICS = None
+READER_SCORES = None
 
-from matplotlib import pyplot as plt
 
+def get_parser():
+    parser = argparse.ArgumentParser(description='Recall@k of the selected passage under several passage rankers.')
+    parser.add_argument('--data_dir', '-d', default='datasets/msmarco/train')
+    parser.add_argument('--question_types', '-q', nargs='+', default=QUESTION_TYPES, choices=QUESTION_TYPES)
+    parser.add_argument('--rankers', '-r', nargs='+', default=['tfidf', 'bm25'], choices=RANKERS)
+    parser.add_argument('--reader_scores', '-rs', default=None) # e.g. tensorboard_models/{question_type}_bidaf/passage_scores.json
+    parser.add_argument('--output_dir', '-o', default='passage_relevance')
+    parser.add_argument('--chunk_mb', '-cm', type=int, default=16) # size of the file ranges read by each task
+    parser.add_argument('--process_count', '-p', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--k1', type=float, default=1.2) # BM25 term frequency saturation
+    parser.add_argument('--b', type=float, default=0.75) # BM25 length normalization
 
-def load_samples(path):
+    return parser
+
+
+def read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        lines = f.read(end - start).decode('utf-8').splitlines()
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def load_reader_scores(path):
+    '''Passage scores of the reader by query id, as main_multi.py writes them.'''
+    scores = {}
     with open(path, encoding='utf-8') as f:
         for line in f:
-            yield json.loads(line)
+            row = json.loads(line)
+            scores[row['query_id']] = row['passage_scores']
+    return scores
+
+
+def count_terms(task):
+    '''Document frequencies, passage count and total passage length of a
+       range of the file.
+    '''
+    path, start, end = task
+    passages = [p['passage_text'] for sample in read_range(path, start, end) for p in sample['passages']]
+    if not passages:
+        return collections.Counter(), 0, 0
+
+    vectorizer = CountVectorizer()
+    counts = vectorizer.fit_transform(passages)
+    document_frequencies = np.bincount(counts.indices, minlength=counts.shape[1])
+    terms = vectorizer.get_feature_names_out() if hasattr(vectorizer, 'get_feature_names_out') \
+        else vectorizer.get_feature_names()
+    return collections.Counter(dict(zip(terms, document_frequencies.tolist()))), len(passages), int(counts.sum())
+
+
+def corpus_statistics(document_frequencies, passage_count, total_length, k1, b):
+    vocabulary = {term: i for i, term in enumerate(sorted(document_frequencies))}
+    df = np.zeros(len(vocabulary))
+    for term, i in vocabulary.items():
+        df[i] = document_frequencies[term]
+    return {
+        'vocabulary': vocabulary,
+        # Smoothed as TfidfVectorizer does
+        'tfidf_idf': np.log((1. + passage_count) / (1. + df)) + 1.,
+        'bm25_idf': bm25_idf(df, passage_count),
+        'average_length': total_length / max(passage_count, 1),
+        'k1': k1,
+        'b': b,
+    }
+
+
+def init_worker(statistics, reader_scores):
+    global STATISTICS, READER_SCORES
+    STATISTICS = statistics
+    READER_SCORES = reader_scores
+
+
+def tfidf_scores(queries, passages, owners):
+    '''Cosine similarity of binary TF-IDF vectors of each passage and its query.'''
+    idf = sparse.diags(STATISTICS['tfidf_idf'])
+    queries = normalize((queries > 0).astype(np.float64).dot(idf))
+    passages = normalize((passages > 0).astype(np.float64).dot(idf))
+    return np.asarray(passages.multiply(queries[owners]).sum(axis=1)).ravel()
+
 
+def bm25_scores(queries, passages, owners):
+    lengths = np.asarray(passages.sum(axis=1)).ravel()
+    rows = np.repeat(np.arange(passages.shape[0]), np.diff(passages.indptr))
+    tf = passages.data.astype(np.float64)
+    weights = passages.astype(np.float64)
+    weights.data = bm25(STATISTICS['bm25_idf'][passages.indices], tf, lengths[rows], STATISTICS['average_length'],
+                        STATISTICS['k1'], STATISTICS['b'])
+    return np.asarray(weights.multiply(queries[owners] > 0).sum(axis=1)).ravel()
 
-def load_passages(path):
-    print('Loading passages from {}...'.format(path))
 
-    samples = []
+def first_selected_ranks(scores, selected, counts):
+    '''Rank of the best ranked selected passage of each query, -1 for queries
+       without one. Ties keep the original passage order.
+    '''
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    # Pad to a [queries, passages] matrix, with padding ranked last
+    columns = np.arange(len(scores)) - np.repeat(offsets[:-1], counts)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    padded_scores = np.full((len(counts), max(counts, default=0)), -np.inf)
+    padded_selected = np.zeros(padded_scores.shape, dtype=bool)
+    padded_scores[rows, columns] = scores
+    padded_selected[rows, columns] = selected
 
-    for sample in load_samples(path):
-        passages = []
-        selected = []
-        s = {}
-        for passage in sample['passages']:
-            passages.append(passage['passage_text'].lower())
-            selected.append(passage['is_selected'])
-        s['query'] = sample['query'].lower()
-        s['selected'] = selected
-        s['passages'] = passages
-        samples.append(s)
+    order = np.argsort(-padded_scores, axis=1, kind='mergesort')
+    ranked_selected = padded_selected[np.arange(len(counts))[:, None], order]
+    return np.where(ranked_selected.any(axis=1), np.argmax(ranked_selected, axis=1), -1)
 
-    print('Loaded {} samples.'.format(len(samples)))
 
-    return samples
+def rank_range(task):
+    '''Histograms of the rank of the selected passage of the queries in a
+       range of the file, for each ranker, and the number of queries the
+       reader ranker skipped for lack of scores of all their passages.
+    '''
+    path, start, end, rankers = task
+    samples = read_range(path, start, end)
+    histograms = {}
+    skipped = 0
+    if not samples:
+        return histograms, skipped
 
-def get_rank(t):
-    tfidf = TfidfVectorizer(binary=True).fit_transform([t['query']] + t['passages'])
-    cosine_similarities = linear_kernel(tfidf[0:1], tfidf).flatten()[1:]
-    related_docs_indices = cosine_similarities.argsort()[::-1]
-    try:
-        selected_index = t['selected'].index(1)
-        return related_docs_indices.tolist().index(selected_index)
-    except ValueError:
-        return None
+    vectorizer = CountVectorizer(vocabulary=STATISTICS['vocabulary'])
+    queries = vectorizer.transform([sample['query'] for sample in samples])
+    passages = vectorizer.transform([p['passage_text'] for sample in samples for p in sample['passages']])
+    counts = np.array([len(sample['passages']) for sample in samples])
+    owners = np.repeat(np.arange(len(samples)), counts)
+    selected = np.array([p['is_selected'] > 0 for sample in samples for p in sample['passages']], dtype=bool)
 
+    for ranker in rankers:
+        if ranker == 'reader':
+            # Only the queries the reader scored, with a score for each passage
+            keep = np.array([len(READER_SCORES.get(sample['query_id'], ())) == len(sample['passages'])
+                             for sample in samples], dtype=bool)
+            skipped = int(len(samples) - keep.sum())
+            scores = np.concatenate([np.asarray(READER_SCORES[sample['query_id']], dtype=np.float64)
+                                     for sample, k in zip(samples, keep) if k] or [[]])
+            ranks = first_selected_ranks(scores, selected[keep[owners]], counts[keep])
+        elif ranker == 'bm25':
+            ranks = first_selected_ranks(bm25_scores(queries, passages, owners), selected, counts)
+        else:
+            ranks = first_selected_ranks(tfidf_scores(queries, passages, owners), selected, counts)
+        histograms[ranker] = np.bincount(ranks[ranks >= 0])
+    return histograms, skipped
 
-def get_accuracy(passages):
-    rank_counter = collections.Counter(get_rank(t) for t in passages)
-    counts = [count for element, count in rank_counter.items()
-              if element is not None]
-    cumsum = np.cumsum(counts)
-    percents = [x / cumsum[-1] for x in cumsum]
-    return percents
+
+def recall_at_k(histogram):
+    '''Fraction of the queries with a selected passage that have one in
+       their top k, for k = 1..the most passages of a query.
+    '''
+    cumulative = np.cumsum(histogram)
+    return cumulative / max(cumulative[-1], 1) if len(cumulative) else cumulative
+
+
+def add_histograms(total, histogram):
+    if len(histogram) > len(total):
+        total, histogram = histogram, total
+    total = total.copy()
+    total[:len(histogram)] += histogram
+    return total
+
+
+def map_ranges(function, tasks, process_count, initargs=None):
+    if process_count > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(process_count, len(tasks)), init_worker if initargs else None,
+                                    initargs or ())
+        try:
+            return pool.map(function, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    if initargs:
+        init_worker(*initargs)
+    return [function(task) for task in tasks]
+
+
+def analyze(path, rankers, reader_scores, chunk_bytes, process_count, k1, b):
+    '''Rank histograms of path for each ranker, counting term statistics
+       over the whole file first, then ranking ranges of it in parallel,
+       and the number of queries the reader ranker skipped.
+    '''
+    ranges = chunk_ranges(path, chunk_bytes)
+
+    document_frequencies = collections.Counter()
+    passage_count = 0
+    total_length = 0
+    for frequencies, passages, length in map_ranges(count_terms, [(path, start, end) for start, end in ranges],
+                                                    process_count):
+        document_frequencies.update(frequencies)
+        passage_count += passages
+        total_length += length
+    statistics = corpus_statistics(document_frequencies, passage_count, total_length, k1, b)
+
+    histograms = {ranker: np.zeros(0, dtype=np.int64) for ranker in rankers}
+    skipped = 0
+    for result, range_skipped in map_ranges(rank_range, [(path, start, end, rankers) for start, end in ranges],
+                                            process_count, (statistics, reader_scores)):
+        for ranker, histogram in result.items():
+            histograms[ranker] = add_histograms(histograms[ranker], histogram)
+        skipped += range_skipped
+    return histograms, skipped
+
+
+def write_curves(curves, output_dir):
+    '''recall_at_k.csv with every curve, and a plot of the question types of
+       each ranker.
+    '''
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    with open(os.path.join(output_dir, 'recall_at_k.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['question_type', 'ranker', 'k', 'recall', 'queries'])
+        for (question_type, ranker), (recall, queries) in sorted(curves.items()):
+            for k, value in enumerate(recall, 1):
+                writer.writerow([question_type, ranker, k, '{:.5f}'.format(value), queries])
+
+    for ranker in sorted(set(ranker for _, ranker in curves)):
+        plt.figure()
+        for (question_type, r), (recall, _) in sorted(curves.items()):
+            if r == ranker:
+                plt.plot(range(1, len(recall) + 1), recall, label=question_type)
+        plt.ylabel('Percent of Questions where Selected Passage is Included')
+        plt.xlabel('Number of Passages')
+        plt.title(ranker)
+        plt.legend(loc='lower right')
+        plt.savefig(os.path.join(output_dir, 'recall_at_k_{}.png'.format(ranker)))
+        plt.close()
 
 
 def main():
-    for question_type in ['description', 'numeric', 'entity', 'location', 'person']:
-        path = 'datasets/msmarco/train/{}.json'.format(question_type)
-        passages = load_passages(path)
-        accuracy = get_accuracy(passages)
-        plt.plot(range(1, len(accuracy) + 1), accuracy, label=question_type)
-
-    plt.ylabel('Percent of Questions where Selected Passage is Included')
-    plt.xlabel('Number of Passages')
-    plt.legend(loc='upper left')
-    plt.show()
-
-main()
-
-
-def a():
-    train = load_passages('datasets/msmarco/train/location.json')
-
-    for t in train[:0]:
-        tfidf = TfidfVectorizer().fit_transform([t['query']] + t['passages'])
-        cosine_similarities = linear_kernel(tfidf[0:1], tfidf).flatten()[1:]
-        related_docs_indices = cosine_similarities.argsort()[::-1]
-
-        print('Cosine Similarities:', cosine_similarities)
-        print('Ranked indexes:', related_docs_indices)
-        print('Selected:', t['selected'])
-        print('Query:', t['query'] + '?')
-        print()
-        print('Passages:')
-        for i in range(len(t['passages'])):
-            print(i, ':', t['passages'][i])
-            print()
+    config = get_parser().parse_args()
+    if 'reader' in config.rankers and config.reader_scores is None:
+        raise ValueError('The reader ranker needs --reader_scores')
+
+    curves = {}
+    for question_type in config.question_types:
+        path = os.path.join(config.data_dir, '{}.json'.format(question_type))
+        reader_scores = {}
+        if 'reader' in config.rankers:
+            reader_scores = load_reader_scores(config.reader_scores.format(question_type=question_type))
+
+        print('Ranking passages of {}...'.format(path))
+        histograms, skipped = analyze(path, config.rankers, reader_scores, config.chunk_mb * 2 ** 20,
+                                      config.process_count, config.k1, config.b)
+        if skipped:
+            print('{:12} reader skipped {} queries without scores for all their passages'.format(question_type,
+                                                                                                 skipped))
+        for ranker, histogram in histograms.items():
+            recall = recall_at_k(histogram)
+            curves[(question_type, ranker)] = (recall, int(histogram.sum()))
+            print('{:12} {:6} {}'.format(question_type, ranker,
+                                         ' '.join('{:.3f}'.format(r) for r in recall[:5])))
+
+    write_curves(curves, config.output_dir)
+    print('Wrote recall@k curves to {}'.format(config.output_dir))
+
+
+if __name__ == '__main__':
+    main()
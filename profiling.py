@@ -0,0 +1,131 @@
+import collections
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+def scope_of(name, depth=2):
+    '''Name scope an op belongs to, e.g. encoding/bidirectional_rnn for
+       encoding/bidirectional_rnn/fw/fw/while/lstm_cell/MatMul.
+    '''
+    return '/'.join(name.split('/')[:-1][:depth]) or name
+
+
+class Profiler:
+    '''Traces a window of sess.run calls with full tracing, writing a Chrome
+       trace of each one and aggregating the time and memory used by every op.
+
+       Training runs are traced after `start` warm up steps, other phases
+       (e.g. inference) after their first run. Open the traces by loading them
+       in chrome://tracing.
+    '''
+
+    def __init__(self, output_dir, start, steps, writer=None):
+        self.output_dir = output_dir
+        self.start = start
+        self.steps = steps
+        self.writer = writer
+        self.op_stats = collections.defaultdict(lambda: collections.defaultdict(lambda: np.zeros(3)))
+        self.scope_stats = collections.defaultdict(lambda: collections.defaultdict(lambda: np.zeros(3)))
+        self.runs = collections.Counter()
+        self.traced_steps = collections.Counter()
+        self.run_metadata = {}
+
+        # Counted up front, before the graph is extended for inference
+        self.parameters = collections.Counter()
+        for variable in tf.trainable_variables():
+            self.parameters[scope_of(variable.name, depth=1)] += int(np.prod(variable.get_shape().as_list()))
+
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    def in_window(self, phase, step):
+        start = self.start if phase == 'train' else 1
+        return start <= step < start + self.steps
+
+    def run(self, sess, fetches, feed_dict, phase):
+        step = self.runs[phase]
+        self.runs[phase] += 1
+
+        if not self.in_window(phase, step):
+            return sess.run(fetches, feed_dict=feed_dict)
+
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        result = sess.run(fetches, feed_dict=feed_dict, options=run_options, run_metadata=run_metadata)
+        self.record(sess.graph, run_metadata, phase, step)
+        return result
+
+    def record(self, graph, run_metadata, phase, step):
+        trace = timeline.Timeline(run_metadata.step_stats, graph=graph)
+        trace_path = os.path.join(self.output_dir, 'timeline_{}_{}.json'.format(phase, step))
+        with open(trace_path, 'w') as f:
+            f.write(trace.generate_chrome_trace_format(show_memory=True))
+
+        if self.writer is not None:
+            self.writer.add_run_metadata(run_metadata, '{}_step_{}'.format(phase, step))
+
+        for device in run_metadata.step_stats.dev_stats:
+            for node in device.node_stats:
+                # Ops may be reported as e.g. name:MatMul on some devices
+                name = node.node_name.split(':')[0]
+                try:
+                    op_type = graph.get_operation_by_name(name).type
+                except KeyError:
+                    op_type = name
+
+                micros = node.all_end_rel_micros
+                memory = sum(m.total_bytes for m in node.memory)
+                self.op_stats[phase][op_type] += [1, micros, memory]
+                self.scope_stats[phase][scope_of(name)] += [1, micros, memory]
+
+        self.traced_steps[phase] += 1
+        self.run_metadata[phase] = run_metadata
+
+    def write_table(self, stats, phase, key_name, path):
+        steps = self.traced_steps[phase]
+        total_micros = sum(s[1] for s in stats.values())
+        rows = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)
+
+        with open(path, 'w', encoding='utf-8') as f:
+            print('\t'.join([key_name, 'count', 'ms_per_step', 'percent', 'mb_per_step']), file=f)
+            for key, (count, micros, memory) in rows:
+                print('{}\t{}\t{:.3f}\t{:.2f}\t{:.3f}'.format(key, int(count / steps), micros / steps / 1000,
+                                                             100 * micros / total_micros,
+                                                             memory / steps / 2 ** 20), file=f)
+
+        print('Top {}s for {} ({} traced steps):'.format(key_name, phase, steps))
+        for key, (count, micros, memory) in rows[:10]:
+            print('  {:6.2f}%  {:10.3f} ms  {}'.format(100 * micros / total_micros, micros / steps / 1000, key))
+
+    def write_tables(self):
+        for phase in self.traced_steps:
+            self.write_table(self.op_stats[phase], phase, 'op',
+                             os.path.join(self.output_dir, 'ops_{}.tsv'.format(phase)))
+            self.write_table(self.scope_stats[phase], phase, 'scope',
+                             os.path.join(self.output_dir, 'scopes_{}.tsv'.format(phase)))
+
+    def write_model_stats(self, graph, model_name):
+        stats = {
+            'model': model_name,
+            'trainable_parameters': sum(self.parameters.values()),
+            'parameters_by_scope': dict(self.parameters),
+        }
+
+        # The shapes recorded in a traced step let tfprof estimate the FLOPs
+        # of ops whose batch dimension is unknown in the graph
+        stats['float_ops_per_step'] = {}
+        for phase, run_metadata in self.run_metadata.items():
+            options = dict(tf.contrib.tfprof.model_analyzer.FLOAT_OPS_OPTIONS)
+            options['dump_to_file'] = os.path.join(self.output_dir, 'flops_{}.txt'.format(phase))
+            flops = tf.contrib.tfprof.model_analyzer.print_model_analysis(
+                graph, run_meta=run_metadata, tfprof_options=options)
+            stats['float_ops_per_step'][phase] = flops.total_float_ops
+
+        with open(os.path.join(self.output_dir, 'model_stats.json'), 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=2, sort_keys=True)
+
+        print('{} trainable parameters'.format(stats['trainable_parameters']))
@@ -0,0 +1,449 @@
+import argparse
+import collections
+import hashlib
+import json
+import os
+import re
+import time
+from array import array
+
+import numpy as np
+
+from corpus import bm25, bm25_idf
+
+INDEX_VERSION = 1
+# Same tokens as sklearn's CountVectorizer, which passage_relevance.py ranks with
+TOKEN_PATTERN = re.compile(r'(?u)\b\w\w+\b')
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Builds and searches a BM25 index over the unique passages of '
+                                                 'MS MARCO files.')
+    parser.add_argument('index_dir') # e.g. ./retrieval_index
+    parser.add_argument('--data_paths', '-d', nargs='+', default=None) # builds the index, e.g. datasets/msmarco/*/*.json
+    parser.add_argument('--query', '-qr', default=None) # prints the top passages of a question
+    parser.add_argument('--top_k', '-k', type=int, default=10)
+    parser.add_argument('--block_size', '-bs', type=int, default=128) # postings per block
+    parser.add_argument('--k1', type=float, default=1.2) # BM25 term frequency saturation
+    parser.add_argument('--b', type=float, default=0.75) # BM25 length normalization
+    parser.add_argument('--run_postings', '-rp', type=int, default=2 ** 22) # postings sorted in memory at once
+
+    return parser
+
+
+def analyze(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def encode_varints(values):
+    '''Variable byte encoding of non-negative integers, 7 bits to a byte with
+       the high bit set on the last byte of each. Returns the bytes and the
+       offset just past each value.
+    '''
+    values = np.asarray(values, dtype=np.uint64)
+    sizes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= np.uint64(7)
+
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    owners = np.repeat(np.arange(len(values)), sizes)
+    shifts = (7 * (np.arange(int(ends[-1]) if len(values) else 0) - starts[owners])).astype(np.uint64)
+    encoded = ((values[owners] >> shifts) & np.uint64(0x7f)).astype(np.uint8)
+    encoded[ends - 1] |= 0x80
+    return encoded, ends
+
+
+def decode_varints(encoded):
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    if len(encoded) == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = np.flatnonzero(encoded & 0x80)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    shifts = 7 * (np.arange(len(encoded)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((encoded & 0x7f).astype(np.int64) << shifts, starts)
+
+
+def passage_key(passage):
+    '''Passages are the same if both their URL and text are.'''
+    return hashlib.sha1((passage.get('url', '') + '\n' + passage['passage_text']).encode('utf-8')).digest()
+
+
+def source_signature(path):
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+
+def write_run(run_dir, run, terms, passages, frequencies, document_frequencies):
+    '''Sorts postings by term, keeping them in passage id order within
+       each term, and saves them as the run-th run. Returns
+       document_frequencies with the postings of the run added.
+    '''
+    terms = np.frombuffer(terms, dtype=np.int32)
+    order = np.argsort(terms, kind='mergesort')
+    for name, values in [('terms', terms), ('passages', np.frombuffer(passages, dtype=np.int32)),
+                         ('frequencies', np.frombuffer(frequencies, dtype=np.int32))]:
+        np.save(os.path.join(run_dir, '{}_{}.npy'.format(name, run)), values[order])
+
+    counts = np.bincount(terms, minlength=len(document_frequencies))
+    counts[:len(document_frequencies)] += document_frequencies
+    return counts
+
+
+def encode_blocks(terms, passages, frequencies, idf, lengths, average_length, block_size, k1, b):
+    '''Cuts the postings of whole terms, sorted by term then passage id,
+       into blocks of block_size. Returns the encoded blocks, the offset just
+       past each block in them, and the first and last passage id and the
+       highest BM25 score of each block.
+    '''
+    first_term = terms[0]
+    document_frequencies = np.bincount(terms - first_term)
+    term_starts = np.concatenate([[0], np.cumsum(document_frequencies)])
+    term_blocks = np.concatenate([[0], np.cumsum((document_frequencies + block_size - 1) // block_size)])
+    scores = bm25(idf[terms], frequencies, lengths[passages], average_length, k1, b)
+
+    # The block of each posting
+    ranks = np.arange(len(terms)) - term_starts[terms - first_term]
+    posting_blocks = term_blocks[terms - first_term] + ranks // block_size
+    block_starts = np.flatnonzero(np.diff(np.concatenate([[-1], posting_blocks])))
+    block_ends = np.concatenate([block_starts[1:], [len(terms)]])
+
+    # Each block holds its gaps, then its frequencies
+    block_start_of = block_starts[posting_blocks]
+    counts = (block_ends - block_starts)[posting_blocks]
+    gaps = np.diff(np.concatenate([[0], passages]))
+    gaps[block_starts] = 0
+    values = np.empty(2 * len(terms), dtype=np.int64)
+    values[block_start_of + np.arange(len(terms))] = gaps
+    values[block_start_of + np.arange(len(terms)) + counts] = frequencies
+    encoded, value_ends = encode_varints(values)
+    return (encoded, value_ends[2 * block_ends - 1], passages[block_starts], passages[block_ends - 1],
+            np.maximum.reduceat(scores, block_starts))
+
+
+def build_index(index_dir, data_paths, block_size=128, k1=1.2, b=0.75, run_postings=2 ** 22):
+    '''Writes an index of the unique passages of data_paths to index_dir.
+
+       Postings of each term are sorted by passage id and cut into blocks of
+       block_size, each stored as variable byte passage id gaps followed by
+       term frequencies, along with its first and last passage id and the
+       highest BM25 score of the term in it for search to skip by.
+
+       Postings are sorted in runs of run_postings and saved, then merged a
+       range of terms of about run_postings postings at a time, so memory
+       stays bounded by run_postings rather than the size of the corpus.
+    '''
+    run_dir = os.path.join(index_dir, 'runs')
+    if not os.path.exists(run_dir):
+        os.makedirs(run_dir)
+
+    term_ids = {}
+    seen = {}
+    lengths = array('i')
+    document_frequencies = np.zeros(0, dtype=np.int64)
+    posting_terms, posting_passages, posting_frequencies = array('i'), array('i'), array('i')
+    run_count = 0
+    passage_offsets = array('q', [0])
+    with open(os.path.join(index_dir, 'passages.json'), 'wb') as passage_file:
+        for path in data_paths:
+            print('Indexing passages of {}...'.format(path))
+            with open(path, encoding='utf-8') as data_file:
+                for line in data_file:
+                    for passage in json.loads(line)['passages']:
+                        key = passage_key(passage)
+                        if key in seen:
+                            continue
+                        passage_id = seen[key] = len(lengths)
+
+                        row = (json.dumps({'url': passage.get('url', ''), 'passage_text': passage['passage_text']},
+                                          ensure_ascii=False) + '\n').encode('utf-8')
+                        passage_file.write(row)
+                        passage_offsets.append(passage_offsets[-1] + len(row))
+
+                        tokens = analyze(passage['passage_text'])
+                        lengths.append(len(tokens))
+                        for term, frequency in collections.Counter(tokens).items():
+                            posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                            posting_passages.append(passage_id)
+                            posting_frequencies.append(frequency)
+
+                    if len(posting_terms) >= run_postings:
+                        document_frequencies = write_run(run_dir, run_count, posting_terms, posting_passages,
+                                                         posting_frequencies, document_frequencies)
+                        run_count += 1
+                        posting_terms, posting_passages, posting_frequencies = array('i'), array('i'), array('i')
+
+    if len(posting_terms):
+        document_frequencies = write_run(run_dir, run_count, posting_terms, posting_passages, posting_frequencies,
+                                         document_frequencies)
+        run_count += 1
+    del posting_terms, posting_passages, posting_frequencies, seen
+    document_frequencies = np.concatenate([document_frequencies,
+                                           np.zeros(len(term_ids) - len(document_frequencies), dtype=np.int64)])
+
+    lengths = np.frombuffer(lengths, dtype=np.int32)
+    passage_count = len(lengths)
+    average_length = float(lengths.mean()) if passage_count else 0.
+    idf = bm25_idf(document_frequencies, passage_count)
+    term_blocks = np.concatenate([[0], np.cumsum((document_frequencies + block_size - 1) // block_size)])
+    term_starts = np.concatenate([[0], np.cumsum(document_frequencies)])
+
+    runs = [dict((name, np.load(os.path.join(run_dir, '{}_{}.npy'.format(name, run)), mmap_mode='r'))
+                 for name in ['terms', 'passages', 'frequencies']) for run in range(run_count)]
+    block_offsets = [np.zeros(1, dtype=np.int64)]
+    block_first, block_last, block_max = [], [], []
+    postings_size = 0
+    with open(os.path.join(index_dir, 'postings.bin'), 'wb') as postings_file:
+        first_term = 0
+        while first_term < len(term_ids):
+            # Whole terms, about run_postings postings of them, from every run
+            end_term = int(np.searchsorted(term_starts, term_starts[first_term] + run_postings, side='right')) - 1
+            end_term = min(max(end_term, first_term + 1), len(term_ids))
+            pieces = []
+            for run in runs:
+                start, end = np.searchsorted(run['terms'], [first_term, end_term])
+                pieces.append([np.asarray(run[name][start:end]) for name in ['terms', 'passages', 'frequencies']])
+            terms, passages, frequencies = [np.concatenate([piece[i] for piece in pieces]) for i in range(3)]
+            first_term = end_term
+
+            # Runs hold increasing passage ids, so a stable sort by term keeps them sorted within each term
+            order = np.argsort(terms, kind='mergesort')
+            encoded, ends, first, last, maxima = encode_blocks(terms[order], passages[order], frequencies[order],
+                                                               idf, lengths, average_length, block_size, k1, b)
+            encoded.tofile(postings_file)
+            block_offsets.append(postings_size + ends)
+            block_first.append(first)
+            block_last.append(last)
+            block_max.append(maxima)
+            postings_size += len(encoded)
+
+    del runs
+    for run in range(run_count):
+        for name in ['terms', 'passages', 'frequencies']:
+            os.remove(os.path.join(run_dir, '{}_{}.npy'.format(name, run)))
+    os.rmdir(run_dir)
+
+    np.save(os.path.join(index_dir, 'block_offsets.npy'), np.concatenate(block_offsets).astype(np.int64))
+    np.save(os.path.join(index_dir, 'block_first.npy'), np.concatenate(block_first or [[]]).astype(np.int32))
+    np.save(os.path.join(index_dir, 'block_last.npy'), np.concatenate(block_last or [[]]).astype(np.int32))
+    np.save(os.path.join(index_dir, 'block_max.npy'), np.concatenate(block_max or [[]]).astype(np.float64))
+    np.save(os.path.join(index_dir, 'term_blocks.npy'), term_blocks.astype(np.int64))
+    np.save(os.path.join(index_dir, 'document_frequencies.npy'), document_frequencies.astype(np.int32))
+    np.save(os.path.join(index_dir, 'lengths.npy'), lengths)
+    np.save(os.path.join(index_dir, 'passage_offsets.npy'), np.frombuffer(passage_offsets, dtype=np.int64))
+    with open(os.path.join(index_dir, 'terms.json'), 'w', encoding='utf-8') as f:
+        json.dump(sorted(term_ids, key=term_ids.get), f, ensure_ascii=False)
+    with open(os.path.join(index_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'passages': passage_count, 'average_length': average_length,
+                   'block_size': block_size, 'k1': k1, 'b': b,
+                   'sources': [source_signature(path) for path in data_paths]}, f, indent=2)
+
+    print('Indexed {} unique passages and {} terms in {} ({:.1f} MB of postings)'
+          .format(passage_count, len(term_ids), index_dir, postings_size / 2 ** 20))
+
+
+class PassageIndex:
+    '''Searches an index written by build_index. Postings and passages stay
+       on disk and are read through memory maps.
+
+       Search is block-max pruned: the passage id range of the query is cut
+       at the block boundaries of its terms, each piece gets the sum of the
+       block maxima covering it as an upper bound, and pieces are scored from
+       the highest bound down until the k-th best score reaches the next
+       bound. The top k scores are the same as scoring every posting.
+    '''
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta['version'] != INDEX_VERSION:
+            raise ValueError('{} was built by another version, build it again'.format(index_dir))
+        with open(os.path.join(index_dir, 'terms.json'), encoding='utf-8') as f:
+            self.term_ids = dict((term, i) for i, term in enumerate(json.load(f)))
+
+        def load(name):
+            return np.load(os.path.join(index_dir, name), mmap_mode='r')
+
+        self.index_dir = index_dir
+        self.postings = np.memmap(os.path.join(index_dir, 'postings.bin'), dtype=np.uint8, mode='r') \
+            if os.path.getsize(os.path.join(index_dir, 'postings.bin')) else np.zeros(0, dtype=np.uint8)
+        self.block_offsets = load('block_offsets.npy')
+        self.block_first = load('block_first.npy')
+        self.block_last = load('block_last.npy')
+        self.block_max = load('block_max.npy')
+        self.term_blocks = load('term_blocks.npy')
+        self.lengths = load('lengths.npy')
+        self.passage_offsets = load('passage_offsets.npy')
+        self.idf = bm25_idf(load('document_frequencies.npy').astype(np.float64), self.meta['passages'])
+        # Read without seeking, so that server threads can share the index
+        self.passage_data = np.memmap(os.path.join(index_dir, 'passages.json'), dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return self.meta['passages']
+
+    def decode_blocks(self, blocks, block_terms):
+        '''Passage ids and BM25 scores of the postings of blocks, and the
+           position of the block of each in blocks, decoded together.
+        '''
+        starts = self.block_offsets[blocks]
+        sizes = self.block_offsets[blocks + 1] - starts
+        ends = np.cumsum(sizes)
+        encoded = self.postings[np.repeat(starts - (ends - sizes), sizes) + np.arange(ends[-1])]
+        values = decode_varints(encoded)
+
+        # Every block holds as many gaps as frequencies
+        value_blocks = np.searchsorted(ends, np.flatnonzero(encoded & 0x80), side='right')
+        value_counts = np.bincount(value_blocks, minlength=len(blocks))
+        value_starts = np.cumsum(value_counts) - value_counts
+        is_gap = np.arange(len(values)) - value_starts[value_blocks] < value_counts[value_blocks] // 2
+        posting_blocks = value_blocks[is_gap]
+
+        # The first gap of a block is 0, so sums restart from its first passage id
+        sums = np.cumsum(values[is_gap])
+        firsts = np.flatnonzero(np.diff(np.concatenate([[-1], posting_blocks])))
+        passages = self.block_first[blocks][posting_blocks] + sums - np.repeat(sums[firsts], np.diff(
+            np.concatenate([firsts, [len(sums)]])))
+        scores = bm25(self.idf[block_terms[posting_blocks]], values[~is_gap], self.lengths[passages],
+                      self.meta['average_length'], self.meta['k1'], self.meta['b'])
+        return passages, scores
+
+    def search(self, query, top_k=10, first_batch=16):
+        '''(passage id, BM25 score) of the top_k passages, best first. Pieces
+           are scored in batches, starting with first_batch pieces and
+           doubling.
+        '''
+        terms = sorted(set(self.term_ids[t] for t in analyze(query) if t in self.term_ids))
+        if not terms or top_k <= 0:
+            return []
+
+        blocks = [(t, int(self.term_blocks[t]), int(self.term_blocks[t + 1])) for t in terms]
+        boundaries = np.unique(np.concatenate([self.block_first[start:end] for _, start, end in blocks] +
+                                              [self.block_last[start:end] + 1 for _, start, end in blocks]))
+        starts = boundaries[:-1]
+
+        # The block of each term covering each piece, or -1
+        covering = np.full((len(terms), len(starts)), -1, dtype=np.int64)
+        upper_bounds = np.zeros(len(starts))
+        for i, (t, start, end) in enumerate(blocks):
+            j = np.minimum(np.searchsorted(self.block_last[start:end], starts), end - start - 1)
+            covered = (self.block_first[start:end][j] <= starts) & (self.block_last[start:end][j] >= starts)
+            covering[i, covered] = start + j[covered]
+            upper_bounds[covered] += self.block_max[start:end][j[covered]]
+        block_terms = np.zeros(int(self.term_blocks[terms[-1] + 1]), dtype=np.int64)
+        for t, start, end in blocks:
+            block_terms[start:end] = t
+
+        order = np.argsort(-upper_bounds, kind='mergesort')
+        order = order[upper_bounds[order] > 0]
+        top_passages = np.zeros(0, dtype=np.int64)
+        top_scores = np.zeros(0)
+        # Postings of the blocks decoded so far, which later pieces may share
+        decoded = np.zeros(len(block_terms), dtype=bool)
+        passages = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0)
+        posting_pieces = np.zeros(0, dtype=np.int64)
+        position = 0
+        batch = first_batch
+        while position < len(order):
+            if len(top_scores) == top_k and upper_bounds[order[position]] <= top_scores[-1]:
+                break
+            pieces = order[position:position + batch]
+            position += batch
+            batch *= 2
+
+            needed = np.unique(covering[:, pieces])
+            needed = needed[(needed >= 0) & ~decoded[np.maximum(needed, 0)]]
+            if len(needed):
+                decoded[needed] = True
+                new_passages, new_scores = self.decode_blocks(needed, block_terms[needed])
+                passages = np.concatenate([passages, new_passages])
+                scores = np.concatenate([scores, new_scores])
+                posting_pieces = np.concatenate([posting_pieces,
+                                                 np.searchsorted(boundaries, new_passages, side='right') - 1])
+            in_batch = np.zeros(len(starts) + 1, dtype=bool)
+            in_batch[pieces] = True
+            keep = in_batch[posting_pieces]
+
+            # Every posting of a piece is in this batch, so its passages get their full scores
+            unique, inverse = np.unique(passages[keep], return_inverse=True)
+            totals = np.bincount(inverse, weights=scores[keep], minlength=len(unique))
+            top_passages = np.concatenate([top_passages, unique])
+            top_scores = np.concatenate([top_scores, totals])
+            best = np.lexsort((top_passages, -top_scores))[:top_k]
+            top_passages, top_scores = top_passages[best], top_scores[best]
+
+        return list(zip(top_passages.tolist(), top_scores.tolist()))
+
+    def passage(self, passage_id):
+        '''The url and passage_text of a passage.'''
+        start, end = int(self.passage_offsets[passage_id]), int(self.passage_offsets[passage_id + 1])
+        return json.loads(self.passage_data[start:end].tobytes().decode('utf-8'))
+
+    def retrieve(self, query, top_k=10):
+        '''The top_k passages of query, with their passage_id and score.'''
+        return [dict(self.passage(passage_id), passage_id=passage_id, score=score)
+                for passage_id, score in self.search(query, top_k)]
+
+
+def retrieve_file(index, data_path, output_path, top_k=10):
+    '''Writes the records of data_path with their passages replaced by the
+       top_k retrieved for their query, for Data to load like any split.
+       Retrieved passages that were selected for the query keep is_selected.
+       Records whose query matches no passage keep their own passages.
+    '''
+    directory = os.path.dirname(output_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+
+    kept = 0
+    with open(data_path, encoding='utf-8') as data_file, open(output_path, 'w', encoding='utf-8') as output_file:
+        for line in data_file:
+            record = json.loads(line)
+            selected = set(passage_key(p) for p in record['passages'] if p.get('is_selected', 0))
+            retrieved = index.retrieve(record['query'], top_k)
+            if retrieved:
+                record['passages'] = [{'url': p['url'], 'passage_text': p['passage_text'],
+                                       'is_selected': int(passage_key(p) in selected)} for p in retrieved]
+            else:
+                kept += 1
+            output_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    if kept:
+        print('{} queries of {} matched no passage and kept their own'.format(kept, data_path))
+
+
+def retrieved_path(index_dir, data_path, top_k):
+    '''Where the retrieved version of a split is kept, written if it is
+       missing or older than the index or the split.
+    '''
+    split = os.path.basename(os.path.dirname(os.path.abspath(data_path)))
+    name = os.path.splitext(os.path.basename(data_path))[0]
+    path = os.path.join(index_dir, 'retrieved', split, '{}_top{}.json'.format(name, top_k))
+    if not os.path.exists(path) or os.path.getmtime(path) < max(os.path.getmtime(data_path),
+                                                                os.path.getmtime(os.path.join(index_dir, 'meta.json'))):
+        index = PassageIndex(index_dir)
+        print('Retrieving passages for {}...'.format(data_path))
+        retrieve_file(index, data_path, path, top_k)
+    return path
+
+
+def main():
+    config = get_parser().parse_args()
+    if config.data_paths:
+        build_index(config.index_dir, config.data_paths, config.block_size, config.k1, config.b,
+                    config.run_postings)
+
+    if config.query:
+        index = PassageIndex(config.index_dir)
+        start = time.perf_counter()
+        passages = index.retrieve(config.query, config.top_k)
+        print('{} passages in {:.1f} ms'.format(len(passages), 1000 * (time.perf_counter() - start)))
+        for p in passages:
+            print('{:8.3f} {:>8} {}'.format(p['score'], p['passage_id'], p['url']))
+            print('         {}'.format(p['passage_text'][:200]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+This module performs unit tests for retrieval.py .
+
+Command line:
+$ python retrieval_test.py
+"""
+
+import collections
+import json
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from corpus import bm25, bm25_idf
+from retrieval import PassageIndex, analyze, build_index, decode_varints, encode_varints
+
+WORDS = ['where', 'city', 'river', 'located', 'state', 'county', 'north', 'south', 'capital', 'lake',
+         'mountain', 'island', 'coast', 'valley', 'bridge', 'park', 'road', 'port', 'bay', 'hill']
+
+
+def write_data(path, query_count, seed=0):
+    """Records of random passages over a small vocabulary, some passages
+    repeated across queries, as in MS MARCO."""
+
+    generator = random.Random(seed)
+    passages = []
+    with open(path, 'w', encoding='utf-8') as data_file:
+        for query_id in range(query_count):
+            record = []
+            for _ in range(generator.randint(1, 6)):
+                if passages and generator.random() < 0.2:
+                    record.append(generator.choice(passages))
+                    continue
+                text = ' '.join(generator.choice(WORDS) for _ in range(generator.randint(1, 30)))
+                passages.append({'url': 'http://example.com/{}'.format(len(passages)), 'passage_text': text})
+                record.append(passages[-1])
+            data_file.write(json.dumps({'query_id': query_id, 'query': '',
+                                        'passages': [dict(p, is_selected=0) for p in record]}) + '\n')
+
+
+def exhaustive_scores(index, query):
+    """BM25 score of every passage of the index, scoring every posting."""
+
+    texts = [index.passage(i)['passage_text'] for i in range(len(index))]
+    lengths = np.array([len(analyze(text)) for text in texts], dtype=np.float64)
+    counts = [collections.Counter(analyze(text)) for text in texts]
+    scores = np.zeros(len(texts))
+    for term in set(analyze(query)):
+        frequencies = np.array([c[term] for c in counts], dtype=np.float64)
+        idf = bm25_idf(np.count_nonzero(frequencies), len(texts))
+        matched = frequencies > 0
+        scores[matched] += bm25(idf, frequencies[matched], lengths[matched], lengths.mean(),
+                                index.meta['k1'], index.meta['b'])
+    return scores
+
+
+class Test(unittest.TestCase):
+    """Unit tests for retrieval.py ."""
+
+    def test_varints(self):
+        """Unit test for decoding variable byte encoded integers."""
+
+        values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2 ** 31 - 1, 2 ** 40], dtype=np.int64)
+        encoded, ends = encode_varints(values)
+        self.assertEqual(ends.tolist(), [1, 2, 3, 5, 7, 9, 12, 17, 23])
+        self.assertEqual(decode_varints(encoded).tolist(), values.tolist())
+        self.assertEqual(decode_varints(encode_varints([])[0]).tolist(), [])
+
+    def test_search(self):
+        """Unit test for block-max pruned search against scoring every posting."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            data_path = os.path.join(directory, 'location.json')
+            write_data(data_path, 200)
+            build_index(os.path.join(directory, 'index'), [data_path], block_size=4, run_postings=100)
+            index = PassageIndex(os.path.join(directory, 'index'))
+
+            generator = random.Random(1)
+            for _ in range(50):
+                query = ' '.join(generator.choice(WORDS + ['unknown']) for _ in range(generator.randint(1, 4)))
+                scores = exhaustive_scores(index, query)
+                for top_k in [1, 5, 20]:
+                    results = index.search(query, top_k, first_batch=2)
+                    expected = np.sort(scores[scores > 0])[::-1][:top_k]
+                    np.testing.assert_allclose([score for _, score in results], expected)
+                    for passage_id, score in results:
+                        self.assertAlmostEqual(score, scores[passage_id])
+
+    def test_runs(self):
+        """Unit test for building an index from many runs, which gives the same
+        index as sorting every posting at once."""
+
+        with tempfile.TemporaryDirectory() as directory:
+            data_path = os.path.join(directory, 'location.json')
+            write_data(data_path, 100)
+            build_index(os.path.join(directory, 'one_run'), [data_path], block_size=4)
+            build_index(os.path.join(directory, 'runs'), [data_path], block_size=4, run_postings=10)
+
+            names = sorted(os.listdir(os.path.join(directory, 'one_run')))
+            self.assertEqual(sorted(os.listdir(os.path.join(directory, 'runs'))), names)
+            for name in names:
+                if name == 'meta.json':
+                    continue
+                with open(os.path.join(directory, 'one_run', name), 'rb') as one_run, \
+                     open(os.path.join(directory, 'runs', name), 'rb') as runs:
+                    self.assertEqual(one_run.read(), runs.read(), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import tensorflow as tf
+from tensorflow.contrib.rnn import DropoutWrapper
+from tensorflow.contrib.rnn import GRUBlockCell
+from tensorflow.contrib.rnn import GRUCell
+from tensorflow.contrib.rnn import LSTMBlockCell
+from tensorflow.contrib.rnn import LSTMBlockFusedCell
+from tensorflow.contrib.rnn import LSTMCell
+from tensorflow.contrib.rnn import TimeReversedFusedRNN
+
+
+# lstm, lstm_block and lstm_fused create the same variables (lstm_cell/weights
+# and lstm_cell/biases, gates in the same order), so their checkpoints can be
+# restored into each other; python rnn_cells.py checks it. gru_block names its
+# variables differently to gru.
+CELLS = ['lstm', 'gru', 'lstm_block', 'gru_block', 'lstm_fused']
+
+
+def get_cell(cell, dim, keep_prob):
+    '''A single step cell with dropout on its inputs, for use with
+       tf.nn.dynamic_rnn. The fused backend falls back to LSTMBlockCell.
+    '''
+    if cell == 'lstm':
+        step_cell = LSTMCell(dim)
+    elif cell == 'gru':
+        step_cell = GRUCell(dim)
+    elif cell in ('lstm_block', 'lstm_fused'):
+        # Its default scope is lstm_cell already, like LSTMCell
+        step_cell = LSTMBlockCell(dim)
+    elif cell == 'gru_block':
+        step_cell = GRUBlockCell(dim)
+    else:
+        raise ValueError('Unknown cell {}, expected one of {}'.format(cell, CELLS))
+
+    return DropoutWrapper(step_cell, input_keep_prob=keep_prob)  # to avoid over-fitting
+
+
+def fused_rnn(dim, inputs, sequence_length, keep_prob, reverse=False):
+    # Same dropout as DropoutWrapper, but applied to the whole sequence at once
+    inputs = tf.nn.dropout(inputs, keep_prob)
+
+    fused_cell = LSTMBlockFusedCell(dim)
+    if reverse:
+        fused_cell = TimeReversedFusedRNN(fused_cell)
+
+    # The fused kernel runs the whole sequence in one op, but wants [time, batch, depth]
+    outputs, state = fused_cell(tf.transpose(inputs, [1, 0, 2]), dtype=tf.float32,
+                                sequence_length=sequence_length, scope='lstm_cell')
+    outputs = tf.transpose(outputs, [1, 0, 2])
+
+    # Zero the outputs past the end of each sequence, as dynamic_rnn does
+    max_time = inputs.get_shape()[1].value or tf.shape(inputs)[1]
+    mask = tf.sequence_mask(sequence_length, max_time, dtype=tf.float32)
+    return outputs * tf.expand_dims(mask, -1), state
+
+
+def dynamic_rnn(cell, dim, inputs, sequence_length, keep_prob):
+    '''Runs a cell over batch major inputs, like tf.nn.dynamic_rnn.'''
+    if cell != 'lstm_fused':
+        return tf.nn.dynamic_rnn(get_cell(cell, dim, keep_prob), inputs,
+                                 sequence_length=sequence_length, dtype=tf.float32)
+
+    with tf.variable_scope('rnn'):
+        return fused_rnn(dim, inputs, sequence_length, keep_prob)
+
+
+def bidirectional_rnn(cell, dim, inputs, sequence_length, keep_prob):
+    '''Runs a cell over batch major inputs in both directions, like
+       tf.nn.bidirectional_dynamic_rnn, and returns (outputs_fw, outputs_bw).
+    '''
+    if cell != 'lstm_fused':
+        d_cell = get_cell(cell, dim, keep_prob)
+        outputs, _ = tf.nn.bidirectional_dynamic_rnn(d_cell, d_cell, inputs=inputs,
+                                                     sequence_length=sequence_length, dtype=tf.float32)
+        return outputs
+
+    with tf.variable_scope('bidirectional_rnn'):
+        with tf.variable_scope('fw'):
+            outputs_fw, _ = fused_rnn(dim, inputs, sequence_length, keep_prob)
+        with tf.variable_scope('bw'):
+            outputs_bw, _ = fused_rnn(dim, inputs, sequence_length, keep_prob, reverse=True)
+
+    return outputs_fw, outputs_bw
+
+
+def variable_shapes(cell, dim=4, max_time=3, depth=5):
+    '''Names and shapes of the variables a backend creates for one
+       dynamic_rnn and one bidirectional_rnn, in a graph of its own.
+    '''
+    with tf.Graph().as_default():
+        inputs = tf.placeholder(tf.float32, [None, max_time, depth])
+        sequence_length = tf.placeholder(tf.int32, [None])
+        with tf.variable_scope('single'):
+            dynamic_rnn(cell, dim, inputs, sequence_length, 1.0)
+        with tf.variable_scope('both'):
+            bidirectional_rnn(cell, dim, inputs, sequence_length, 1.0)
+        return sorted((v.op.name, v.get_shape().as_list()) for v in tf.global_variables())
+
+
+def main():
+    expected = variable_shapes('lstm')
+    for cell in ['lstm_block', 'lstm_fused']:
+        shapes = variable_shapes(cell)
+        assert shapes == expected, '{} variables {} differ from lstm {}'.format(cell, shapes, expected)
+        print('{} checkpoints are compatible with lstm: {}'.format(cell, ', '.join(name for name, _ in shapes)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import collections
+
+import numpy as np
+
+
+SENTENCE_ENDS = set(['.', '?', '!'])
+
+
+def sentence_ids(tokens):
+    '''Index of the sentence each token belongs to, with sentences ending
+       after a '.', '?' or '!' token.
+    '''
+    ends = np.array([w in SENTENCE_ENDS for w in tokens], dtype=np.int64)
+    return np.concatenate([[0], np.cumsum(ends)[:-1]]).astype(np.int64)
+
+
+class SentenceFilter:
+    '''Keeps the sentences of a passage that share the most words with the
+       question, weighting each shared word by its inverse document frequency.
+    '''
+
+    def __init__(self, documents, top_sentences):
+        self.top_sentences = top_sentences
+
+        document_frequency = collections.Counter(w for document in documents for w in set(document))
+        self.word_index = dict((w, i) for i, w in enumerate(document_frequency))
+        self.unknown = len(self.word_index)
+
+        # Smoothed like sklearn's TfidfVectorizer, with an extra entry for unseen words
+        df = np.array(list(document_frequency.values()) + [0], dtype=np.float64)
+        self.idf = np.log((1.0 + len(documents)) / (1.0 + df)) + 1.0
+
+    def ids(self, tokens):
+        return np.array([self.word_index.get(w, self.unknown) for w in tokens], dtype=np.int64)
+
+    def score(self, tokens, question):
+        '''Returns the sentence of each token and the score of each sentence.'''
+        token_ids = self.ids(tokens)
+        sentences = sentence_ids(tokens)
+        # Looked up in the sorted question ids, np.isin is newer than the numpy we pin
+        question_ids = np.unique(self.ids(question))
+        question_ids = question_ids[question_ids != self.unknown]
+        found = np.minimum(np.searchsorted(question_ids, token_ids), max(len(question_ids) - 1, 0))
+        matches = question_ids[found] == token_ids if len(question_ids) else np.zeros(len(token_ids), dtype=bool)
+        scores = np.bincount(sentences, weights=matches * self.idf[token_ids])
+        return sentences, scores
+
+    def filter(self, tokens, question):
+        '''Returns the tokens of the best top_sentences sentences, in their
+           original order, and the position of each kept token in the passage.
+        '''
+        if len(tokens) == 0:
+            return tokens, []
+
+        sentences, scores = self.score(tokens, question)
+        if len(scores) <= self.top_sentences:
+            return tokens, list(range(len(tokens)))
+
+        # Stable, so ties go to the earlier sentence
+        keep = np.zeros(len(scores), dtype=bool)
+        keep[np.argsort(-scores, kind='mergesort')[:self.top_sentences]] = True
+        positions = np.flatnonzero(keep[sentences])
+        return [tokens[i] for i in positions], positions.tolist()
@@ -0,0 +1,299 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+import tensorflow as tf
+
+import chunking
+import retrieval
+from answer_cache import AnswerCache, checkpoint_version
+from data import get_unknown_classes, passage_weights, tokenize
+from main_multi import merge_windows
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Serves answers from a saved model over HTTP.')
+    parser.add_argument('model_path') # e.g. ./saved_models/location_bidaf.json
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', '-p', type=int, default=8000)
+    parser.add_argument('--max_batch_size', '-b', type=int, default=64) # windows run together
+    parser.add_argument('--max_wait_ms', '-w', type=float, default=5.0) # wait for a batch to fill
+    parser.add_argument('--window_stride', '-wst', type=int, default=0) # defaults to half the context size
+    parser.add_argument('--cache_size', '-cs', type=int, default=10000) # answers kept in memory, 0 disables
+    parser.add_argument('--cache_path', '-cp', default=None) # e.g. ./cache/answers.db to keep answers on disk
+    parser.add_argument('--index_dir', '-ix', default=None) # answers questions sent without passages from this index
+    parser.add_argument('--top_k', '-k', type=int, default=10) # passages retrieved per question
+
+    return parser
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+class MicroBatcher:
+    '''Collects items submitted from many threads into batches of up to
+       max_batch_size, waiting at most max_wait seconds after the first item
+       for the batch to fill, and runs them on a single worker thread.
+    '''
+
+    def __init__(self, run_batch, max_batch_size, max_wait):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.batch_sizes = []
+
+        self.worker = threading.Thread(target=self.loop, name='micro-batcher')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.queue.get(block=remaining > 0, timeout=max(remaining, 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def loop(self):
+        while True:
+            batch = self.next_batch()
+            self.batch_sizes.append(len(batch))
+            items = [item for item, _ in batch]
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class Reader:
+    '''Loads a model saved by main.py, along with its vocabulary, and answers
+       questions over a list of passages. Passages are split into windows of
+       the model's context size, and the windows of all concurrent requests
+       are run through the model together by a MicroBatcher.
+    '''
+
+    def __init__(self, model_path, max_batch_size, max_wait, window_stride=0, cache_size=0, cache_path=None):
+        self.sess = tf.Session()
+        checkpoint = tf.train.latest_checkpoint(model_path)
+        saver = tf.train.import_meta_graph(model_path + '/model.meta')
+        saver.restore(self.sess, checkpoint)
+        graph = self.sess.graph
+
+        self.vocab = [w.decode('utf-8') if isinstance(w, bytes) else w for w in tf.get_collection('vocab')]
+        self.word_index = dict((w, i) for i, w in enumerate(self.vocab))
+        self.max_x, self.max_q = tf.get_collection('dimensions')
+        self.window_stride = window_stride or max(1, self.max_x // 2)
+
+        # Smart unknown words are on if the model learned vectors for more than one unknown class
+        unknown_vectors = graph.get_tensor_by_name('embedding_matrix/unknown_vectors:0')
+        self.unknown_classes = get_unknown_classes(unknown_vectors.get_shape()[0].value > 1)
+        self.padding = len(self.vocab) + len(self.unknown_classes)
+
+        self.x = graph.get_tensor_by_name('x:0')
+        self.x_len = graph.get_tensor_by_name('x_len:0')
+        self.q = graph.get_tensor_by_name('q:0')
+        self.q_len = graph.get_tensor_by_name('q_len:0')
+        self.keep_prob = graph.get_tensor_by_name('keep_prob:0')
+        self.logits = tf.get_collection('logits')
+
+        self.batcher = MicroBatcher(self.run_batch, max_batch_size, max_wait)
+
+        self.cache = None
+        if cache_size:
+            version = checkpoint_version(checkpoint, {'window_stride': self.window_stride})
+            self.cache = AnswerCache(cache_size, version, cache_path)
+
+    def word_id(self, word):
+        if word in self.word_index:
+            return self.word_index[word]
+        for j in range(len(self.unknown_classes)):
+            if self.unknown_classes[j].match(word):
+                return len(self.word_index) + j
+
+    def pad(self, ids, maxlen):
+        ids = ids[:maxlen]
+        return ids + [self.padding] * (maxlen - len(ids))
+
+    def run_batch(self, windows):
+        feed_dict = {self.x: [w['x'] for w in windows],
+                     self.x_len: [w['x_len'] for w in windows],
+                     self.q: [w['q'] for w in windows],
+                     self.q_len: [w['q_len'] for w in windows],
+                     self.keep_prob: 1.0}
+        logits_start, logits_end = self.sess.run(self.logits, feed_dict=feed_dict)
+        return list(zip(softmax(logits_start), softmax(logits_end)))
+
+    def tokenize(self, text):
+        text = text.replace("''", '" ').replace("``", '" ')
+        return tokenize(text.lower())
+
+    def answer(self, question, passages):
+        '''Returns the best answer span over all passages, and the best span
+           and score of each passage.
+        '''
+        timing = {}
+        start = time.perf_counter()
+        question_tokens = self.tokenize(question)
+        passage_tokens = [self.tokenize(p) for p in passages]
+        timing['tokenize'] = time.perf_counter() - start
+
+        # Keyed on tokens rather than ids, since answers are built from the
+        # passage words and unknown words share ids
+        if self.cache is not None:
+            key = self.cache.key(question_tokens, passage_tokens)
+            response = self.cache.get(key)
+            if response is not None:
+                return dict(response, timing=timing, cached=True)
+
+        start = time.perf_counter()
+        try:
+            weights = passage_weights(passage_tokens, question_tokens)
+        except ValueError:
+            # Every word is a stop word
+            weights = [1.0 / len(passages)] * len(passages)
+        timing['relevance'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        question_ids = [self.word_id(w) for w in question_tokens]
+        passage_ids = [[self.word_id(w) for w in tokens] for tokens in passage_tokens]
+        q = self.pad(question_ids, self.max_q)
+        q_len = min(len(question_ids), self.max_q)
+        futures = []
+        for ids in passage_ids:
+            offsets, windows = chunking.split_windows(ids, self.max_x, self.window_stride)
+            futures.append((offsets, [self.batcher.submit({'x': self.pad(w, self.max_x), 'x_len': len(w),
+                                                           'q': q, 'q_len': q_len})
+                                      for w in windows]))
+        timing['vectorize'] = time.perf_counter() - start
+
+        # Includes waiting for the batch to fill
+        start = time.perf_counter()
+        probs = [[future.result() for future in window_futures] for _, window_futures in futures]
+        timing['model'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = []
+        for p, (offsets, _) in enumerate(futures):
+            begin, end, begin_prob, end_prob, _, _ = merge_windows(
+                len(passage_tokens[p]), list(range(len(passage_tokens[p]))), offsets,
+                [b for b, _ in probs[p]], [e for _, e in probs[p]])
+            results.append({'start': begin, 'end': end, 'relevance': float(weights[p]),
+                            'score': float(weights[p] * begin_prob * end_prob),
+                            'answer': ' '.join(passage_tokens[p][begin:end + 1])})
+        timing['decode'] = time.perf_counter() - start
+
+        best = max(range(len(results)), key=lambda p: results[p]['score'])
+        response = {'answer': results[best]['answer'], 'passage_index': best,
+                    'start': results[best]['start'], 'end': results[best]['end'],
+                    'score': results[best]['score'], 'passages': results}
+        if self.cache is not None:
+            self.cache.put(key, response)
+        return dict(response, timing=timing, cached=False)
+
+
+class AnswerHandler(BaseHTTPRequestHandler):
+    '''POST /answer with {"question": "...", "passages": ["...", ...]}, where
+       passages may also be MS MARCO style {"passage_text": "..."} objects.
+       Without passages, the top_k passages are retrieved from the index.
+    '''
+
+    def send_json(self, status, body):
+        content = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/health':
+            reader = self.server.reader
+            self.send_json(200, {'status': 'ok', 'batch_sizes': reader.batcher.batch_sizes[-100:],
+                                 'cache': reader.cache.stats() if reader.cache is not None else None})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/answer':
+            self.send_json(404, {'error': 'not found'})
+            return
+
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            question = request['question'] if 'question' in request else request['query']
+            retrieved = None
+            if 'passages' not in request and self.server.index is not None:
+                start = time.perf_counter()
+                retrieved = self.server.index.retrieve(question, int(request.get('top_k', self.server.top_k)))
+                retrieve_time = time.perf_counter() - start
+                request['passages'] = retrieved
+            passages = [p['passage_text'] if isinstance(p, dict) else p for p in request['passages']]
+            if not passages:
+                raise ValueError('no passages')
+        except (KeyError, TypeError, ValueError) as e:
+            self.send_json(400, {'error': 'expected a question and a list of passages: {}'.format(e)})
+            return
+
+        response = self.server.reader.answer(question, passages)
+        if retrieved is not None:
+            response['timing'] = dict(response['timing'], retrieve=retrieve_time)
+            response['passages'] = [dict(result, passage_id=passage['passage_id'], url=passage['url'],
+                                         bm25=passage['score'])
+                                    for result, passage in zip(response['passages'], retrieved)]
+        if 'query_id' in request:
+            response['query_id'] = request['query_id']
+        self.send_json(200, response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AnswerServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, reader, index=None, top_k=10):
+        HTTPServer.__init__(self, address, AnswerHandler)
+        self.reader = reader
+        self.index = index
+        self.top_k = top_k
+
+
+def main():
+    config = get_parser().parse_args()
+    reader = Reader(config.model_path, config.max_batch_size, config.max_wait_ms / 1000.0, config.window_stride,
+                    config.cache_size, config.cache_path)
+    index = retrieval.PassageIndex(config.index_dir) if config.index_dir else None
+    server = AnswerServer((config.host, config.port), reader, index, config.top_k)
+    print('Serving {} on http://{}:{}/answer'.format(config.model_path, config.host, config.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        if reader.cache is not None:
+            reader.cache.close()
+
+
+if __name__ == '__main__':
+    main()
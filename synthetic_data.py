@@ -0,0 +1,138 @@
+import argparse
+import bisect
+import itertools
+import json
+import math
+import os
+import random
+import string
+
+
+SPLITS = ['train', 'dev', 'test']
+QUESTION_TYPES = ['description', 'entity', 'location', 'numeric', 'person']
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Generates a deterministic MS MARCO-like dataset and '
+                                                 'matching GloVe file for benchmarking.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--question_type', '-q', default='location', choices=QUESTION_TYPES)
+    parser.add_argument('--queries', '-n', type=int, default=1000) # per split
+    parser.add_argument('--passages', '-p', type=int, default=10) # per query
+    parser.add_argument('--passage_length', '-pl', type=int, default=60) # median tokens
+    parser.add_argument('--passage_length_sigma', '-ps', type=float, default=0.5) # log-normal spread
+    parser.add_argument('--max_passage_length', '-mpl', type=int, default=250)
+    parser.add_argument('--question_length', '-ql', type=int, default=7)
+    parser.add_argument('--answer_length', '-al', type=int, default=4)
+    parser.add_argument('--vocab_size', '-vs', type=int, default=5000)
+    parser.add_argument('--unknown_rate', '-ur', type=float, default=0.05) # words missing from GloVe
+    parser.add_argument('--emb_size', '-es', type=int, default=50)
+    parser.add_argument('--seed', '-s', type=int, default=0)
+
+    return parser
+
+
+class SyntheticMsmarco:
+    '''Generates queries whose selected passage contains the answer verbatim,
+       with Zipf distributed words so that vocabularies and unknown word rates
+       look like real text.
+    '''
+
+    def __init__(self, config):
+        self.config = config
+        self.random = random.Random(config.seed)
+        # 'a' is always in the vocabulary since Data reads the embedding size from it
+        words = sorted(set(self.make_word() for _ in range(config.vocab_size - 1)) - {'a'})
+        self.random.shuffle(words)
+        self.vocab = ['a'] + words
+        self.known = set(w for w in self.vocab if self.random.random() >= config.unknown_rate)
+        self.known.add('a')
+        self.cumulative_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(self.vocab))))
+        self.next_query_id = 0
+
+    def make_word(self):
+        length = self.random.randint(2, 9)
+        return ''.join(self.random.choice(string.ascii_lowercase) for _ in range(length))
+
+    def words(self, n):
+        total = self.cumulative_weights[-1]
+        words = [self.vocab[bisect.bisect(self.cumulative_weights, self.random.random() * total)]
+                 for _ in range(n)]
+        # Numbers and punctuation exercise the smart unknown word classes
+        for i in range(len(words)):
+            r = self.random.random()
+            if r < 0.03:
+                words[i] = str(self.random.randint(0, 2000))
+            elif r < 0.08:
+                words[i] += self.random.choice(',.')
+        return words
+
+    def passage_length(self):
+        length = self.random.lognormvariate(math.log(self.config.passage_length), self.config.passage_length_sigma)
+        return max(self.config.answer_length + 1, min(self.config.max_passage_length, int(length)))
+
+    def query(self):
+        query_id = self.next_query_id
+        self.next_query_id += 1
+
+        passages = [self.words(self.passage_length()) for _ in range(self.config.passages)]
+        selected = self.random.randrange(len(passages))
+        start = self.random.randrange(len(passages[selected]) - self.config.answer_length + 1)
+        answer = passages[selected][start:start + self.config.answer_length]
+
+        return {
+            'query_id': query_id,
+            'query_type': self.config.question_type,
+            'query': ' '.join(self.words(self.config.question_length)),
+            'passages': [{'is_selected': int(i == selected),
+                          'passage_text': ' '.join(p),
+                          'url': 'http://example.com/{}/{}'.format(query_id, i)}
+                         for i, p in enumerate(passages)],
+            'answers': [' '.join(answer).strip(',.')],
+        }
+
+    def write_split(self, split):
+        split_dir = os.path.join(self.config.output_dir, 'msmarco', split)
+        if not os.path.exists(split_dir):
+            os.makedirs(split_dir)
+
+        path = os.path.join(split_dir, self.config.question_type + '.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            for _ in range(self.config.queries):
+                print(json.dumps(self.query()), file=f)
+        return path
+
+    def write_glove(self):
+        glove_dir = os.path.join(self.config.output_dir, 'glove')
+        if not os.path.exists(glove_dir):
+            os.makedirs(glove_dir)
+
+        path = os.path.join(glove_dir, 'glove.6B.{}d.txt'.format(self.config.emb_size))
+        with open(path, 'w', encoding='utf-8') as f:
+            for word in self.vocab:
+                if word in self.known:
+                    vector = ' '.join('{:.5f}'.format(self.random.gauss(0, 0.4))
+                                      for _ in range(self.config.emb_size))
+                    print(word, vector, file=f)
+            for punctuation in string.punctuation:
+                print(punctuation, ' '.join(['0.1'] * self.config.emb_size), file=f)
+        return path
+
+    def generate(self):
+        '''Writes <output_dir>/msmarco/{train,dev,test}/<question_type>.json and
+           <output_dir>/glove/glove.6B.<emb_size>d.txt, laid out like datasets/.
+        '''
+        paths = {split: self.write_split(split) for split in SPLITS}
+        paths['glove'] = self.write_glove()
+        return paths
+
+
+def main():
+    config = get_parser().parse_args()
+    paths = SyntheticMsmarco(config).generate()
+    for name, path in sorted(paths.items()):
+        print('{}: {}'.format(name, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import json
+import resource
+import time
+
+import numpy as np
+import tensorflow as tf
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+class ThroughputMonitor:
+    '''Times each training step, split into assembling the batch and running
+       the session, and writes the measurements to TensorBoard as scalars.
+    '''
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.batch_times = []
+        self.run_times = []
+        self.examples = []
+        self.real_tokens = []
+        self.padded_tokens = []
+        self.step_start = None
+        self.batch_end = None
+
+    def start_step(self):
+        self.step_start = time.perf_counter()
+
+    def batch_ready(self):
+        self.batch_end = time.perf_counter()
+
+    def end_step(self, step, examples, real_tokens, padded_tokens):
+        end = time.perf_counter()
+        batch_time = self.batch_end - self.step_start
+        run_time = end - self.batch_end
+
+        self.batch_times.append(batch_time)
+        self.run_times.append(run_time)
+        self.examples.append(examples)
+        self.real_tokens.append(real_tokens)
+        self.padded_tokens.append(padded_tokens)
+
+        step_time = batch_time + run_time
+        values = {
+            'batch_time': batch_time,
+            'run_time': run_time,
+            'input_fraction': batch_time / step_time,
+            'examples_per_sec': examples / step_time,
+            'tokens_per_sec': real_tokens / step_time,
+            'padding_ratio': 1.0 - real_tokens / padded_tokens,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        summary = tf.Summary(value=[tf.Summary.Value(tag='throughput/' + name, simple_value=value)
+                                    for name, value in sorted(values.items())])
+        self.writer.add_summary(summary, step)
+
+    def report(self):
+        batch_times = np.array(self.batch_times)
+        run_times = np.array(self.run_times)
+        total_time = batch_times.sum() + run_times.sum()
+
+        def percentiles(times):
+            return {'mean': float(times.mean()),
+                    'p50': float(np.percentile(times, 50)),
+                    'p90': float(np.percentile(times, 90)),
+                    'p99': float(np.percentile(times, 99))}
+
+        return {
+            'steps': len(self.run_times),
+            'examples': int(sum(self.examples)),
+            'batch_time': percentiles(batch_times),
+            'run_time': percentiles(run_times),
+            'input_fraction': float(batch_times.sum() / total_time),
+            'examples_per_sec': float(sum(self.examples) / total_time),
+            'tokens_per_sec': float(sum(self.real_tokens) / total_time),
+            'padding_ratio': float(1.0 - sum(self.real_tokens) / sum(self.padded_tokens)),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def write_report(self, path, config):
+        if not self.run_times:
+            return
+
+        report = self.report()
+        report['config'] = vars(config)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+        print('{:.1f} examples/sec, {:.1f} tokens/sec, {:.0%} of step time assembling batches'
+              .format(report['examples_per_sec'], report['tokens_per_sec'], report['input_fraction']))